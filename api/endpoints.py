@@ -2,68 +2,163 @@
 
 Rutas:
   POST /predict        → genera imagen(es)
+  POST /predict/stream → igual, con previews por Server-Sent Events
   GET  /timing-report  → reporte de tiempos
+  POST /admin/profile  → perfila los próximos N requests (torch.profiler)
   GET  /health         → healthcheck
 """
-from __future__ import annotations
+# Sin ``from __future__ import annotations``: FastAPI resuelve las anotaciones
+# de los handlers en los globals del módulo y PredictInput se importa dentro de
+# ``fastapi_app`` (el cuerpo acabaría leyéndose como parámetro de query → 422).
+import os
+from typing import Optional
 
 import modal
 
-from config.infrastructure import app
-
-# Importación lazy del modelo para evitar circular; se resuelve en runtime
-# porque Modal ya lo tiene registrado en el mismo App.
-from model.nova_anime import NovaAnimeModel  # noqa: F401
+from config.constants import (
+    WEB_FUNCTION_TIMEOUT_S,
+    WEB_MAX_CONCURRENT_INPUTS,
+    WEB_MAX_IN_FLIGHT,
+    WEB_REQUEST_TIMEOUT_S,
+    WEB_RETRY_AFTER_S,
+)
+from config.infrastructure import APP_NAME, app, web_image
 
 
 @app.function(
-    timeout=60,
+    image=web_image,
+    timeout=WEB_FUNCTION_TIMEOUT_S,
     secrets=[modal.Secret.from_name("nova-anime-checkpoint")],
 )
+@modal.concurrent(max_inputs=WEB_MAX_CONCURRENT_INPUTS)
 @modal.asgi_app()
 def fastapi_app():
     """Crea y devuelve la aplicación FastAPI.
 
     Los imports de fastapi y pydantic se hacen dentro de la función
     porque solo están disponibles dentro del contenedor Modal.
+
+    El tier web corre en ``web_image`` (sin torch ni diffusers) y no importa
+    ``model.nova_anime``: llega a la clase GPU por nombre con
+    ``modal.Cls.from_name``, que solo resuelve la app desplegada.
+
+    Los handlers usan las llamadas async de Modal (``.remote.aio``) para no
+    bloquear el event loop. Con más de ``WEB_MAX_IN_FLIGHT`` generaciones en
+    curso se responde 429 con ``Retry-After``; una generación que no termina en
+    ``WEB_REQUEST_TIMEOUT_S`` devuelve 504 (en ``/predict/stream``, un evento
+    ``error`` al vencer el plazo total del stream).
     """
-    from fastapi import FastAPI, HTTPException
-    from fastapi.responses import Response
+    import asyncio
+
+    from fastapi import FastAPI, Header, HTTPException
+    from fastapi.responses import Response, StreamingResponse
 
-    from api.schemas import PredictInput
+    from api.schemas import PredictInput, PredictStreamInput
+    from core.image_encoder import media_type_for
+    from core.profiling import stage_headers
 
     app_fastapi = FastAPI(title="Nova Anime IL XL", version="1.0")
 
+    _model_cls = None
+
+    def _model():
+        """Handle remoto de la clase GPU (se resuelve la primera vez que se usa)."""
+        nonlocal _model_cls
+        if _model_cls is None:
+            _model_cls = modal.Cls.from_name(APP_NAME, "NovaAnimeModel")
+        return _model_cls()
+
+    max_in_flight = int(os.environ.get("NOVA_WEB_MAX_IN_FLIGHT", WEB_MAX_IN_FLIGHT))
+    in_flight = 0
+
+    def _acquire() -> None:
+        """Reserva un hueco de generación o rechaza con 429 (todo en el event loop)."""
+        nonlocal in_flight
+        if in_flight >= max_in_flight:
+            raise HTTPException(
+                status_code=429,
+                detail=f"Demasiadas generaciones en curso ({in_flight}); reintenta más tarde",
+                headers={"Retry-After": str(WEB_RETRY_AFTER_S)},
+            )
+        in_flight += 1
+
+    def _release() -> None:
+        nonlocal in_flight
+        in_flight -= 1
+
+    class _SlotStreamingResponse(StreamingResponse):
+        """Libera el hueco de generación al terminar la respuesta.
+
+        El ``finally`` del generador no basta: si el cliente se desconecta
+        antes de que empiece el stream, el generador nunca arranca.
+        """
+
+        async def __call__(self, scope, receive, send) -> None:
+            try:
+                await super().__call__(scope, receive, send)
+            finally:
+                _release()
+
+    async def _call(method, **kwargs):
+        """``method.remote.aio`` acotado por ``WEB_REQUEST_TIMEOUT_S`` (504 al vencer)."""
+        try:
+            return await asyncio.wait_for(
+                method.remote.aio(**kwargs), timeout=WEB_REQUEST_TIMEOUT_S
+            )
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=504,
+                detail=f"La generación superó {WEB_REQUEST_TIMEOUT_S}s",
+            ) from None
+
+    def _model_kwargs(body: PredictInput) -> dict:
+        """Campos del esquema HTTP → argumentos de ``NovaAnimeModel.predict``."""
+        return dict(
+            prompt=body.prompt,
+            prepend_preprompt=body.prepend_preprompt,
+            negative_prompt=body.negative_prompt,
+            num_inference_steps=body.steps,
+            scheduler=body.scheduler,
+            guidance_scale=body.cfg_scale,
+            guidance_rescale=body.guidance_rescale,
+            clip_skip=body.clip_skip,
+            pag_scale=body.pag_scale,
+            cfg_end=body.cfg_end,
+            pag_end=body.pag_end,
+            width=body.width,
+            height=body.height,
+            seed=body.seed if body.seed != -1 else None,
+            num_outputs=body.batch_size,
+            face_yolov9c=body.face_yolov9c,
+            hand_yolov9c=body.hand_yolov9c,
+            person_yolov8m_seg=body.person_yolov8m_seg,
+            output_format=body.output_format,
+            output_quality=body.output_quality,
+            png_compress_level=body.png_compress_level,
+            snap_to_bucket=body.snap_to_bucket,
+            resize_back=body.resize_back,
+            feature_cache_interval=body.feature_cache_interval,
+        )
+
     @app_fastapi.post("/predict")
     async def predict(body: PredictInput):
-        """Genera imagen(es) a partir del prompt y devuelve PNG o JSON con base64."""
+        """Genera imagen(es) a partir del prompt y devuelve la imagen o JSON con base64."""
+        _acquire()
         try:
-            images, timings = NovaAnimeModel().predict.remote(
-                prompt=body.prompt,
-                prepend_preprompt=body.prepend_preprompt,
-                negative_prompt=body.negative_prompt,
-                num_inference_steps=body.steps,
-                guidance_scale=body.cfg_scale,
-                guidance_rescale=body.guidance_rescale,
-                clip_skip=body.clip_skip,
-                pag_scale=body.pag_scale,
-                width=body.width,
-                height=body.height,
-                seed=body.seed if body.seed != -1 else None,
-                num_outputs=body.batch_size,
-                face_yolov9c=body.face_yolov9c,
-                hand_yolov9c=body.hand_yolov9c,
-                person_yolov8m_seg=body.person_yolov8m_seg,
-            )
+            images, timings = await _call(_model().predict, **_model_kwargs(body))
             headers = {
                 "X-Inference-Seconds": str(timings["inference_seconds"]),
                 "X-Cold-Start-Seconds": str(timings["cold_start_seconds"]),
                 "X-Request-Number": str(timings["request_number"]),
+                "X-Result-Cache": str(timings.get("result_cache", "bypass")),
+                **stage_headers(timings),
             }
-            # Una sola imagen → respuesta binaria PNG directa
+            # Una sola imagen → respuesta binaria directa
             if len(images) == 1:
                 return Response(
-                    content=images[0], media_type="image/png", headers=headers
+                    content=images[0],
+                    media_type=media_type_for(body.output_format),
+                    headers=headers,
                 )
             # Múltiples imágenes → JSON con base64
             import base64
@@ -73,19 +168,98 @@ def fastapi_app():
             return JSONResponse(
                 content={
                     "images": [base64.b64encode(img).decode() for img in images],
+                    "format": body.output_format,
                     "timings": timings,
                 },
                 headers=headers,
             )
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
+        finally:
+            _release()
+
+    @app_fastapi.post("/predict/stream")
+    async def predict_stream(body: PredictStreamInput):
+        """Genera con previews por SSE.
+
+        Eventos: ``status`` (fase), ``preview`` (JPEG base64 de baja resolución
+        cada ``preview_every`` pasos) y al final ``result`` (imágenes base64 +
+        timings) o ``error``.
+        """
+        import base64
+        import json
+
+        def _sse(event: str, data: dict) -> str:
+            return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+        async def events(stream):
+            # Plazo total del stream: el mismo que una generación sin previews
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + WEB_REQUEST_TIMEOUT_S
+            try:
+                while True:
+                    remaining = deadline - loop.time()
+                    try:
+                        ev = await asyncio.wait_for(anext(stream), timeout=max(remaining, 0))
+                    except StopAsyncIteration:
+                        break
+                    kind = ev.pop("event")
+                    if kind == "preview":
+                        ev["image"] = base64.b64encode(ev["image"]).decode()
+                    elif kind == "result":
+                        ev["images"] = [base64.b64encode(b).decode() for b in ev["images"]]
+                        ev["format"] = body.output_format
+                    yield _sse(kind, ev)
+            except asyncio.TimeoutError:
+                yield _sse("error", {"detail": f"La generación superó {WEB_REQUEST_TIMEOUT_S}s"})
+            except Exception as e:
+                yield _sse("error", {"detail": str(e)})
+            finally:
+                await stream.aclose()
+
+        _acquire()
+        try:
+            stream = _model().predict_stream.remote_gen.aio(
+                preview_every=body.preview_every, **_model_kwargs(body)
+            )
+            return _SlotStreamingResponse(
+                events(stream),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+        except Exception as e:
+            # Sin respuesta no hay quien libere el hueco
+            _release()
+            raise HTTPException(status_code=500, detail=str(e))
 
     @app_fastapi.get("/timing-report")
     async def timing_report():
         """Devuelve el reporte de tiempos acumulados (cold start, inferencia)."""
         try:
-            report = NovaAnimeModel().get_timing_report.remote()
+            report = await _call(_model().get_timing_report)
             return Response(content=report, media_type="text/plain; charset=utf-8")
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    @app_fastapi.post("/admin/profile")
+    async def admin_profile(
+        requests: int = 1, x_admin_token: Optional[str] = Header(default=None)
+    ):
+        """Activa torch.profiler para los próximos N requests (trazas en el Volume).
+
+        Si existe ``NOVA_ADMIN_TOKEN`` se exige en la cabecera ``X-Admin-Token``.
+        """
+        token = os.environ.get("NOVA_ADMIN_TOKEN")
+        if token and x_admin_token != token:
+            raise HTTPException(status_code=403, detail="Token de admin inválido")
+        try:
+            return await _call(_model().enable_profiler, num_requests=requests)
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
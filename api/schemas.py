@@ -1,18 +1,25 @@
 """Esquemas Pydantic para la API HTTP (estilo Replicate)."""
 from __future__ import annotations
 
-from typing import Optional
+from typing import Literal, Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 
 from config.constants import (
+    DEFAULT_CFG_END,
     DEFAULT_CLIP_SKIP,
+    DEFAULT_FEATURE_CACHE_INTERVAL,
     DEFAULT_GUIDANCE,
     DEFAULT_GUIDANCE_RESCALE,
     DEFAULT_HEIGHT,
-    DEFAULT_STEPS,
+    DEFAULT_OUTPUT_FORMAT,
+    DEFAULT_OUTPUT_QUALITY,
+    DEFAULT_PAG_END,
+    DEFAULT_PNG_COMPRESS_LEVEL,
     DEFAULT_WIDTH,
+    PREVIEW_EVERY_STEPS,
 )
+from core.schedulers import DEFAULT_SCHEDULER, SCHEDULER_NAMES, normalize_scheduler_name
 
 
 class PredictInput(BaseModel):
@@ -23,7 +30,7 @@ class PredictInput(BaseModel):
 
     prompt: str = Field(
         ...,
-        description="Prompt de generación; acepta sintaxis Compel (word:1.2)",
+        description="Prompt de generación; acepta pesos (word:1.2), [word] y BREAK",
     )
     negative_prompt: Optional[str] = Field(
         None, description="Prompt negativo (cosas que no quieres en la imagen)"
@@ -43,19 +50,66 @@ class PredictInput(BaseModel):
     pag_scale: float = Field(
         1.5, ge=0.0, le=50.0, description="PAG scale; 0 = desactivado, 1.5 = default"
     )
+    cfg_end: float = Field(
+        DEFAULT_CFG_END,
+        ge=0.0,
+        le=1.0,
+        description="Fracción de pasos con CFG; después solo la rama condicional (0.8 recomendado)",
+    )
+    pag_end: float = Field(
+        DEFAULT_PAG_END, ge=0.0, le=1.0, description="Fracción de pasos con PAG"
+    )
     clip_skip: Optional[int] = Field(
         DEFAULT_CLIP_SKIP, ge=1, description="Capas de CLIP a saltar"
     )
     width: int = Field(DEFAULT_WIDTH, ge=1, le=4096)
     height: int = Field(DEFAULT_HEIGHT, ge=1, le=4096)
+    snap_to_bucket: bool = Field(
+        False, description="Generar en el bucket SDXL nativo más cercano (~1 MP, múltiplo de 64)"
+    )
+    resize_back: bool = Field(
+        False, description="Con snap_to_bucket, redimensionar la salida al tamaño pedido"
+    )
     prepend_preprompt: bool = Field(
         True,
         description="Anteponer preprompt Replicate (masterpiece, best quality, ...)",
     )
-    scheduler: Optional[str] = Field("Euler a", description="Scheduler (Euler a)")
-    steps: int = Field(DEFAULT_STEPS, ge=1, le=100)
+    scheduler: Optional[str] = Field(
+        DEFAULT_SCHEDULER, description=f"Scheduler: {', '.join(SCHEDULER_NAMES)}"
+    )
+    steps: Optional[int] = Field(
+        None, ge=1, le=100, description="Pasos; None = default del scheduler (Euler a: 30)"
+    )
+    feature_cache_interval: int = Field(
+        DEFAULT_FEATURE_CACHE_INTERVAL,
+        ge=1,
+        le=10,
+        description="Modo rápido: UNet completo cada N pasos (1 = desactivado, 3 recomendado)",
+    )
     batch_size: int = Field(1, ge=1, le=4, description="Número de imágenes")
     seed: Optional[int] = Field(-1, description="-1 = aleatorio")
     face_yolov9c: bool = Field(True, description="Refinado de caras ADetailer")
     hand_yolov9c: bool = Field(False, description="ADetailer manos (aceptado, no implementado)")
     person_yolov8m_seg: bool = Field(False, description="ADetailer persona (aceptado, no implementado)")
+    output_format: Literal["png", "webp", "jpeg"] = Field(
+        DEFAULT_OUTPUT_FORMAT, description="Formato de salida: png | webp | jpeg"
+    )
+    output_quality: int = Field(
+        DEFAULT_OUTPUT_QUALITY, ge=1, le=100, description="Calidad WebP/JPEG"
+    )
+    png_compress_level: int = Field(
+        DEFAULT_PNG_COMPRESS_LEVEL, ge=0, le=9, description="Compresión zlib del PNG"
+    )
+
+    @field_validator("scheduler")
+    @classmethod
+    def _valid_scheduler(cls, v: Optional[str]) -> str:
+        return normalize_scheduler_name(v)
+
+
+class PredictStreamInput(PredictInput):
+    """Esquema de entrada para /predict/stream (SSE con previews)."""
+
+    preview_every: int = Field(
+        PREVIEW_EVERY_STEPS, ge=1, le=50, description="Un preview cada K pasos"
+    )
@@ -29,8 +29,9 @@ from config.constants import (
     DEFAULT_CLIP_SKIP,
     DEFAULT_GUIDANCE,
     DEFAULT_GUIDANCE_RESCALE,
-    DEFAULT_STEPS,
+    DEFAULT_USER_NEGATIVE,
 )
+from core.image_encoder import extension_for
 
 # Carpeta por defecto para guardar resultados (project root / outputs)
 _DEFAULT_OUTPUTS_DIR = str(Path(__file__).resolve().parent / "outputs")
@@ -40,12 +41,14 @@ _DEFAULT_OUTPUTS_DIR = str(Path(__file__).resolve().parent / "outputs")
 def main(
     prompt: str = "street, 1girl, dark-purple short hair, purple eyes, medium breasts, cleavage, casual clothes, smile",
     prepend_preprompt: bool = True,
-    negative_prompt: Optional[str] = "nsfw, naked",
-    steps: int = DEFAULT_STEPS,
+    negative_prompt: Optional[str] = DEFAULT_USER_NEGATIVE,
+    steps: Optional[int] = None,  # None = default del scheduler
+    scheduler: str = "Euler a",
     cfg_scale: float = DEFAULT_GUIDANCE,
     guidance_rescale: float = DEFAULT_GUIDANCE_RESCALE,
     clip_skip: Optional[int] = DEFAULT_CLIP_SKIP,
     seed: Optional[int] = None,
+    output_format: str = "png",
     save_dir: str = _DEFAULT_OUTPUTS_DIR,
     show_report: bool = True,
 ) -> None:
@@ -57,17 +60,19 @@ def main(
         prepend_preprompt=prepend_preprompt,
         negative_prompt=negative_prompt,
         num_inference_steps=steps,
+        scheduler=scheduler,
         guidance_scale=cfg_scale,
         guidance_rescale=guidance_rescale,
         clip_skip=clip_skip,
         seed=seed,
+        output_format=output_format,
     )
 
     total_seconds = time.perf_counter() - t0_total
     path = Path(save_dir)
     path.mkdir(parents=True, exist_ok=True)
     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    out_path = path / f"output_{ts}.png"
+    out_path = path / f"output_{ts}.{extension_for(output_format)}"
     out_path.write_bytes(out_bytes)
 
     print(f"Guardado en {out_path}")
@@ -1,12 +1,18 @@
 """Configuración: constantes e infraestructura de Modal."""
 from config.constants import *  # noqa: F401,F403
 from config.infrastructure import (  # noqa: F401
+    APP_NAME,
     CACHE_DIR,
+    CHECKPOINT_MANIFEST_PATH,
+    CONVERTED_CACHE_DIR,
     LOCAL_CHECKPOINT_IN_IMAGE,
     MODEL_CACHE_DIR,
-    TIMING_REPORT_PATH,
+    PROFILES_DIR,
+    RESULT_CACHE_DIR,
+    TIMING_DIR,
     VAE_CACHE_DIR,
     app,
     nova_image,
     volume,
+    web_image,
 )
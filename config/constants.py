@@ -7,9 +7,20 @@ Referencia: https://civitai.com/models/376130?modelVersionId=1500882
 DEFAULT_STEPS = 30
 DEFAULT_GUIDANCE = 5.0          # CFG scale; 4–6 recomendado para Illustrious
 DEFAULT_GUIDANCE_RESCALE = 0.0  # 0.0 = CFG estándar (NO usar 1.0, anula el CFG y causa borroneo)
+DEFAULT_CFG_END = 1.0          # Fracción de pasos con CFG; después solo rama condicional
+DEFAULT_PAG_END = 1.0          # Fracción de pasos con PAG
 DEFAULT_CLIP_SKIP = 2
 DEFAULT_WIDTH = 1024
 DEFAULT_HEIGHT = 1024
+DEFAULT_FEATURE_CACHE_INTERVAL = 1  # UNet completo cada N pasos; 1 = desactivado (DeepCache)
+
+# --- Descarga del checkpoint (core/downloader.py) ---
+DOWNLOAD_CHUNK_MB = 64   # Trozo por petición Range; también la granularidad al reanudar
+DOWNLOAD_WORKERS = 8     # Peticiones Range simultáneas
+DOWNLOAD_RETRIES = 3     # Reintentos por trozo (backoff exponencial)
+
+# --- Carga del modelo ---
+PARALLEL_LOAD_WORKERS = 4  # Hilos de lectura de componentes (UNet, text encoders, VAE, ...)
 
 # --- VAE ---
 SDXL_VAE_HF_ID = "madebyollin/sdxl-vae-fp16-fix"
@@ -39,10 +50,66 @@ DEFAULT_NEGATIVE = (
     "conjoined, bad ai-generated"
 )
 
+# Negative del usuario por defecto en el entrypoint local (app.py). Con prepend
+# va detrás de REPLICATE_PRE_NEGATIVE; ``load`` precalcula esos chunks.
+DEFAULT_USER_NEGATIVE = "nsfw, naked"
+
 # --- Límites CLIP para prompts largos ---
 CLIP_MAX_LENGTH = 77
 CONTENT_TOKENS_PER_CHUNK = 75
 
+# --- Cache de embeddings de prompt (GPU, LRU) ---
+PROMPT_EMBED_CACHE_MAX_MB = 512  # Override: env PROMPT_EMBED_CACHE_MB
+CHUNK_EMBED_CACHE_MAX_MB = 256   # Override: env CHUNK_EMBED_CACHE_MB
+
+# --- Cache de resultados (requests con seed fija) ---
+RESULT_CACHE_MAX_MB = 2048   # Tamaño máx. en el Volume (LRU). Override: env RESULT_CACHE_MB
+RESULT_CACHE_MEMORY_MB = 128 # Hot set en memoria por contenedor
+
+# --- Formato de salida ---
+DEFAULT_OUTPUT_FORMAT = "png"     # png | webp | jpeg
+DEFAULT_OUTPUT_QUALITY = 90       # Calidad WebP/JPEG (1–100)
+DEFAULT_PNG_COMPRESS_LEVEL = 1    # zlib 0–9; 1 ≈ mucho más rápido que 6 y sigue siendo sin pérdida
+IMAGE_ENCODE_WORKERS = 4          # Hilos para codificar imágenes en paralelo
+
+# --- Previews en streaming (/predict/stream) ---
+PREVIEW_EVERY_STEPS = 5     # Un preview cada K pasos de denoising
+PREVIEW_MAX_SIZE = 256      # Lado máximo del JPEG de preview
+PREVIEW_JPEG_QUALITY = 70
+
+# --- Refinado de caras (crop + upscale, estilo ADetailer) ---
+FACE_REFINE_RESOLUTION = 768  # Lado del crop de trabajo para el inpainting
+FACE_MASK_PADDING = 0.35      # Expansión del bbox de la cara para la máscara
+FACE_CROP_CONTEXT = 1.5       # Lado del crop respecto a la máscara (contexto alrededor)
+FACE_MASK_FEATHER = 0.2       # Fracción del radio de la elipse que se funde al pegar
+FACE_REFINE_MAX_BATCH = 8     # Crops por llamada de inpainting (todas las caras del request)
+
+# --- Plan de memoria (VAE tiling/slicing, attention slicing) ---
+MEMORY_ACTIVATION_BUDGET_GB = 20  # Activaciones por batch en A100-40GB. Env NOVA_ACTIVATION_BUDGET_GB
+
+# --- Batching dinámico entre requests (NovaAnimeModel) ---
+MAX_CONCURRENT_INPUTS = 8  # Inputs concurrentes por contenedor (@modal.concurrent)
+BATCH_MAX_SIZE = 4         # Máx. imágenes por batch de UNet; 1 = sin batching. Env NOVA_BATCH_MAX_SIZE
+BATCH_MAX_WAIT_MS = 40     # Ventana de espera para agrupar. Env NOVA_BATCH_MAX_WAIT_MS
+
+# --- Pipeline por etapas tras el denoising (detección → inpainting → codificación) ---
+POSTPROCESS_QUEUE_SIZE = 8  # Requests que pueden esperar a la entrada de cada etapa
+FACE_DETECT_WORKERS = 2     # Hilos CPU de detección de caras
+FINALIZE_WORKERS = 2        # Hilos CPU de pegado, resize y codificación
+
+# --- Tier web (fastapi_app) ---
+WEB_FUNCTION_TIMEOUT_S = 60      # timeout de la web function de Modal
+WEB_REQUEST_TIMEOUT_S = 55       # Espera máx. por generación → 504 (margen bajo el timeout)
+WEB_MAX_CONCURRENT_INPUTS = 100  # Requests HTTP simultáneos por contenedor web
+# Generaciones en curso por contenedor web; más → 429. Env NOVA_WEB_MAX_IN_FLIGHT
+WEB_MAX_IN_FLIGHT = 32
+WEB_RETRY_AFTER_S = 5            # Cabecera Retry-After de las respuestas 429
+
+# --- Métricas de tiempos (MetricsWriter) ---
+METRICS_FLUSH_INTERVAL_S = 30    # Volcado + commit del Volume como mucho cada N segundos
+METRICS_FLUSH_MAX_RECORDS = 32   # ...o antes, al acumular N registros
+INFERENCE_TIMES_WINDOW = 1000    # Tiempos recientes guardados en memoria por contenedor
+
 # --- Identificadores CivitAI ---
 CIVITAI_MODEL_ID = "376130"
 CIVITAI_VERSION_ID = "1500882"
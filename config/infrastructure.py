@@ -3,12 +3,18 @@ from pathlib import Path
 
 import modal
 
+APP_NAME = "nova-anime-ilxl"
+
 # --- Rutas internas del contenedor ---
 LOCAL_CHECKPOINT_IN_IMAGE = "/opt/checkpoint/model.safetensors"
 CACHE_DIR = "/cache"
 MODEL_CACHE_DIR = "/cache/checkpoint"
+CHECKPOINT_MANIFEST_PATH = "/cache/checkpoint/manifest.json"  # Origen, tamaño, mtime y sha256
 VAE_CACHE_DIR = "/cache/vae"
-TIMING_REPORT_PATH = "/cache/nova_anime_timing_report.txt"
+CONVERTED_CACHE_DIR = "/cache/converted"  # Pipelines diffusers convertidos, por sha256
+RESULT_CACHE_DIR = "/cache/results"  # Imágenes codificadas por hash de parámetros (seed fija)
+PROFILES_DIR = "/cache/profiles"  # Trazas Chrome de torch.profiler (bajo demanda)
+TIMING_DIR = "/cache/timing"  # JSONL + agregados de tiempos, un par de archivos por contenedor
 
 # --- Imagen Docker con CUDA + dependencias ---
 CUDA_VERSION = "12.4.0"
@@ -30,9 +36,9 @@ nova_image = (
         "safetensors>=0.4.4",
         "huggingface-hub>=0.25.0",
         "hf_transfer>=0.1.0",
-        "compel>=2.0.0",
         "opencv-python-headless>=4.8.0",
         "Pillow>=10.0.0",
+        "torchsde>=0.2.6",  # DPM++ SDE Karras
         "fastapi[standard]>=0.115.0",
         "pydantic>=2.0",
     )
@@ -52,18 +58,56 @@ nova_image = (
     .add_local_file("api/endpoints.py", "/root/api/endpoints.py")
     .add_local_file("api/schemas.py", "/root/api/schemas.py")
     .add_local_file("core/__init__.py", "/root/core/__init__.py")
+    .add_local_file("core/batcher.py", "/root/core/batcher.py")
+    .add_local_file("core/buckets.py", "/root/core/buckets.py")
     .add_local_file("core/checkpoint.py", "/root/core/checkpoint.py")
+    .add_local_file("core/converted_cache.py", "/root/core/converted_cache.py")
+    .add_local_file("core/downloader.py", "/root/core/downloader.py")
+    .add_local_file("core/embedding_cache.py", "/root/core/embedding_cache.py")
     .add_local_file("core/face_refiner.py", "/root/core/face_refiner.py")
+    .add_local_file("core/feature_cache.py", "/root/core/feature_cache.py")
+    .add_local_file("core/guidance.py", "/root/core/guidance.py")
+    .add_local_file("core/image_encoder.py", "/root/core/image_encoder.py")
+    .add_local_file("core/memory_planner.py", "/root/core/memory_planner.py")
+    .add_local_file("core/metrics.py", "/root/core/metrics.py")
+    .add_local_file("core/parallel_loader.py", "/root/core/parallel_loader.py")
+    .add_local_file("core/previews.py", "/root/core/previews.py")
+    .add_local_file("core/profiling.py", "/root/core/profiling.py")
+    .add_local_file("core/result_cache.py", "/root/core/result_cache.py")
+    .add_local_file("core/schedulers.py", "/root/core/schedulers.py")
+    .add_local_file("core/stage_pipeline.py", "/root/core/stage_pipeline.py")
     .add_local_file("core/prompt_encoder.py", "/root/core/prompt_encoder.py")
     .add_local_file("model/__init__.py", "/root/model/__init__.py")
     .add_local_file("model/nova_anime.py", "/root/model/nova_anime.py")
 )
 
+# --- Imagen ligera del tier web (fastapi_app): sin CUDA, torch ni diffusers ---
+# Solo reenvía requests a NovaAnimeModel (modal.Cls.from_name), así que arranca
+# en frío mucho más rápido que la imagen GPU.
+web_image = (
+    modal.Image.debian_slim(python_version=PYTHON_VERSION)
+    .pip_install(
+        "fastapi[standard]>=0.115.0",
+        "pydantic>=2.0",
+    )
+    .env({"PYTHONPATH": "/root"})
+    .add_local_file("config/__init__.py", "/root/config/__init__.py")
+    .add_local_file("config/constants.py", "/root/config/constants.py")
+    .add_local_file("config/infrastructure.py", "/root/config/infrastructure.py")
+    .add_local_file("api/__init__.py", "/root/api/__init__.py")
+    .add_local_file("api/endpoints.py", "/root/api/endpoints.py")
+    .add_local_file("api/schemas.py", "/root/api/schemas.py")
+    .add_local_file("core/__init__.py", "/root/core/__init__.py")
+    .add_local_file("core/image_encoder.py", "/root/core/image_encoder.py")
+    .add_local_file("core/profiling.py", "/root/core/profiling.py")
+    .add_local_file("core/schedulers.py", "/root/core/schedulers.py")
+)
+
 # Si existe un checkpoint local, se embebe en la imagen Docker
 _local_ckpt = Path(__file__).resolve().parent.parent / "checkpoint" / "novaAnimeXL_ilV5b.safetensors"
 if _local_ckpt.exists():
     nova_image = nova_image.add_local_file(str(_local_ckpt), LOCAL_CHECKPOINT_IN_IMAGE)
 
 # --- App y Volume de Modal ---
-app = modal.App("nova-anime-ilxl", image=nova_image)
+app = modal.App(APP_NAME, image=nova_image)
 volume = modal.Volume.from_name("nova-anime-cache", create_if_missing=True)
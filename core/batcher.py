@@ -0,0 +1,175 @@
+"""Batching dinámico entre requests concurrentes.
+
+``RequestBatcher`` agrupa trabajos que comparten clave (p. ej. tamaño, pasos,
+PAG on/off) dentro de una ventana de espera corta y los ejecuta juntos con una
+única llamada a ``run_batch``. Cada llamante recibe un ``Future`` con su parte
+del resultado. No depende de torch: se puede probar en CPU con un pipeline falso.
+
+``PerSampleScale`` permite pasar un guidance/PAG scale distinto por fila del
+batch a los pipelines de diffusers, que solo aceptan un escalar.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable, Sequence
+
+
+class RequestBatcher:
+    """Agrupa trabajos con la misma clave y los ejecuta en un hilo de fondo.
+
+    Args:
+        run_batch: Recibe la lista de trabajos del batch y devuelve una lista de
+            resultados en el mismo orden.
+        max_batch: Máximo de filas por batch (suma de ``size_of`` de los trabajos).
+        max_wait_s: Tiempo máximo que espera el primer trabajo de un grupo a que
+            lleguen otros compatibles.
+        size_of: Filas que aporta cada trabajo (p. ej. ``num_outputs``).
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[list[Any]], Sequence[Any]],
+        max_batch: int,
+        max_wait_s: float,
+        size_of: Callable[[Any], int] = lambda _: 1,
+    ) -> None:
+        self.run_batch = run_batch
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait_s = max(0.0, float(max_wait_s))
+        self.size_of = size_of
+        # clave → [(t_encolado, trabajo, future), ...] en orden de llegada
+        self._pending: OrderedDict[Hashable, list[tuple[float, Any, Future]]] = (
+            OrderedDict()
+        )
+        self._cv = threading.Condition()
+        self._closed = False
+        self._worker = threading.Thread(
+            target=self._loop, name="request-batcher", daemon=True
+        )
+        self._worker.start()
+
+    def submit(self, key: Hashable, job: Any) -> Future:
+        """Encola un trabajo y devuelve un Future con su resultado."""
+        fut: Future = Future()
+        with self._cv:
+            if self._closed:
+                raise RuntimeError("RequestBatcher cerrado")
+            self._pending.setdefault(key, []).append((time.monotonic(), job, fut))
+            self._cv.notify()
+        return fut
+
+    def close(self) -> None:
+        """Detiene el hilo de fondo tras vaciar lo pendiente."""
+        with self._cv:
+            self._closed = True
+            self._cv.notify()
+        self._worker.join()
+
+    def _rows(self, items: list[tuple[float, Any, Future]]) -> int:
+        return sum(self.size_of(job) for _, job, _ in items)
+
+    def _take_ready(self) -> list[tuple[float, Any, Future]]:
+        """Espera (con el lock tomado) hasta que un grupo esté listo y lo extrae."""
+        while True:
+            if not self._pending:
+                if self._closed:
+                    return []
+                self._cv.wait()
+                continue
+            now = time.monotonic()
+            deadline = None
+            for key, items in self._pending.items():
+                expires = items[0][0] + self.max_wait_s
+                if self._closed or self._rows(items) >= self.max_batch or now >= expires:
+                    return self._pop_batch(key)
+                deadline = expires if deadline is None else min(deadline, expires)
+            self._cv.wait(timeout=max(0.0, deadline - now))
+
+    def _pop_batch(self, key: Hashable) -> list[tuple[float, Any, Future]]:
+        """Extrae del grupo ``key`` tantos trabajos como quepan en ``max_batch``."""
+        items = self._pending[key]
+        batch: list[tuple[float, Any, Future]] = []
+        rows = 0
+        while items:
+            size = self.size_of(items[0][1])
+            if batch and rows + size > self.max_batch:
+                break
+            batch.append(items.pop(0))
+            rows += size
+        if not items:
+            del self._pending[key]
+        return batch
+
+    def _loop(self) -> None:
+        while True:
+            with self._cv:
+                batch = self._take_ready()
+            if not batch:
+                return
+            futures = [fut for _, _, fut in batch]
+            try:
+                results = self.run_batch([job for _, job, _ in batch])
+                for fut, res in zip(futures, results):
+                    fut.set_result(res)
+            except BaseException as e:  # noqa: BLE001 - se propaga a cada llamante
+                for fut in futures:
+                    if not fut.done():
+                        fut.set_exception(e)
+
+
+class PerSampleScale(float):
+    """Escalar de guidance con un valor por fila del batch.
+
+    Se comporta como ``float`` (valor = primera fila) en comparaciones como
+    ``guidance_scale > 1``, pero al multiplicarlo por un tensor, en cualquier
+    orden (``scale * tensor``, ``tensor * scale`` o ``torch.mul``), cada fila
+    del tensor usa su propio valor. diffusers aplica CFG/PAG como
+    ``uncond + scale * (cond - uncond)``. ``scale * tensor`` entra por
+    ``__mul__`` y ``tensor * scale`` por ``__torch_function__``. Cualquier otra
+    operación de torch con un ``PerSampleScale`` lanza ``TypeError`` en vez de
+    usar en silencio el valor de la primera fila.
+    """
+
+    _MUL_OPS = ("mul", "__mul__", "__rmul__")
+
+    def __new__(cls, values: Sequence[float]) -> "PerSampleScale":
+        obj = super().__new__(cls, float(values[0]))
+        obj.values = [float(v) for v in values]
+        return obj
+
+    def _scale_rows(self, tensor):
+        import torch
+
+        scale = torch.tensor(self.values, device=tensor.device, dtype=tensor.dtype)
+        return tensor * scale.view(-1, *([1] * (tensor.ndim - 1)))
+
+    def __mul__(self, other):
+        import torch
+
+        if isinstance(other, torch.Tensor):
+            return self._scale_rows(other)
+        return float(self) * other
+
+    __rmul__ = __mul__
+
+    @classmethod
+    def __torch_function__(cls, func, types, args=(), kwargs=None):
+        import torch
+
+        if getattr(func, "__name__", None) in cls._MUL_OPS and not kwargs and len(args) == 2:
+            a, b = args
+            if isinstance(b, cls) and isinstance(a, torch.Tensor):
+                return b._scale_rows(a)
+            if isinstance(a, cls) and isinstance(b, torch.Tensor):
+                return a._scale_rows(b)
+        raise TypeError(f"PerSampleScale solo admite multiplicación por tensores, no {func}")
+
+
+def per_sample_scale(values: Sequence[float]) -> float:
+    """``float`` si todas las filas comparten valor; ``PerSampleScale`` si no."""
+    if all(v == values[0] for v in values):
+        return float(values[0])
+    return PerSampleScale(values)
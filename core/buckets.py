@@ -0,0 +1,49 @@
+"""Buckets de resolución nativos de SDXL.
+
+SDXL se entrenó con buckets de ~1 MP, múltiplos de 64, para cada aspect ratio.
+Ajustar el tamaño pedido al bucket más cercano da un conjunto pequeño y fijo de
+formas: comparten batch, kernels calentados y claves de cache, y quedan dentro
+de la distribución de entrenamiento.
+"""
+from __future__ import annotations
+
+import math
+
+# (width, height) de los buckets de entrenamiento de SDXL
+SDXL_BUCKETS: tuple[tuple[int, int], ...] = (
+    (512, 2048), (512, 1984), (512, 1920), (512, 1856),
+    (576, 1792), (576, 1728), (576, 1664),
+    (640, 1600), (640, 1536),
+    (704, 1472), (704, 1408), (704, 1344),
+    (768, 1344), (768, 1280),
+    (832, 1216), (832, 1152),
+    (896, 1152), (896, 1088),
+    (960, 1088), (960, 1024),
+    (1024, 1024),
+    (1024, 960),
+    (1088, 960), (1088, 896),
+    (1152, 896), (1152, 832),
+    (1216, 832),
+    (1280, 768), (1344, 768),
+    (1344, 704), (1408, 704), (1472, 704),
+    (1536, 640), (1600, 640),
+    (1664, 576), (1728, 576), (1792, 576),
+    (1856, 512), (1920, 512), (1984, 512), (2048, 512),
+)  # fmt: skip
+
+
+def snap_to_bucket(width: int, height: int) -> tuple[int, int]:
+    """Bucket SDXL más cercano a ``width x height``.
+
+    Prioriza el aspect ratio (distancia en escala log) y desempata por número
+    de píxeles.
+    """
+    target_ratio = math.log(width / height)
+    target_pixels = width * height
+    return min(
+        SDXL_BUCKETS,
+        key=lambda wh: (
+            round(abs(math.log(wh[0] / wh[1]) - target_ratio), 6),
+            abs(wh[0] * wh[1] - target_pixels),
+        ),
+    )
@@ -1,14 +1,140 @@
-"""Resolución del checkpoint: busca el modelo en imagen embebida, env vars, Volume o HuggingFace."""
+"""Resolución del checkpoint: busca el modelo en imagen embebida, env vars, Volume o HuggingFace.
+
+El checkpoint resuelto se apunta en un manifest del Volume (origen, ruta,
+tamaño, mtime y SHA-256). En los arranques siguientes el manifest da la ruta
+sin tocar la red, y ``get_checkpoint_id`` da la identidad del checkpoint para
+las demás caches. El hash solo se recalcula cuando cambian tamaño o mtime; si el
+tamaño de un checkpoint descargado no cuadra con el manifest, o solo cambió el
+mtime y el hash ya no coincide, se considera corrupto y se vuelve a descargar.
+"""
 from __future__ import annotations
 
+import hashlib
+import json
 import os
+import time
+from datetime import datetime, timezone
 from pathlib import Path
+from typing import Optional
+from urllib.parse import parse_qs, urlencode, urlparse, urlunparse
 
 from config.infrastructure import (
+    CHECKPOINT_MANIFEST_PATH,
     LOCAL_CHECKPOINT_IN_IMAGE,
     MODEL_CACHE_DIR,
 )
 
+_HASH_BLOCK = 16 * 1024 * 1024
+
+
+def _read_manifest() -> Optional[dict]:
+    try:
+        return json.loads(Path(CHECKPOINT_MANIFEST_PATH).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(manifest: dict) -> None:
+    """Escritura atómica (tmp + rename) para no dejar JSON truncados."""
+    path = Path(CHECKPOINT_MANIFEST_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    os.replace(tmp, path)
+
+
+def _sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(_HASH_BLOCK):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _remote_source() -> str:
+    """Origen de descarga configurado (sin credenciales), para validar el manifest."""
+    url = os.environ.get("CHECKPOINT_URL")
+    if url:
+        parsed = list(urlparse(url))
+        qs = parse_qs(parsed[4], keep_blank_values=True)
+        qs.pop("token", None)
+        parsed[4] = urlencode(qs, doseq=True)
+        return "url:" + urlunparse(parsed)
+    hf_id = os.environ.get("NOVA_ANIME_HF_ID", "John6666/nova-anime-xl-il-v80-sdxl")
+    return f"hf:{hf_id}/{os.environ.get('NOVA_ANIME_HF_FILENAME') or '*'}"
+
+
+def _is_download(path: str, source: str) -> bool:
+    """Checkpoint descargado por nosotros en el Volume (se puede volver a bajar)."""
+    return path.startswith(MODEL_CACHE_DIR + "/") and source.startswith(("url:", "hf:"))
+
+
+def _record(path: str, source: str, downloaded: bool = False) -> Optional[dict]:
+    """Actualiza el manifest para ``path``; el SHA-256 solo si cambió tamaño o mtime.
+
+    Si solo cambió el mtime (mismo origen, ruta y tamaño) el hash se compara
+    con el del manifest: si coincide se apunta el mtime nuevo y si no, el
+    fichero no es el verificado. Un checkpoint descargado se borra y se
+    devuelve ``None`` para bajarlo de nuevo; cualquier otro es un error.
+    Con ``downloaded`` (recién descargado) el hash es la identidad nueva.
+    """
+    st = os.stat(path)
+    manifest = _read_manifest()
+    same_file = (
+        manifest is not None
+        and manifest.get("path") == path
+        and manifest.get("size") == st.st_size
+    )
+    if same_file and manifest.get("mtime") == st.st_mtime:
+        if manifest.get("source") != source:
+            manifest["source"] = source
+            _write_manifest(manifest)
+        return manifest
+
+    t0 = time.perf_counter()
+    sha256 = _sha256_file(path)
+    print(f"SHA-256 del checkpoint en {time.perf_counter() - t0:.1f}s: {sha256[:16]}…")
+    if same_file and not downloaded and manifest.get("source") == source:
+        if sha256 == manifest.get("sha256"):
+            manifest["mtime"] = st.st_mtime
+            _write_manifest(manifest)
+            return manifest
+        if _is_download(path, source):
+            print(f"Checkpoint corrupto (SHA-256 distinto al manifest): {path}")
+            os.remove(path)
+            return None
+        raise RuntimeError(
+            f"El checkpoint {path} cambió de contenido (SHA-256 {sha256[:16]}… en lugar "
+            f"de {manifest.get('sha256', '')[:16]}…) sin cambiar de tamaño"
+        )
+
+    manifest = {
+        "source": source,
+        "path": path,
+        "size": st.st_size,
+        "mtime": st.st_mtime,
+        "sha256": sha256,
+        "verified_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+    }
+    _write_manifest(manifest)
+    return manifest
+
+
+def get_checkpoint_id(checkpoint_path: Optional[str] = None) -> str:
+    """Identidad del checkpoint (SHA-256) para claves de otras caches.
+
+    Lee el manifest; solo hashea si la ruta no es la del manifest o si
+    cambiaron tamaño o mtime.
+    """
+    path = checkpoint_path or get_checkpoint_path()
+    manifest = _read_manifest() or {}
+    source = manifest.get("source", "local") if manifest.get("path") == path else "local"
+    recorded = _record(path, source)
+    if recorded is None:
+        # Checkpoint descargado y corrupto: volver a resolverlo (lo descarga)
+        return get_checkpoint_id()
+    return recorded["sha256"]
+
 
 def get_checkpoint_path() -> str:
     """Devuelve la ruta al checkpoint del modelo.
@@ -19,63 +145,75 @@ def get_checkpoint_path() -> str:
       3. Checkpoint en el Volume cache (/cache/checkpoint/model.safetensors).
       4. Descarga desde CHECKPOINT_URL (CivitAI con API key).
       5. Descarga desde HuggingFace (fallback público).
+
+    Tras el primer arranque, 3–5 se resuelven en O(1) desde el manifest.
     """
     # 1) Embebido en imagen
     if Path(LOCAL_CHECKPOINT_IN_IMAGE).exists():
-        return LOCAL_CHECKPOINT_IN_IMAGE
+        return _record(LOCAL_CHECKPOINT_IN_IMAGE, "image")["path"]
 
     # 2) Variable de entorno CHECKPOINT_PATH
     path = os.environ.get("CHECKPOINT_PATH")
     if path and Path(path).exists():
-        return path
+        return _record(path, "env")["path"]
+
+    # Camino rápido: el manifest del Volume ya resolvió este origen (sin red)
+    source = _remote_source()
+    manifest = _read_manifest()
+    if manifest and manifest.get("source") == source:
+        resolved = manifest.get("path", "")
+        if Path(resolved).exists():
+            if os.path.getsize(resolved) == manifest.get("size"):
+                recorded = _record(resolved, source)
+                if recorded is not None:
+                    return recorded["path"]
+            elif resolved.startswith(MODEL_CACHE_DIR + "/"):
+                print(f"Checkpoint corrupto (tamaño distinto al manifest): {resolved}")
+                os.remove(resolved)
 
     # 3) Volume cache
     Path(MODEL_CACHE_DIR).mkdir(parents=True, exist_ok=True)
     cached = f"{MODEL_CACHE_DIR}/model.safetensors"
     if Path(cached).exists():
-        return cached
+        recorded = _record(cached, source)
+        if recorded is not None:
+            return recorded["path"]
 
-    # 4) Descarga desde CHECKPOINT_URL (CivitAI)
+    # 4) Descarga desde CHECKPOINT_URL (CivitAI): streaming a .part, trozos Range
+    #    en paralelo, reanudable y con rename atómico al terminar
     url = os.environ.get("CHECKPOINT_URL")
     if url:
-        if not Path(cached).exists():
-            import urllib.request
-
-            api_key = (
-                os.environ.get("CIVITAI_API_KEY")
-                or os.environ.get("CIVITAI_TOKEN")
-                or ""
-            ).strip()
-
-            if api_key and "civitai.com" in url:
-                import urllib.error
-                from urllib.parse import parse_qs, urlencode, urlparse, urlunparse
-
-                parsed = list(urlparse(url))
-                qs = parse_qs(parsed[4], keep_blank_values=True)
-                qs["token"] = [api_key]
-                parsed[4] = urlencode(qs, doseq=True)
-                url_with_token = urlunparse(parsed)
-
-                req = urllib.request.Request(
-                    url_with_token,
-                    headers={"Authorization": f"Bearer {api_key}"},
-                )
-                try:
-                    with urllib.request.urlopen(req, timeout=600) as resp:
-                        Path(cached).write_bytes(resp.read())
-                except urllib.error.HTTPError as e:
-                    if e.code == 403:
-                        raise RuntimeError(
-                            "CivitAI devolvió 403 Forbidden. Comprueba que CIVITAI_API_KEY "
-                            "en el secret 'nova-anime-checkpoint' sea un token válido de "
-                            "https://civitai.com/user/account (Create API Key). "
-                            "Si el modelo requiere login, acepta los términos en la web."
-                        ) from e
-                    raise
-            else:
-                urllib.request.urlretrieve(url, cached)
-        return cached
+        import urllib.error
+
+        from core.downloader import download
+
+        api_key = (
+            os.environ.get("CIVITAI_API_KEY")
+            or os.environ.get("CIVITAI_TOKEN")
+            or ""
+        ).strip()
+
+        headers = {}
+        if api_key and "civitai.com" in url:
+            parsed = list(urlparse(url))
+            qs = parse_qs(parsed[4], keep_blank_values=True)
+            qs["token"] = [api_key]
+            parsed[4] = urlencode(qs, doseq=True)
+            url = urlunparse(parsed)
+            headers["Authorization"] = f"Bearer {api_key}"
+
+        try:
+            download(url, cached, headers=headers)
+        except urllib.error.HTTPError as e:
+            if e.code == 403 and "Authorization" in headers:
+                raise RuntimeError(
+                    "CivitAI devolvió 403 Forbidden. Comprueba que CIVITAI_API_KEY "
+                    "en el secret 'nova-anime-checkpoint' sea un token válido de "
+                    "https://civitai.com/user/account (Create API Key). "
+                    "Si el modelo requiere login, acepta los términos en la web."
+                ) from e
+            raise
+        return _record(cached, source, downloaded=True)["path"]
 
     # 5) Fallback HuggingFace
     hf_id = os.environ.get("NOVA_ANIME_HF_ID", "John6666/nova-anime-xl-il-v80-sdxl")
@@ -90,7 +228,7 @@ def get_checkpoint_path() -> str:
             local_dir=MODEL_CACHE_DIR,
             local_dir_use_symlinks=False,
         )
-        return dest
+        return _record(dest, source, downloaded=True)["path"]
 
     files = list_repo_files(hf_id)
     safetensors = [f for f in files if f.endswith(".safetensors")]
@@ -105,4 +243,4 @@ def get_checkpoint_path() -> str:
         local_dir=MODEL_CACHE_DIR,
         local_dir_use_symlinks=False,
     )
-    return dest
+    return _record(dest, source, downloaded=True)["path"]
@@ -0,0 +1,146 @@
+"""Cache en el Volume del pipeline SDXL convertido a formato diffusers.
+
+``from_single_file`` convierte en cada carga las claves del checkpoint SD
+original a diffusers. La primera carga guarda el pipeline convertido (fp16,
+safetensors en shards) en ``/cache/converted/<sha256-del-checkpoint>/`` y las
+siguientes (incluidos los snapshots nuevos tras un deploy) cargan directamente
+con ``from_pretrained``.
+
+La validez se decide por manifest (tamaño y hash del checkpoint). El hash es
+``get_checkpoint_id`` (manifest del checkpoint): solo se recalcula cuando
+cambian el tamaño o el mtime del archivo.
+"""
+from __future__ import annotations
+
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+from config.infrastructure import CONVERTED_CACHE_DIR
+from core.checkpoint import get_checkpoint_id
+from core.parallel_loader import load_pipeline_parallel
+
+if TYPE_CHECKING:
+    import torch
+    from diffusers import StableDiffusionXLPipeline
+
+MANIFEST_NAME = "manifest.json"
+MAX_SHARD_SIZE = "2GB"
+
+
+def _read_json(path: Path) -> Optional[dict]:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path: Path, data: dict) -> None:
+    """Escritura atómica (tmp + rename) para no dejar JSON truncados."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps(data, indent=2, sort_keys=True))
+    os.replace(tmp, path)
+
+
+def _manifest_for(checkpoint_path: str, sha256: str) -> dict[str, Any]:
+    st = os.stat(checkpoint_path)
+    return {
+        "checkpoint_path": checkpoint_path,
+        "checkpoint_size": st.st_size,
+        "checkpoint_mtime": st.st_mtime,
+        "checkpoint_sha256": sha256,
+    }
+
+
+def _is_valid(converted_dir: Path, checkpoint_path: str, sha256: str) -> bool:
+    manifest = _read_json(converted_dir / MANIFEST_NAME)
+    if not manifest:
+        return False
+    expected = _manifest_for(checkpoint_path, sha256)
+    return (
+        manifest.get("checkpoint_sha256") == expected["checkpoint_sha256"]
+        and manifest.get("checkpoint_size") == expected["checkpoint_size"]
+    )
+
+
+def load_sdxl_pipeline(
+    checkpoint_path: str,
+    torch_dtype: "torch.dtype",
+    vae_loader: Optional[Callable[[], Any]] = None,
+    device: Optional[str] = "cuda",
+) -> tuple["StableDiffusionXLPipeline", str]:
+    """Carga el pipeline txt2img desde la cache convertida o lo convierte y la crea.
+
+    Desde la cache, los safetensors se leen en paralelo directamente a
+    ``device`` y los módulos se construyen en este hilo según terminan
+    (``load_pipeline_parallel``). ``vae_loader`` sustituye al VAE guardado
+    (VAE fp16-fix) y corre en este hilo mientras se lee el resto.
+
+    Returns:
+        (pipeline, origen) con origen ``"converted"`` o ``"single_file"``.
+    """
+    from diffusers import StableDiffusionXLPipeline
+
+    sha256 = get_checkpoint_id(checkpoint_path)
+    converted_dir = Path(CONVERTED_CACHE_DIR) / sha256
+
+    if _is_valid(converted_dir, checkpoint_path, sha256):
+        try:
+            pipe, _ = load_pipeline_parallel(
+                str(converted_dir),
+                torch_dtype=torch_dtype,
+                device=device,
+                overrides={"vae": vae_loader} if vae_loader is not None else None,
+            )
+            return pipe, "converted"
+        except Exception as e:
+            print(f"Cache convertida inválida ({converted_dir}): {e}; reconvirtiendo.")
+
+    kwargs: dict[str, Any] = {}
+    if vae_loader is not None:
+        kwargs["vae"] = vae_loader()
+    pipe = StableDiffusionXLPipeline.from_single_file(
+        checkpoint_path, use_safetensors=True, torch_dtype=torch_dtype, **kwargs
+    )
+    try:
+        save_converted(pipe, checkpoint_path, sha256)
+    except Exception as e:
+        print(f"No se pudo guardar la cache convertida: {e}")
+    if device is not None:
+        pipe = pipe.to(device)
+    return pipe, "single_file"
+
+
+def save_converted(
+    pipe: "StableDiffusionXLPipeline", checkpoint_path: str, sha256: str
+) -> Path:
+    """Guarda el pipeline convertido en ``/cache/converted/<sha256>/``.
+
+    Se escribe en un directorio temporal y se renombra; el manifest se escribe
+    al final, así que un guardado interrumpido nunca se considera válido.
+    """
+    import diffusers
+
+    converted_dir = Path(CONVERTED_CACHE_DIR) / sha256
+    tmp_dir = converted_dir.with_name(f"{sha256}.tmp-{os.getpid()}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    pipe.save_pretrained(
+        str(tmp_dir), safe_serialization=True, max_shard_size=MAX_SHARD_SIZE
+    )
+    shutil.rmtree(converted_dir, ignore_errors=True)
+    os.replace(tmp_dir, converted_dir)
+
+    manifest = _manifest_for(checkpoint_path, sha256)
+    manifest.update(
+        {
+            "dtype": str(pipe.unet.dtype),
+            "diffusers_version": diffusers.__version__,
+            "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+    )
+    _write_json(converted_dir / MANIFEST_NAME, manifest)
+    return converted_dir
@@ -0,0 +1,198 @@
+"""Descarga de ficheros grandes: streaming, en paralelo, reanudable y atómica.
+
+``download`` escribe en ``<dest>.part`` por bloques, nunca el fichero completo
+en RAM. Si el servidor acepta ``Range``, el fichero se parte en trozos de
+``chunk_size`` que se bajan en paralelo y escriben en su offset; los trozos
+terminados se apuntan en ``<dest>.part.json``, así una descarga interrumpida
+continúa donde se quedó. Si un trozo falla tras sus reintentos, los pendientes
+se cancelan y los que están en curso se cortan en el siguiente bloque. Al
+terminar, ``os.replace`` mueve el ``.part`` al destino: un cold start nunca ve
+un checkpoint truncado.
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+import time
+import urllib.request
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from typing import Optional
+from urllib.parse import urlparse
+
+from config.constants import DOWNLOAD_CHUNK_MB, DOWNLOAD_RETRIES, DOWNLOAD_WORKERS
+
+# Bloque de lectura/escritura: memoria máxima ≈ workers × BLOCK_SIZE
+BLOCK_SIZE = 1024 * 1024
+
+_CONTENT_RANGE = re.compile(r"bytes\s+\d+-\d+/(\d+)")
+
+
+def _probe(url: str, headers: dict[str, str], timeout: float):
+    """GET de ``bytes=0-0``: (respuesta, tamaño total o None si no hay Range)."""
+    req = urllib.request.Request(url, headers={**headers, "Range": "bytes=0-0"})
+    resp = urllib.request.urlopen(req, timeout=timeout)
+    match = _CONTENT_RANGE.match(resp.headers.get("Content-Range", ""))
+    if resp.status == 206 and match:
+        return resp, int(match.group(1))
+    return resp, None
+
+
+def _load_progress(path: str, total: int, chunk_size: int) -> set[int]:
+    try:
+        with open(path) as f:
+            progress = json.load(f)
+    except (OSError, ValueError):
+        return set()
+    if progress.get("total") != total or progress.get("chunk_size") != chunk_size:
+        return set()
+    return set(progress.get("done", []))
+
+
+def _save_progress(path: str, total: int, chunk_size: int, done: set[int]) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"total": total, "chunk_size": chunk_size, "done": sorted(done)}, f)
+    os.replace(tmp, path)
+
+
+def _stream_to(
+    resp,
+    fd: int,
+    offset: int,
+    expected: Optional[int],
+    stop: Optional[threading.Event] = None,
+) -> int:
+    """Copia la respuesta a ``fd`` desde ``offset`` por bloques; devuelve bytes escritos.
+
+    Con ``stop`` activado se corta antes del siguiente bloque.
+    """
+    written = 0
+    while True:
+        if stop is not None and stop.is_set():
+            raise IOError("Descarga cancelada: falló otro trozo")
+        block = resp.read(BLOCK_SIZE)
+        if not block:
+            break
+        os.pwrite(fd, block, offset + written)
+        written += len(block)
+    if expected is not None and written != expected:
+        raise IOError(f"Descarga incompleta: {written} de {expected} bytes")
+    return written
+
+
+def _fetch_chunk(
+    url: str,
+    headers: dict[str, str],
+    fd: int,
+    start: int,
+    end: int,
+    timeout: float,
+    retries: int,
+    stop: threading.Event,
+) -> None:
+    """Baja ``[start, end]`` (inclusivo) con reintentos y backoff; para si ``stop``."""
+    for attempt in range(retries + 1):
+        try:
+            req = urllib.request.Request(
+                url, headers={**headers, "Range": f"bytes={start}-{end}"}
+            )
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                if resp.status != 206:
+                    raise IOError(f"El servidor ignoró Range (HTTP {resp.status})")
+                _stream_to(resp, fd, start, end - start + 1, stop)
+            return
+        except Exception:
+            if attempt == retries or stop.is_set():
+                raise
+            if stop.wait(2**attempt):
+                raise
+
+
+def download(
+    url: str,
+    dest: str,
+    headers: Optional[dict[str, str]] = None,
+    chunk_size: int = DOWNLOAD_CHUNK_MB * 1024 * 1024,
+    workers: int = DOWNLOAD_WORKERS,
+    retries: int = DOWNLOAD_RETRIES,
+    timeout: float = 600,
+) -> str:
+    """Descarga ``url`` en ``dest`` y devuelve ``dest``.
+
+    Args:
+        url: URL de origen (se siguen redirecciones).
+        dest: Ruta final; solo aparece cuando la descarga está completa.
+        headers: Cabeceras extra (p. ej. ``Authorization``).
+        chunk_size: Tamaño de cada trozo en modo paralelo.
+        workers: Peticiones ``Range`` simultáneas.
+        retries: Reintentos por trozo.
+        timeout: Timeout de socket por petición, en segundos.
+    """
+    headers = dict(headers or {})
+    part = f"{dest}.part"
+    progress_path = f"{part}.json"
+    t0 = time.perf_counter()
+
+    resp, total = _probe(url, headers, timeout)
+    if total is None:
+        # Sin Range: un solo stream secuencial, sin posibilidad de reanudar
+        with resp, open(part, "wb") as f:
+            length = resp.headers.get("Content-Length")
+            written = _stream_to(resp, f.fileno(), 0, int(length) if length else None)
+            f.flush()
+            os.fsync(f.fileno())
+    else:
+        resp.close()
+        # La URL final (CDN firmada tras redirecciones) se usa para los trozos;
+        # la cabecera de autenticación solo va al host original.
+        chunk_url = resp.geturl()
+        if urlparse(chunk_url).netloc != urlparse(url).netloc:
+            headers.pop("Authorization", None)
+
+        done = _load_progress(progress_path, total, chunk_size) if os.path.exists(part) else set()
+        num_chunks = max(1, -(-total // chunk_size))
+        pending = [i for i in range(num_chunks) if i not in done]
+        lock = threading.Lock()
+        stop = threading.Event()
+
+        fd = os.open(part, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, total)
+
+            def fetch(index: int) -> None:
+                start = index * chunk_size
+                end = min(total, start + chunk_size) - 1
+                _fetch_chunk(chunk_url, headers, fd, start, end, timeout, retries, stop)
+                with lock:
+                    done.add(index)
+                    _save_progress(progress_path, total, chunk_size, done)
+
+            pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="download")
+            try:
+                futures = [pool.submit(fetch, i) for i in pending]
+                finished, _ = wait(futures, return_when=FIRST_EXCEPTION)
+                for future in finished:
+                    future.result()
+            finally:
+                # Al primer fallo: sin trozos nuevos y los que están en curso se
+                # cortan en el siguiente bloque (su progreso no se apunta)
+                stop.set()
+                pool.shutdown(wait=True, cancel_futures=True)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        written = total
+        if len(pending) < num_chunks:
+            print(f"Descarga reanudada: {num_chunks - len(pending)}/{num_chunks} trozos previos")
+
+    os.replace(part, dest)
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
+    elapsed = time.perf_counter() - t0
+    print(
+        f"Descargado {dest}: {written / 1e9:.2f} GB en {elapsed:.1f}s "
+        f"({written / 1e6 / max(elapsed, 1e-6):.0f} MB/s)"
+    )
+    return dest
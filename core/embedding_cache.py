@@ -0,0 +1,129 @@
+"""Cache LRU de embeddings de prompt acotado por bytes.
+
+Guarda tuplas de tensores (p. ej. ``(embeds, pooled)``) en GPU, indexadas por una
+clave hashable. Cuando el tamaño total supera ``max_bytes`` se expulsan las
+entradas usadas hace más tiempo. Las entradas fijadas (``pin=True``, p. ej. las
+precalculadas en ``load``) no cuentan para el límite ni se expulsan. Es
+thread-safe y lleva contadores de aciertos, fallos y expulsiones. Los
+contadores globales mezclan requests concurrentes; para los timings de un
+request se usa ``track``, que cuenta solo lo que hace el hilo actual.
+"""
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Hashable, Iterator, Optional
+
+if TYPE_CHECKING:
+    import torch
+
+
+def _tensors_nbytes(tensors: tuple["torch.Tensor", ...]) -> int:
+    """Bytes ocupados por una tupla de tensores."""
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class EmbeddingCache:
+    """Cache LRU de tuplas de tensores con límite de memoria en bytes."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max(0, int(max_bytes))
+        self._entries: OrderedDict[Hashable, tuple["torch.Tensor", ...]] = OrderedDict()
+        self._sizes: dict[Hashable, int] = {}
+        self._pinned: dict[Hashable, tuple["torch.Tensor", ...]] = {}
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._local = threading.local()
+
+    def __len__(self) -> int:
+        return len(self._entries) + len(self._pinned)
+
+    def get(self, key: Hashable) -> Optional[tuple["torch.Tensor", ...]]:
+        """Devuelve la entrada (y la marca como reciente) o None si no existe."""
+        with self._lock:
+            value = self._pinned.get(key)
+            if value is None:
+                value = self._entries.get(key)
+                if value is None:
+                    self.misses += 1
+                    self._count("misses")
+                    return None
+                self._entries.move_to_end(key)
+            self.hits += 1
+            self._count("hits")
+            return value
+
+    def put(
+        self, key: Hashable, value: tuple["torch.Tensor", ...], pin: bool = False
+    ) -> None:
+        """Inserta una entrada y expulsa las menos recientes si se supera el límite.
+
+        Con ``pin=True`` la entrada queda fija fuera del LRU (nunca se expulsa).
+        """
+        if pin:
+            with self._lock:
+                if key in self._entries:
+                    self.current_bytes -= self._sizes.pop(key)
+                    del self._entries[key]
+                self._pinned[key] = value
+            return
+        size = _tensors_nbytes(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._pinned:
+                return
+            if key in self._entries:
+                self.current_bytes -= self._sizes.pop(key)
+                del self._entries[key]
+            self._entries[key] = value
+            self._sizes[key] = size
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes and self._entries:
+                old_key, _ = self._entries.popitem(last=False)
+                self.current_bytes -= self._sizes.pop(old_key)
+                self.evictions += 1
+                self._count("evictions")
+
+    @contextmanager
+    def track(self) -> Iterator[dict[str, int]]:
+        """Cuenta aciertos, fallos y expulsiones del hilo actual dentro del bloque.
+
+        Con ``@modal.concurrent`` cada request corre en su hilo: el dict que se
+        devuelve no incluye lo que hagan los demás requests a la vez.
+        """
+        counts = {"hits": 0, "misses": 0, "evictions": 0}
+        previous = getattr(self._local, "counts", None)
+        self._local.counts = counts
+        try:
+            yield counts
+        finally:
+            self._local.counts = previous
+
+    def _count(self, name: str) -> None:
+        counts = getattr(self._local, "counts", None)
+        if counts is not None:
+            counts[name] += 1
+
+    def clear(self) -> None:
+        """Vacía la parte LRU de la cache (fijadas y contadores se conservan)."""
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        """Contadores acumulados y ocupación actual."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "pinned": len(self._pinned),
+                "bytes": self.current_bytes,
+            }
@@ -1,92 +1,261 @@
 """Refinado de caras con inpainting (estilo ADetailer).
 
-Detecta caras con Haar cascade de OpenCV, genera una máscara elíptica y ejecuta
-inpainting SDXL sobre las regiones detectadas para mejorar la calidad facial.
+Detecta caras con Haar cascade de OpenCV y, por cada una, recorta una caja
+cuadrada con contexto alrededor, la escala a una resolución de trabajo fija,
+hace inpainting SDXL solo sobre ese crop con una máscara elíptica y lo pega de
+vuelta fundiendo el borde. El coste depende del número de caras, no del tamaño
+de la imagen.
+
+Todas las caras de todas las imágenes de un request se refinan juntas: se
+detecta primero en el batch completo, las máscaras se construyen vectorizadas
+y el inpainting corre como un único batch (troceado en ``FACE_REFINE_MAX_BATCH``).
+Detección y pegado son CPU; solo ``inpaint_face_crops`` usa la GPU.
 """
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Optional
+import threading
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, ContextManager, Optional
+
+from config.constants import (
+    FACE_CROP_CONTEXT,
+    FACE_MASK_FEATHER,
+    FACE_MASK_PADDING,
+    FACE_REFINE_MAX_BATCH,
+    FACE_REFINE_RESOLUTION,
+)
 
 if TYPE_CHECKING:
+    import numpy as np
     import torch
     from PIL import Image
+    from diffusers import (
+        SchedulerMixin,
+        StableDiffusionXLInpaintPipeline,
+        StableDiffusionXLPipeline,
+    )
+
+
+Box = tuple[int, int, int, int]  # (x1, y1, x2, y2), x2/y2 exclusivos
+PromptEmbeds = tuple["torch.Tensor", "torch.Tensor", "torch.Tensor", "torch.Tensor"]
+
+# El clasificador se carga del XML una vez por hilo (detectMultiScale no es
+# seguro entre hilos).
+_local = threading.local()
+
+
+@dataclass(frozen=True)
+class FaceCrop:
+    """Cara a refinar: imagen de origen, crop cuadrado y máscara dentro del crop."""
+
+    image_index: int
+    box: Box
+    mask_box: tuple[float, float, float, float]  # en píxeles del crop, sin escalar
+
+    @property
+    def side(self) -> int:
+        return self.box[2] - self.box[0]
+
+
+def build_inpaint_pipeline(
+    pipe: "StableDiffusionXLPipeline", scheduler: "SchedulerMixin"
+) -> "StableDiffusionXLInpaintPipeline":
+    """Pipeline de inpainting sobre los módulos ya cargados de ``pipe``.
+
+    UNet, text encoders, tokenizers y VAE son las mismas instancias que en
+    ``pipe`` (sin segundo parseo del checkpoint ni pesos duplicados en VRAM);
+    solo ``scheduler`` es propio.
+    """
     from diffusers import StableDiffusionXLInpaintPipeline
 
+    pipe_inpaint = StableDiffusionXLInpaintPipeline.from_pipe(pipe, scheduler=scheduler)
+    pipe_inpaint.set_progress_bar_config(disable=True)
+    return pipe_inpaint
+
+
+def _face_cascade():
+    cascade = getattr(_local, "cascade", None)
+    if cascade is None:
+        import cv2
+
+        cascade = cv2.CascadeClassifier(
+            cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+        )
+        _local.cascade = cascade
+    return cascade
+
+
+def detect_faces(image: "Image.Image") -> list[tuple[int, int, int, int]]:
+    """Caras ``(x, y, w, h)`` detectadas con el Haar cascade (cacheado)."""
+    import cv2
+    import numpy as np
+
+    gray = cv2.cvtColor(np.asarray(image.convert("RGB")), cv2.COLOR_RGB2GRAY)
+    faces = _face_cascade().detectMultiScale(
+        gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30)
+    )
+    return [tuple(int(v) for v in face) for face in faces]
+
+
+def mask_box(face: tuple[int, int, int, int], image_size: tuple[int, int]) -> Box:
+    """Bbox de la cara ``(x, y, w, h)`` expandido ~35% para cubrir ojos y pelo."""
+    x, y, bw, bh = (int(v) for v in face)
+    w, h = image_size
+    pad = max(4, int(FACE_MASK_PADDING * max(bw, bh)))
+    return max(0, x - pad), max(0, y - pad), min(w, x + bw + pad), min(h, y + bh + pad)
+
+
+def crop_box(mask: Box, image_size: tuple[int, int]) -> Box:
+    """Caja cuadrada centrada en la máscara, con contexto y dentro de la imagen.
 
-def refine_faces(
+    Si toca un borde se desplaza hacia dentro en lugar de recortarse, así el
+    crop sigue siendo cuadrado y se escala sin deformar.
+    """
+    w, h = image_size
+    x1, y1, x2, y2 = mask
+    side = int(round(max(x2 - x1, y2 - y1) * FACE_CROP_CONTEXT))
+    side = max(8, min(side, w, h))
+    cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+    left = int(round(min(max(cx - side / 2, 0), w - side)))
+    top = int(round(min(max(cy - side / 2, 0), h - side)))
+    return left, top, left + side, top + side
+
+
+def plan_face_crops(
+    image_sizes: list[tuple[int, int]], faces: list[list[tuple[int, int, int, int]]]
+) -> list[FaceCrop]:
+    """Crops de todas las caras de todas las imágenes, en orden (imagen, cara)."""
+    crops = []
+    for index, (size, image_faces) in enumerate(zip(image_sizes, faces)):
+        for face in image_faces:
+            m_box = mask_box(face, size)
+            c_box = crop_box(m_box, size)
+            x0, y0 = c_box[0], c_box[1]
+            local = (m_box[0] - x0, m_box[1] - y0, m_box[2] - x0, m_box[3] - y0)
+            crops.append(FaceCrop(index, c_box, tuple(float(v) for v in local)))
+    return crops
+
+
+def ellipse_masks(size: int, boxes: "np.ndarray", feather: float = 0.0) -> "np.ndarray":
+    """Elipses inscritas en ``boxes`` [N, 4] sobre lienzos ``size x size``.
+
+    Devuelve float32 [N, size, size] en [0, 1], calculado de una vez con
+    broadcasting. Con ``feather > 0`` la opacidad cae linealmente en la
+    fracción exterior ``feather`` del radio (borde suave para pegar); con 0 es
+    binaria.
+    """
+    import numpy as np
+
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    cx = (boxes[:, 0] + boxes[:, 2]) / 2
+    cy = (boxes[:, 1] + boxes[:, 3]) / 2
+    rx = np.maximum((boxes[:, 2] - boxes[:, 0]) / 2, 1.0)
+    ry = np.maximum((boxes[:, 3] - boxes[:, 1]) / 2, 1.0)
+    coords = np.arange(size, dtype=np.float32) + 0.5
+    dx = (coords[None, None, :] - cx[:, None, None]) / rx[:, None, None]
+    dy = (coords[None, :, None] - cy[:, None, None]) / ry[:, None, None]
+    r = np.sqrt(dx**2 + dy**2)
+    if feather <= 0:
+        return (r <= 1).astype(np.float32)
+    return np.clip((1 - r) / feather, 0.0, 1.0).astype(np.float32)
+
+
+def paste_back(
+    image: "np.ndarray", patch: "np.ndarray", box: Box, alpha: "np.ndarray"
+) -> "np.ndarray":
+    """Funde ``patch`` (tamaño de ``box``) sobre ``image`` con opacidad ``alpha`` [h, w]."""
+    import numpy as np
+
+    x1, y1, x2, y2 = box
+    out = image.copy()
+    region = out[y1:y2, x1:x2].astype(np.float32)
+    a = alpha[..., None] if region.ndim == 3 else alpha
+    blended = region + (patch.astype(np.float32) - region) * a
+    out[y1:y2, x1:x2] = np.clip(np.rint(blended), 0, 255).astype(image.dtype)
+    return out
+
+
+def inpaint_face_crops(
     pipe_inpaint: "StableDiffusionXLInpaintPipeline",
-    image: "Image.Image",
-    prompt: str,
-    negative_prompt: str,
+    images: list["Image.Image"],
+    crops: list[FaceCrop],
+    embeds: PromptEmbeds,
     num_inference_steps: int = 20,
     guidance_scale: float = 5.0,
     seed: Optional[int] = None,
-) -> "Image.Image":
-    """Refina caras detectadas en la imagen usando inpainting SDXL.
-
-    Args:
-        pipe_inpaint: Pipeline de inpainting SDXL ya cargado en GPU.
-        image: Imagen PIL a refinar.
-        prompt: Prompt positivo para guiar el inpainting.
-        negative_prompt: Prompt negativo.
-        num_inference_steps: Pasos de inferencia para el inpainting.
-        guidance_scale: CFG scale para el inpainting.
-        seed: Semilla (se usa seed+1 para diferenciar del generado original).
+    resolution: int = FACE_REFINE_RESOLUTION,
+    max_batch: int = FACE_REFINE_MAX_BATCH,
+    gpu_section: Callable[[int], ContextManager] = lambda n: nullcontext(),
+) -> list["Image.Image"]:
+    """Inpainting de todos los crops en batches de hasta ``max_batch``.
+
+    ``embeds`` son los embeddings ya ponderados del request
+    ``(prompt, negative, pooled, pooled_negative)``. Cada crop usa su propio
+    generator (``seed + 1 + i``), así el resultado no depende del troceado.
+    ``gpu_section(n)`` envuelve cada llamada (lock de GPU, plan de memoria).
 
     Returns:
-        Imagen PIL con caras refinadas (o la original si no se detectaron caras).
+        Crops refinados a ``resolution x resolution``, en el orden de ``crops``.
     """
-    import cv2
     import numpy as np
     import torch
     from PIL import Image as PILImage
 
-    w, h = image.size
-    img_np = np.array(image)
-    if img_np.ndim == 2:
-        gray = img_np
-    else:
-        gray = cv2.cvtColor(img_np, cv2.COLOR_RGB2GRAY)
+    prompt_embeds, negative_embeds, pooled, pooled_negative = embeds
+    scales = np.array([resolution / c.side for c in crops], dtype=np.float32)
+    boxes = np.array([c.mask_box for c in crops], dtype=np.float32) * scales[:, None]
+    masks = (ellipse_masks(resolution, boxes) * 255).astype(np.uint8)
+
+    refined: list["Image.Image"] = []
+    for start in range(0, len(crops), max(1, max_batch)):
+        chunk = crops[start : start + max(1, max_batch)]
+        crop_images = [
+            images[c.image_index].crop(c.box).resize((resolution, resolution), PILImage.LANCZOS)
+            for c in chunk
+        ]
+        generator = None
+        if seed is not None and seed != -1:
+            generator = [
+                torch.Generator(device="cuda").manual_seed(seed + 1 + start + i)
+                for i in range(len(chunk))
+            ]
+        with gpu_section(len(chunk)):
+            refined += pipe_inpaint(
+                prompt_embeds=prompt_embeds,
+                negative_prompt_embeds=negative_embeds,
+                pooled_prompt_embeds=pooled,
+                negative_pooled_prompt_embeds=pooled_negative,
+                num_images_per_prompt=len(chunk),
+                image=crop_images,
+                mask_image=[PILImage.fromarray(m) for m in masks[start : start + len(chunk)]],
+                width=resolution,
+                height=resolution,
+                num_inference_steps=num_inference_steps,
+                guidance_scale=guidance_scale,
+                strength=0.45,
+                generator=generator,
+            ).images
+    return refined
+
+
+def paste_face_crops(
+    images: list["Image.Image"], crops: list[FaceCrop], refined: list["Image.Image"]
+) -> list["Image.Image"]:
+    """Pega los crops refinados en sus imágenes con la elipse suavizada."""
+    import numpy as np
+    from PIL import Image as PILImage
+
+    arrays: dict[int, "np.ndarray"] = {}
+    for crop, patch in zip(crops, refined):
+        img_np = arrays.get(crop.image_index)
+        if img_np is None:
+            img_np = np.array(images[crop.image_index].convert("RGB"))
+        side = crop.side
+        patch_np = np.asarray(patch.convert("RGB").resize((side, side), PILImage.LANCZOS))
+        alpha = ellipse_masks(side, np.array([crop.mask_box]), feather=FACE_MASK_FEATHER)[0]
+        arrays[crop.image_index] = paste_back(img_np, patch_np, crop.box, alpha)
+    return [
+        PILImage.fromarray(arrays[i]) if i in arrays else img for i, img in enumerate(images)
+    ]
 
-    face_cascade = cv2.CascadeClassifier(
-        cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
-    )
-    faces = face_cascade.detectMultiScale(
-        gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30)
-    )
-    if len(faces) == 0:
-        return image
-
-    # Máscara combinada: expandir bbox ~35% para capturar mejor ojos y detalles
-    mask_np = np.zeros((h, w), dtype=np.uint8)
-    for (x, y, bw, bh) in faces:
-        pad = max(4, int(0.35 * max(bw, bh)))
-        x1 = max(0, x - pad)
-        y1 = max(0, y - pad)
-        x2 = min(w, x + bw + pad)
-        y2 = min(h, y + bh + pad)
-        cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
-        rx, ry = (x2 - x1) // 2, (y2 - y1) // 2
-        yy, xx = np.ogrid[:h, :w]
-        ellipse = ((xx - cx) ** 2 / (rx**2 + 1)) + ((yy - cy) ** 2 / (ry**2 + 1)) <= 1
-        mask_np[ellipse] = 255
-
-    mask_pil = PILImage.fromarray(mask_np).convert("L")
-    if mask_np.max() == 0:
-        return image
-
-    gen = None
-    if seed is not None and seed != -1:
-        gen = torch.Generator(device="cuda").manual_seed(seed + 1)
-
-    out = pipe_inpaint(
-        prompt=prompt,
-        negative_prompt=negative_prompt,
-        image=image,
-        mask_image=mask_pil,
-        num_inference_steps=num_inference_steps,
-        guidance_scale=guidance_scale,
-        strength=0.45,
-        generator=gen,
-    ).images[0]
-    return out
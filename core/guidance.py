@@ -0,0 +1,106 @@
+"""Intervalo de guidance: cortar CFG y PAG en la parte final del muestreo.
+
+Con CFG + PAG cada paso corre el UNet sobre 2x o 3x filas (incondicional,
+condicional, perturbada). En los últimos pasos las ramas extra aportan poco, así
+que a partir de ``cfg_end`` / ``pag_end`` (fracción de pasos) se eliminan sus
+filas de los tensores del pipeline desde ``callback_on_step_end`` y el resto
+de pasos corre solo la rama condicional.
+
+Orden de filas en diffusers: ``[neg, pos]`` con CFG, ``[pos, perturbada]`` con
+PAG y ``[neg, pos, perturbada]`` con ambos (cada grupo con N filas).
+"""
+from __future__ import annotations
+
+import math
+from typing import TYPE_CHECKING, Any, Optional
+
+if TYPE_CHECKING:
+    from diffusers import DiffusionPipeline
+
+# Tensores del pipeline SDXL (y SDXL PAG) con una fila por rama
+TRUNCATION_TENSOR_INPUTS = ["prompt_embeds", "add_text_embeds", "add_time_ids"]
+
+
+def active_steps(end: float, total_steps: int) -> int:
+    """Pasos iniciales con la rama activa para una fracción ``end`` en [0, 1]."""
+    return min(total_steps, max(0, math.ceil(end * total_steps)))
+
+
+class GuidanceTruncation:
+    """Callback de paso que elimina las ramas de CFG/PAG al llegar a su fin.
+
+    Se usa como context manager alrededor de la llamada al pipeline, bajo el
+    lock de GPU y dentro de ``apply_memory_plan``: al entrar guarda los
+    attention processors del UNet tal como están (p. ej. con attention
+    slicing) y al salir los restaura, también si el pipeline falla.
+
+    Args:
+        pipe: Pipeline que se va a ejecutar (normal o PAG).
+        total_steps: Pasos de denoising.
+        cfg_end: Fracción de pasos con CFG (1 = todos).
+        pag_end: Fracción de pasos con PAG (1 = todos).
+    """
+
+    def __init__(
+        self, pipe: "DiffusionPipeline", total_steps: int, cfg_end: float, pag_end: float
+    ) -> None:
+        self.pipe = pipe
+        self.cfg_stop = self._stop(cfg_end, total_steps)
+        self.pag_stop = self._stop(pag_end, total_steps)
+        # Processors originales: al cortar PAG hay que restaurarlos nosotros,
+        # porque el pipeline solo lo hace si PAG sigue activo al terminar.
+        self._original_processors: Optional[dict[str, Any]] = None
+
+    def __enter__(self) -> "GuidanceTruncation":
+        if self.pag_stop is not None:
+            self._original_processors = self.pipe.unet.attn_processors
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self._original_processors is not None:
+            self.pipe.unet.set_attn_processor(dict(self._original_processors))
+            self._original_processors = None
+
+    @staticmethod
+    def _stop(end: float, total_steps: int) -> Optional[int]:
+        n = active_steps(end, total_steps)
+        return n if 0 < n < total_steps else None
+
+    @property
+    def active(self) -> bool:
+        return self.cfg_stop is not None or self.pag_stop is not None
+
+    def __call__(self, pipe, i: int, t, callback_kwargs: dict) -> dict:
+        import torch
+
+        step = i + 1
+        drop_cfg = step == self.cfg_stop and pipe.do_classifier_free_guidance
+        pag_on = getattr(pipe, "do_perturbed_attention_guidance", False)
+        drop_pag = step == self.pag_stop and pag_on
+        if not (drop_cfg or drop_pag):
+            return callback_kwargs
+
+        groups = (["neg"] if pipe.do_classifier_free_guidance else []) + ["pos"]
+        if pag_on:
+            groups.append("pag")
+        keep = [
+            idx
+            for idx, g in enumerate(groups)
+            if not (g == "neg" and drop_cfg) and not (g == "pag" and drop_pag)
+        ]
+        for name in TRUNCATION_TENSOR_INPUTS:
+            chunks = callback_kwargs[name].chunk(len(groups))
+            callback_kwargs[name] = torch.cat([chunks[idx] for idx in keep])
+
+        if drop_cfg:
+            pipe._guidance_scale = 0.0
+        if drop_pag:
+            pipe._pag_scale = 0.0
+            # set_attn_processor vacía el dict que recibe: pasar una copia
+            pipe.unet.set_attn_processor(dict(self._original_processors))
+        elif drop_cfg and pag_on:
+            # El processor PAG con CFG espera 3 grupos; pasar al de 2 (pos, perturbada)
+            pipe._set_pag_attn_processor(
+                pag_applied_layers=pipe.pag_applied_layers, do_classifier_free_guidance=False
+            )
+        return callback_kwargs
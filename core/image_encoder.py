@@ -0,0 +1,81 @@
+"""Serialización de imágenes de salida (PNG / WebP / JPEG).
+
+La codificación es CPU pura y Pillow libera el GIL en zlib/libjpeg/libwebp,
+así que las imágenes de un batch se codifican en paralelo en un thread pool
+en lugar de en serie en el hilo del request.
+"""
+from __future__ import annotations
+
+from concurrent.futures import Executor
+from io import BytesIO
+from typing import TYPE_CHECKING, Optional, Sequence
+
+from config.constants import DEFAULT_OUTPUT_QUALITY, DEFAULT_PNG_COMPRESS_LEVEL
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+# formato → (formato Pillow, media type HTTP, extensión)
+OUTPUT_FORMATS: dict[str, tuple[str, str, str]] = {
+    "png": ("PNG", "image/png", "png"),
+    "webp": ("WEBP", "image/webp", "webp"),
+    "jpeg": ("JPEG", "image/jpeg", "jpg"),
+}
+_ALIASES = {"jpg": "jpeg"}
+
+
+def normalize_format(output_format: Optional[str]) -> str:
+    """Normaliza el nombre del formato; lanza ValueError si no está soportado."""
+    fmt = (output_format or "png").strip().lower()
+    fmt = _ALIASES.get(fmt, fmt)
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(
+            f"output_format '{output_format}' no soportado; usa {sorted(OUTPUT_FORMATS)}"
+        )
+    return fmt
+
+
+def media_type_for(output_format: Optional[str]) -> str:
+    """Media type HTTP del formato (p. ej. ``image/webp``)."""
+    return OUTPUT_FORMATS[normalize_format(output_format)][1]
+
+
+def extension_for(output_format: Optional[str]) -> str:
+    """Extensión de archivo del formato, sin punto."""
+    return OUTPUT_FORMATS[normalize_format(output_format)][2]
+
+
+def encode_image(
+    image: "Image.Image",
+    output_format: str = "png",
+    quality: int = DEFAULT_OUTPUT_QUALITY,
+    compress_level: int = DEFAULT_PNG_COMPRESS_LEVEL,
+) -> bytes:
+    """Codifica una imagen PIL en el formato pedido."""
+    fmt = normalize_format(output_format)
+    pil_format = OUTPUT_FORMATS[fmt][0]
+    buf = BytesIO()
+    if fmt == "png":
+        image.save(buf, format=pil_format, compress_level=compress_level)
+    elif fmt == "jpeg":
+        image.convert("RGB").save(buf, format=pil_format, quality=quality)
+    else:
+        image.save(buf, format=pil_format, quality=quality)
+    return buf.getvalue()
+
+
+def encode_images(
+    images: Sequence["Image.Image"],
+    output_format: str = "png",
+    quality: int = DEFAULT_OUTPUT_QUALITY,
+    compress_level: int = DEFAULT_PNG_COMPRESS_LEVEL,
+    executor: Optional[Executor] = None,
+) -> list[bytes]:
+    """Codifica varias imágenes, en paralelo si se pasa ``executor``."""
+    if executor is None or len(images) <= 1:
+        return [encode_image(img, output_format, quality, compress_level) for img in images]
+    futures = [
+        executor.submit(encode_image, img, output_format, quality, compress_level)
+        for img in images
+    ]
+    return [f.result() for f in futures]
@@ -0,0 +1,113 @@
+"""Plan de memoria por request: VAE tiling/slicing y attention slicing solo si hace falta.
+
+``plan_memory`` estima el pico de activaciones del UNet y del VAE decode a
+partir de ``(width, height, batch, pag, cfg)`` y decide qué modos activar para
+que quepa en el presupuesto. Es una función pura (sin torch), así que se puede
+comprobar en CPU qué modo elige cada tamaño. ``apply_memory_plan`` activa los
+modos en el pipeline y los restaura al salir: UNet y VAE se comparten entre
+pipelines y requests, así que debe usarse bajo el lock de GPU.
+
+Con 1024² (incluso batch 4 con CFG + PAG) el plan es vacío y no se toca nada.
+"""
+from __future__ import annotations
+
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Iterator
+
+# Estimaciones fp16 calibradas a grandes rasgos en A100 (SDPA activado):
+# activaciones del UNet por píxel de salida y fila del batch del UNet, y pico
+# del VAE decode por píxel de salida y imagen.
+UNET_BYTES_PER_PIXEL = 1024
+VAE_DECODE_BYTES_PER_PIXEL = 3 * 1024
+
+
+@dataclass(frozen=True)
+class MemoryPlan:
+    """Modos de ahorro de memoria para un request."""
+
+    vae_tiling: bool = False
+    vae_slicing: bool = False
+    attention_slicing: bool = False
+    unet_bytes: int = 0
+    vae_bytes: int = 0
+
+    @property
+    def is_default(self) -> bool:
+        return not (self.vae_tiling or self.vae_slicing or self.attention_slicing)
+
+    def describe(self) -> str:
+        modes = [
+            name
+            for name, on in (
+                ("vae_tiling", self.vae_tiling),
+                ("vae_slicing", self.vae_slicing),
+                ("attention_slicing", self.attention_slicing),
+            )
+            if on
+        ]
+        return "+".join(modes) or "default"
+
+
+def plan_memory(
+    width: int,
+    height: int,
+    batch: int,
+    pag: bool,
+    budget_bytes: int,
+    cfg: bool = True,
+) -> MemoryPlan:
+    """Elige los modos mínimos para que el pico estimado quepa en ``budget_bytes``.
+
+    Args:
+        width, height: Tamaño de salida en píxeles.
+        batch: Imágenes en el batch (suma de ``num_outputs``).
+        pag: PAG activo (añade una fila perturbada por imagen).
+        budget_bytes: Memoria libre para activaciones (sin contar pesos).
+        cfg: CFG activo (añade la fila incondicional por imagen).
+    """
+    pixels = width * height
+    rows = batch * (1 + int(cfg) + int(pag))
+    unet_bytes = UNET_BYTES_PER_PIXEL * pixels * rows
+    vae_per_image = VAE_DECODE_BYTES_PER_PIXEL * pixels
+
+    vae_tiling = vae_per_image > budget_bytes
+    vae_slicing = not vae_tiling and batch > 1 and vae_per_image * batch > budget_bytes
+    if vae_tiling:
+        vae_bytes = budget_bytes
+    elif vae_slicing:
+        vae_bytes = vae_per_image
+    else:
+        vae_bytes = vae_per_image * batch
+
+    return MemoryPlan(
+        vae_tiling=vae_tiling,
+        vae_slicing=vae_slicing,
+        attention_slicing=unet_bytes > budget_bytes,
+        unet_bytes=unet_bytes,
+        vae_bytes=vae_bytes,
+    )
+
+
+@contextmanager
+def apply_memory_plan(pipe: Any, plan: MemoryPlan) -> Iterator[None]:
+    """Activa los modos del plan en ``pipe`` durante el bloque y luego los desactiva."""
+    if plan.is_default:
+        yield
+        return
+    if plan.vae_tiling:
+        pipe.vae.enable_tiling()
+    if plan.vae_slicing:
+        pipe.vae.enable_slicing()
+    if plan.attention_slicing:
+        pipe.enable_attention_slicing("auto")
+    try:
+        yield
+    finally:
+        if plan.attention_slicing:
+            # Vuelve a los processors SDPA por defecto
+            pipe.disable_attention_slicing()
+        if plan.vae_slicing:
+            pipe.vae.disable_slicing()
+        if plan.vae_tiling:
+            pipe.vae.disable_tiling()
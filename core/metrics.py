@@ -0,0 +1,257 @@
+"""Registro de tiempos por request sin bloquear el camino de latencia.
+
+``MetricsWriter`` acumula los registros en memoria y un hilo de fondo los
+vuelca por lotes (por tiempo o por tamaño) a un JSONL en el Volume, seguido de
+un único ``commit``. Además mantiene agregados incrementales (total y por día:
+count/sum/min/max + histograma logarítmico) en un JSON pequeño, así que el
+reporte da p50/p95/p99 y resúmenes diarios sin releer el historial.
+
+Cada contenedor escribe sus propios archivos (``<container>.jsonl`` y
+``<container>.agg.json``) para que varios contenedores no se pisen en el
+Volume; el reporte fusiona los agregados de todos.
+"""
+from __future__ import annotations
+
+import copy
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Iterable, Optional
+
+# Ancho relativo de cada bucket del histograma: error de percentil ≤ ~2.5 %
+_BUCKET_GROWTH = 1.05
+_MIN_VALUE = 1e-3
+AGG_SUFFIX = ".agg.json"
+LOG_SUFFIX = ".jsonl"
+RECENT_RECORDS = 20
+
+
+def _bucket(value: float) -> int:
+    return int(math.floor(math.log(max(value, _MIN_VALUE)) / math.log(_BUCKET_GROWTH)))
+
+
+def _bucket_mid(idx: int) -> float:
+    return _BUCKET_GROWTH ** (idx + 0.5)
+
+
+def _empty_agg() -> dict[str, Any]:
+    return {"count": 0, "sum": 0.0, "min": None, "max": None, "cold_starts": 0, "hist": {}}
+
+
+def _add_to_agg(agg: dict[str, Any], value: float, cold_start: float) -> None:
+    agg["count"] += 1
+    agg["sum"] += value
+    agg["min"] = value if agg["min"] is None else min(agg["min"], value)
+    agg["max"] = value if agg["max"] is None else max(agg["max"], value)
+    if cold_start > 0:
+        agg["cold_starts"] += 1
+    key = str(_bucket(value))
+    agg["hist"][key] = agg["hist"].get(key, 0) + 1
+
+
+def merge_aggs(aggs: Iterable[dict[str, Any]]) -> dict[str, Any]:
+    """Fusiona agregados (de varios contenedores o días) en uno solo."""
+    out = _empty_agg()
+    for agg in aggs:
+        if not agg or not agg.get("count"):
+            continue
+        out["count"] += agg["count"]
+        out["sum"] += agg["sum"]
+        out["min"] = agg["min"] if out["min"] is None else min(out["min"], agg["min"])
+        out["max"] = agg["max"] if out["max"] is None else max(out["max"], agg["max"])
+        out["cold_starts"] += agg.get("cold_starts", 0)
+        for k, n in agg["hist"].items():
+            out["hist"][k] = out["hist"].get(k, 0) + n
+    return out
+
+
+def percentile(agg: dict[str, Any], q: float) -> float:
+    """Percentil ``q`` (0–100) estimado a partir del histograma."""
+    count = agg.get("count", 0)
+    if not count:
+        return 0.0
+    target = max(1, math.ceil(count * q / 100.0))
+    seen = 0
+    for idx in sorted(int(k) for k in agg["hist"]):
+        seen += agg["hist"][str(idx)]
+        if seen >= target:
+            # Acotar al rango observado para que p0/p100 sean exactos
+            return min(max(_bucket_mid(idx), agg["min"]), agg["max"])
+    return agg["max"]
+
+
+def format_agg(label: str, agg: dict[str, Any]) -> str:
+    n = agg["count"]
+    if not n:
+        return f"{label}: sin datos"
+    return (
+        f"{label}: n={n} avg={agg['sum'] / n:.2f}s "
+        f"p50={percentile(agg, 50):.2f}s p95={percentile(agg, 95):.2f}s "
+        f"p99={percentile(agg, 99):.2f}s min={agg['min']:.2f}s max={agg['max']:.2f}s "
+        f"cold_starts={agg['cold_starts']}"
+    )
+
+
+def _write_json_atomic(path: Path, data: dict) -> None:
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps(data, separators=(",", ":")))
+    os.replace(tmp, path)
+
+
+class MetricsWriter:
+    """Buffer de registros de tiempos con volcado y commit en segundo plano.
+
+    Args:
+        directory: Carpeta del Volume donde escribir (``/cache/timing``).
+        commit: Callable que persiste el Volume (p. ej. ``volume.commit``).
+        flush_interval_s: Volcado periódico aunque el buffer no esté lleno.
+        flush_max_records: Volcado inmediato al alcanzar este tamaño de buffer.
+        container_id: Identificador de los archivos de este contenedor.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        commit: Optional[Callable[[], None]] = None,
+        flush_interval_s: float = 30.0,
+        flush_max_records: int = 32,
+        container_id: Optional[str] = None,
+    ) -> None:
+        self.directory = Path(directory)
+        self.commit = commit
+        self.flush_interval_s = max(0.1, float(flush_interval_s))
+        self.flush_max_records = max(1, int(flush_max_records))
+        self.container_id = (
+            container_id or os.environ.get("MODAL_TASK_ID") or uuid.uuid4().hex[:12]
+        )
+        self.log_path = self.directory / f"{self.container_id}{LOG_SUFFIX}"
+        self.agg_path = self.directory / f"{self.container_id}{AGG_SUFFIX}"
+
+        self._buffer: list[dict[str, Any]] = []
+        self._aggs: dict[str, Any] = {
+            "total": _empty_agg(),
+            "days": {},
+            "recent": [],
+        }
+        self._recent: deque[dict[str, Any]] = deque(maxlen=RECENT_RECORDS)
+        self._cv = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._worker = threading.Thread(target=self._loop, name="metrics-writer", daemon=True)
+        self._worker.start()
+
+    def record(self, inference_s: float, cold_start_s: float = 0.0, **fields: Any) -> None:
+        """Añade un registro (O(1), sin I/O). ``fields`` se guardan tal cual en el JSONL."""
+        now = datetime.now(timezone.utc)
+        rec = {
+            "ts": now.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "inference_s": round(inference_s, 3),
+            "cold_start_s": round(cold_start_s, 3),
+            **fields,
+        }
+        day = now.strftime("%Y-%m-%d")
+        with self._cv:
+            _add_to_agg(self._aggs["total"], inference_s, cold_start_s)
+            _add_to_agg(self._aggs["days"].setdefault(day, _empty_agg()), inference_s, cold_start_s)
+            self._recent.append(rec)
+            self._buffer.append(rec)
+            if len(self._buffer) >= self.flush_max_records:
+                self._cv.notify()
+
+    def flush(self) -> int:
+        """Vuelca el buffer al JSONL, reescribe los agregados y hace commit.
+
+        Returns:
+            Número de registros volcados.
+        """
+        with self._flush_lock:
+            with self._cv:
+                batch, self._buffer = self._buffer, []
+                if not batch:
+                    return 0
+                self._aggs["recent"] = list(self._recent)
+                snapshot = copy.deepcopy(self._aggs)
+            try:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                with open(self.log_path, "a") as f:
+                    f.writelines(json.dumps(r, separators=(",", ":")) + "\n" for r in batch)
+                _write_json_atomic(self.agg_path, snapshot)
+                if self.commit is not None:
+                    self.commit()
+            except Exception as e:
+                print(f"MetricsWriter: no se pudo volcar ({len(batch)} registros): {e}")
+            return len(batch)
+
+    def close(self) -> None:
+        """Detiene el hilo de fondo y hace un último volcado."""
+        with self._cv:
+            self._closed = True
+            self._cv.notify()
+        self._worker.join()
+        self.flush()
+
+    def _loop(self) -> None:
+        while True:
+            with self._cv:
+                deadline = time.monotonic() + self.flush_interval_s
+                while not self._closed and len(self._buffer) < self.flush_max_records:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cv.wait(timeout=remaining)
+                if self._closed:
+                    return
+            self.flush()
+
+
+def load_aggregates(directory: str) -> list[dict[str, Any]]:
+    """Lee los agregados de todos los contenedores (un JSON pequeño por contenedor)."""
+    out = []
+    root = Path(directory)
+    if not root.exists():
+        return out
+    for path in root.glob(f"*{AGG_SUFFIX}"):
+        try:
+            out.append(json.loads(path.read_text()))
+        except (OSError, ValueError):
+            continue
+    return out
+
+
+def build_report(directory: str, max_days: int = 14) -> str:
+    """Reporte de tiempos: total, resumen por día y últimos registros."""
+    aggs = load_aggregates(directory)
+    total = merge_aggs(a.get("total") for a in aggs)
+    if not total["count"]:
+        return "No hay registros aún. Ejecuta al menos una generación.\n"
+
+    days: dict[str, list[dict[str, Any]]] = {}
+    for a in aggs:
+        for day, agg in a.get("days", {}).items():
+            days.setdefault(day, []).append(agg)
+    recent = sorted(
+        (r for a in aggs for r in a.get("recent", [])), key=lambda r: r.get("ts", "")
+    )[-RECENT_RECORDS:]
+
+    lines = [
+        "=== Reporte de tiempos Nova Anime ===",
+        f"Contenedores: {len(aggs)}",
+        format_agg("Inferencia (total)", total),
+        "--- Por día ---",
+    ]
+    for day in sorted(days)[-max_days:]:
+        lines.append(format_agg(day, merge_aggs(days[day])))
+    lines.append(f"--- Últimos {len(recent)} requests ---")
+    for r in recent:
+        lines.append(
+            f"{r.get('ts')} request={r.get('request')} "
+            f"cold_start_s={r.get('cold_start_s', 0):.2f} "
+            f"inference_s={r.get('inference_s', 0):.2f}"
+        )
+    return "\n".join(lines) + "\n"
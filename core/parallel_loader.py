@@ -0,0 +1,172 @@
+"""Carga en paralelo de los componentes de un pipeline diffusers guardado en disco.
+
+``from_pretrained`` lee UNet, text encoders, VAE, tokenizers y scheduler uno
+tras otro y luego ``.to("cuda")`` copia todo a la GPU. Aquí solo la E/S va en
+paralelo: cada fichero ``.safetensors`` (cada shard) se lee en su propio hilo
+directamente al device y en el dtype final (lectura y copias liberan el GIL).
+
+Construir los módulos no es seguro entre hilos: ``from_pretrained`` de
+diffusers/transformers parchea globales de torch (``init_empty_weights``,
+``no_init_weights``). Por eso el hilo principal construye cada módulo desde su
+config con pesos vacíos y le asigna el state dict leído, mientras los hilos
+siguen leyendo los demás. Tokenizers, scheduler, ``overrides`` y módulos sin
+safetensors se cargan también en el hilo principal con ``from_pretrained``.
+
+Los componentes salen de ``model_index.json``, así que sirve para cualquier
+pipeline guardado con ``save_pretrained`` (la cache convertida del checkpoint).
+"""
+from __future__ import annotations
+
+import importlib
+import json
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+from config.constants import PARALLEL_LOAD_WORKERS
+
+if TYPE_CHECKING:
+    import torch
+    from diffusers import DiffusionPipeline
+
+
+def _component_specs(index: dict[str, Any]) -> dict[str, Optional[tuple[str, str]]]:
+    """Componentes del ``model_index.json``: nombre → (librería, clase) o None."""
+    specs: dict[str, Optional[tuple[str, str]]] = {}
+    for name, value in index.items():
+        if name.startswith("_") or not isinstance(value, list):
+            continue
+        library, class_name = value
+        specs[name] = (library, class_name) if library and class_name else None
+    return specs
+
+
+def _read_state_dict(
+    path: Path, device: str, torch_dtype: "torch.dtype"
+) -> tuple[dict[str, "torch.Tensor"], float]:
+    """Lee un ``.safetensors`` al device y pasa los floats a ``torch_dtype`` (en un hilo)."""
+    from safetensors.torch import load_file
+
+    t0 = time.perf_counter()
+    state_dict = load_file(str(path), device=device)
+    for key, tensor in state_dict.items():
+        if tensor.is_floating_point() and tensor.dtype != torch_dtype:
+            state_dict[key] = tensor.to(torch_dtype)
+    return state_dict, time.perf_counter() - t0
+
+
+def _build_module(cls: type, root: Path, name: str, state_dict: dict[str, Any]) -> Any:
+    """Construye ``cls`` desde su config con pesos vacíos y le asigna ``state_dict``.
+
+    Solo en el hilo principal: ``init_empty_weights`` parchea globales de torch.
+    """
+    from accelerate import init_empty_weights
+
+    with init_empty_weights():
+        if hasattr(cls, "load_config"):  # ModelMixin de diffusers
+            module = cls.from_config(cls.load_config(str(root), subfolder=name))
+        else:  # PreTrainedModel de transformers
+            module = cls(cls.config_class.from_pretrained(str(root / name)))
+    missing, _ = module.load_state_dict(state_dict, strict=False, assign=True)
+    if missing:
+        raise RuntimeError(f"{name}: faltan pesos en los safetensors: {missing[:5]}")
+    return module.eval()
+
+
+def load_pipeline_parallel(
+    directory: str,
+    torch_dtype: "torch.dtype",
+    device: Optional[str] = "cuda",
+    overrides: Optional[dict[str, Callable[[], Any]]] = None,
+    workers: int = PARALLEL_LOAD_WORKERS,
+) -> tuple["DiffusionPipeline", dict[str, dict[str, float]]]:
+    """Carga el pipeline de ``directory`` leyendo sus safetensors en paralelo.
+
+    Args:
+        directory: Carpeta de ``save_pretrained`` (con ``model_index.json``).
+        torch_dtype: dtype de los componentes que son ``nn.Module``.
+        device: Destino de los pesos (se leen directamente ahí); None = CPU.
+        overrides: Componentes que se cargan con otro callable (p. ej. el VAE
+            fp16-fix desde el Hub), en el hilo principal mientras se lee el resto.
+        workers: Hilos de lectura.
+
+    Returns:
+        (pipeline, tiempos) con ``{"read_s", "build_s"}`` por componente:
+        lectura en los hilos (suma de sus shards) y construcción en el hilo principal.
+    """
+    import diffusers
+    import torch
+
+    root = Path(directory)
+    index = json.loads((root / "model_index.json").read_text())
+    specs = _component_specs(index)
+    overrides = overrides or {}
+    target = device or "cpu"
+
+    names = [name for name, spec in specs.items() if spec is not None or name in overrides]
+    # Los más pesados primero: el UNet marca el tiempo total
+    order = {"unet": 0, "text_encoder_2": 1, "text_encoder": 2, "vae": 3}
+    names.sort(key=lambda n: order.get(n, len(order)))
+
+    classes: dict[str, type] = {}
+    for name in names:
+        if name not in overrides:
+            library, class_name = specs[name]
+            classes[name] = getattr(importlib.import_module(library), class_name)
+
+    t0 = time.perf_counter()
+    components: dict[str, Any] = {name: None for name in specs}
+    timings: dict[str, dict[str, float]] = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="load") as pool:
+        reads: dict[str, list[Future]] = {}
+        for name, cls in classes.items():
+            shards = sorted((root / name).glob("*.safetensors"))
+            if issubclass(cls, torch.nn.Module) and shards:
+                reads[name] = [
+                    pool.submit(_read_state_dict, path, target, torch_dtype) for path in shards
+                ]
+
+        for name in names:
+            if name in reads:
+                state_dict: dict[str, Any] = {}
+                read_s = 0.0
+                for future in reads.pop(name):
+                    shard, seconds = future.result()
+                    state_dict.update(shard)
+                    read_s += seconds
+                t1 = time.perf_counter()
+                component = _build_module(classes[name], root, name, state_dict)
+                if device is not None:
+                    # Buffers no persistentes (no están en los safetensors)
+                    component = component.to(device)
+            else:
+                read_s = 0.0
+                t1 = time.perf_counter()
+                if name in overrides:
+                    component = overrides[name]()
+                else:
+                    cls = classes[name]
+                    kwargs: dict[str, Any] = {"subfolder": name}
+                    if issubclass(cls, torch.nn.Module):
+                        kwargs["torch_dtype"] = torch_dtype
+                    component = cls.from_pretrained(str(root), **kwargs)
+                if device is not None and isinstance(component, torch.nn.Module):
+                    component = component.to(device)
+            components[name] = component
+            timings[name] = {"read_s": read_s, "build_s": time.perf_counter() - t1}
+
+    for name in names:
+        t = timings[name]
+        print(f"  {name}: lectura {t['read_s']:.2f}s, construcción {t['build_s']:.2f}s")
+    print(
+        f"Componentes cargados en {time.perf_counter() - t0:.2f}s "
+        f"(suma secuencial {sum(t['read_s'] + t['build_s'] for t in timings.values()):.2f}s)"
+    )
+
+    # Parámetros de configuración del pipeline (p. ej. force_zeros_for_empty_prompt)
+    config = {
+        k: v for k, v in index.items() if not k.startswith("_") and not isinstance(v, list)
+    }
+    pipeline_cls = getattr(diffusers, index["_class_name"])
+    return pipeline_cls(**components, **config), timings
@@ -0,0 +1,154 @@
+"""Previews baratas de la predicción de x0 durante el denoising.
+
+Los latents x_t de los primeros pasos son casi puro ruido, así que el preview
+usa la predicción de la imagen final (x0) del paso: ``pred_original_sample`` si
+el scheduler la devuelve (Euler a, DPM++ SDE, DDIM) o, si no (DPM++ 2M, UniPC),
+se calcula a partir de la salida del UNet y el sigma del paso.
+
+En lugar de un VAE decode completo se usa una proyección lineal 4→3 canales
+(los mismos factores que los previews "latent2rgb" de ComfyUI): una imagen de
+1/8 de la resolución final en un solo ``einsum``. La proyección se hace en la
+GPU dentro del callback del pipeline y la copia a CPU es asíncrona; la espera
+y la compresión a JPEG se hacen fuera, en el hilo que emite los eventos.
+"""
+from __future__ import annotations
+
+from io import BytesIO
+from typing import TYPE_CHECKING, Any, Optional
+
+from config.constants import PREVIEW_JPEG_QUALITY, PREVIEW_MAX_SIZE
+
+if TYPE_CHECKING:
+    import torch
+    from diffusers import SchedulerMixin
+
+# Latents SDXL tal como los usa diffusers (multiplicados por scaling_factor,
+# lo que recibe el VAE tras dividir) → RGB aproximado en [-1, 1]
+SDXL_LATENT_RGB_FACTORS = [
+    [0.3651, 0.4232, 0.4341],
+    [-0.2533, -0.0042, 0.1068],
+    [0.1076, 0.1111, -0.0362],
+    [-0.3165, -0.2492, -0.2188],
+]
+SDXL_LATENT_RGB_BIAS = [0.1084, -0.0175, -0.0011]
+
+
+def latents_to_rgb(latents: "torch.Tensor") -> "torch.Tensor":
+    """Proyecta latents ``[B, 4, h, w]`` a RGB uint8 ``[B, h, w, 3]`` en su device."""
+    import torch
+
+    factors = torch.tensor(SDXL_LATENT_RGB_FACTORS, device=latents.device, dtype=torch.float32)
+    bias = torch.tensor(SDXL_LATENT_RGB_BIAS, device=latents.device, dtype=torch.float32)
+    rgb = torch.einsum("bchw,cr->bhwr", latents.float(), factors) + bias
+    return ((rgb + 1.0) * 127.5).clamp(0, 255).to(torch.uint8)
+
+
+class PreviewFrame:
+    """Preview uint8 copiándose a CPU sin sincronizar el hilo que tiene la GPU.
+
+    En CUDA la copia va a memoria pinned con ``non_blocking`` y un evento marca
+    cuándo termina; ``wait()`` bloquea solo al consumidor.
+    """
+
+    def __init__(self, rgb: "torch.Tensor") -> None:
+        import torch
+
+        self._ready: Optional["torch.cuda.Event"] = None
+        if rgb.is_cuda:
+            self._host = torch.empty(rgb.shape, dtype=rgb.dtype, pin_memory=True)
+            self._host.copy_(rgb, non_blocking=True)
+            self._ready = torch.cuda.Event()
+            self._ready.record()
+        else:
+            self._host = rgb
+
+    def wait(self) -> "torch.Tensor":
+        """Espera a la copia y devuelve el tensor en CPU."""
+        if self._ready is not None:
+            self._ready.synchronize()
+        return self._host
+
+
+class PredictedX0:
+    """Guarda la predicción de x0 de cada ``scheduler.step`` del denoising.
+
+    Se usa como context manager alrededor de la llamada al pipeline: envuelve
+    ``step`` en la instancia del scheduler y lo deja como estaba al salir. El
+    x0 de los schedulers que no lo devuelven se calcula solo al leer ``latest``.
+    """
+
+    def __init__(self, scheduler: "SchedulerMixin") -> None:
+        self.scheduler = scheduler
+        self._last: Optional[tuple[Any, "torch.Tensor", "torch.Tensor"]] = None
+
+    def __enter__(self) -> "PredictedX0":
+        step = self.scheduler.step
+
+        def _step(model_output, timestep, sample, *args, return_dict: bool = True, **kwargs):
+            out = step(model_output, timestep, sample, *args, return_dict=True, **kwargs)
+            self._last = (out, model_output, sample)
+            return out if return_dict else out.to_tuple()
+
+        self.scheduler.step = _step
+        return self
+
+    def __exit__(self, *exc) -> None:
+        # Quitar el atributo de instancia vuelve a exponer el método de la clase
+        del self.scheduler.step
+        self._last = None
+
+    @property
+    def latest(self) -> Optional["torch.Tensor"]:
+        """x0 del último paso (``None`` antes del primero)."""
+        if self._last is None:
+            return None
+        out, model_output, sample = self._last
+        x0 = getattr(out, "pred_original_sample", None)
+        if x0 is None:
+            x0 = x0_from_sigma(self.scheduler, model_output, sample)
+        return x0
+
+
+def x0_from_sigma(
+    scheduler: "SchedulerMixin", model_output: "torch.Tensor", sample: "torch.Tensor"
+) -> "torch.Tensor":
+    """x0 a partir de la salida del UNet en el paso que acaba de dar ``scheduler.step``.
+
+    Los schedulers VP (DPM++ multistep, UniPC) tienen ``x_t = α·x0 + σ·ε``; los
+    de estilo k-diffusion ``x_t = x0 + σ·ε``. Sin sigmas se devuelve ``sample``.
+    """
+    sigmas = getattr(scheduler, "sigmas", None)
+    step_index = getattr(scheduler, "step_index", None)
+    if sigmas is None or step_index is None:
+        return sample
+    # step() ya avanzó el índice: el sigma de ``sample`` es el anterior
+    sigma = sigmas[step_index - 1].to(device=sample.device, dtype=sample.dtype)
+    prediction_type = scheduler.config.get("prediction_type", "epsilon")
+    if prediction_type == "sample":
+        return model_output
+    if hasattr(scheduler, "_sigma_to_alpha_sigma_t"):
+        alpha_t, sigma_t = scheduler._sigma_to_alpha_sigma_t(sigma)
+        if prediction_type == "v_prediction":
+            return alpha_t * sample - sigma_t * model_output
+        return (sample - sigma_t * model_output) / alpha_t
+    if prediction_type == "v_prediction":
+        return model_output * (-sigma / (sigma**2 + 1) ** 0.5) + sample / (sigma**2 + 1)
+    return sample - sigma * model_output
+
+
+def rgb_to_jpeg(
+    rgb: "torch.Tensor",
+    max_size: int = PREVIEW_MAX_SIZE,
+    quality: int = PREVIEW_JPEG_QUALITY,
+) -> bytes:
+    """Codifica un preview ``[h, w, 3]`` uint8 (en CPU) como JPEG de lado máximo ``max_size``."""
+    from PIL import Image
+
+    img = Image.fromarray(rgb.numpy())
+    scale = max_size / max(img.size)
+    if scale != 1:
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        img = img.resize(size, Image.BILINEAR)
+    buf = BytesIO()
+    img.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
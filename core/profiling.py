@@ -0,0 +1,135 @@
+"""Tiempos por etapa de un request y captura bajo demanda con ``torch.profiler``.
+
+``StageTimer`` mide etapas (encode del prompt, denoising, VAE decode, caras,
+serialización...). Con ``sync=torch.cuda.synchronize`` sincroniza CUDA al
+cerrar cada etapa para que el trabajo asíncrono de la GPU se atribuya a la
+etapa que lo lanzó; solo debe usarse así bajo el lock de GPU.
+
+``ProfilerController`` se arma con N requests; cada uno de los siguientes N se
+ejecuta dentro de ``torch.profiler`` y se exporta como traza Chrome
+(``chrome://tracing`` / Perfetto) al Volume. El profiler registra las ops de
+CPU solo en el hilo donde se inicia: el request perfilado debe hacer todo su
+trabajo en ese hilo (``_run_predict(inline=True)``), sin batcher ni etapas.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+
+class StageTimer:
+    """Acumula segundos por etapa.
+
+    Args:
+        sync: Se llama al cerrar cada etapa (p. ej. ``torch.cuda.synchronize``).
+    """
+
+    def __init__(self, sync: Optional[Callable[[], None]] = None) -> None:
+        self.sync = sync
+        self.seconds: dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.sync is not None:
+                self.sync()
+            self.add(name, time.perf_counter() - t0)
+
+    def add(self, name: str, seconds: float) -> None:
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    def update(self, seconds: dict[str, float]) -> None:
+        for name, s in seconds.items():
+            self.add(name, s)
+
+    def as_dict(self, prefix: str = "stage_", suffix: str = "_seconds") -> dict[str, float]:
+        return {f"{prefix}{k}{suffix}": round(v, 3) for k, v in self.seconds.items()}
+
+
+def stage_headers(timings: dict) -> dict[str, str]:
+    """``stage_vae_decode_seconds`` → cabecera ``X-Stage-Vae-Decode-Seconds``."""
+    headers = {}
+    for key, value in timings.items():
+        if key.startswith("stage_"):
+            name = "-".join(part.capitalize() for part in key.split("_"))
+            headers[f"X-{name}"] = str(value)
+    return headers
+
+
+class ProfilerController:
+    """Perfila con ``torch.profiler`` los próximos N requests de este contenedor.
+
+    Solo un request se perfila a la vez (el profiler es global al proceso); si
+    ya hay una captura en curso, el request se ejecuta sin perfilar y no
+    consume el contador.
+    """
+
+    def __init__(self, output_dir: str, on_saved: Optional[Callable[[], None]] = None) -> None:
+        self.output_dir = Path(output_dir)
+        self.on_saved = on_saved
+        self._remaining = 0
+        self._lock = threading.Lock()
+        self._active = threading.Lock()
+        self.saved: list[str] = []
+
+    def arm(self, num_requests: int) -> int:
+        """Activa el profiler para los próximos ``num_requests`` (0 lo desarma)."""
+        with self._lock:
+            self._remaining = max(0, int(num_requests))
+            return self._remaining
+
+    @property
+    def remaining(self) -> int:
+        with self._lock:
+            return self._remaining
+
+    def _claim(self) -> bool:
+        with self._lock:
+            if self._remaining <= 0 or not self._active.acquire(blocking=False):
+                return False
+            self._remaining -= 1
+            return True
+
+    @contextmanager
+    def capture(self, label: str = "request") -> Iterator[bool]:
+        """Perfila el bloque si el controlador está armado. Produce si se perfila.
+
+        Solo se registran las ops de CPU de este hilo (y las de GPU de todos):
+        con ``True`` el bloque debe ejecutar su trabajo aquí, no en workers.
+        """
+        if not self._claim():
+            yield False
+            return
+        try:
+            from torch.profiler import ProfilerActivity, profile
+
+            with profile(
+                activities=[ProfilerActivity.CPU, ProfilerActivity.CUDA],
+                record_shapes=True,
+                with_stack=False,
+            ) as prof:
+                yield True
+            self._export(prof, label)
+        finally:
+            self._active.release()
+
+    def _export(self, prof, label: str) -> None:
+        try:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            ts = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+            path = self.output_dir / f"{ts}_{label}_{os.getpid()}.json"
+            prof.export_chrome_trace(str(path))
+            self.saved.append(str(path))
+            print(f"Traza de profiler guardada en {path}")
+            if self.on_saved is not None:
+                self.on_saved()
+        except Exception as e:
+            print(f"No se pudo exportar la traza del profiler: {e}")
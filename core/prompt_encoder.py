@@ -1,11 +1,25 @@
-"""Codificación de prompts largos (>77 tokens) por chunking + concatenación.
+"""Codificación de prompts SDXL con pesos, chunking de 75 tokens, BREAK y clip_skip.
 
-Estilo lpw_stable_diffusion_xl: divide tokens en bloques de 75 contenido + BOS + EOS,
-encodea cada chunk por separado y concatena hidden states para mantener fidelidad.
+Un solo encoder para prompts cortos y largos (sustituye a Compel + fallback):
+
+  1. Parseo de pesos estilo A1111: ``(word:1.2)``, ``(word)`` ×1.1, ``[word]`` ÷1.1,
+     ``\\(`` para paréntesis literales y ``BREAK`` para forzar un chunk nuevo.
+  2. Tokenización sin truncar y división en chunks de 75 contenido + BOS + EOS
+     (estilo lpw_stable_diffusion_xl). El número de chunks sale del conteo de
+     tokens, sin depender de excepciones.
+  3. Un único forward por encoder con todos los chunks (positivos y negativos),
+     capa elegida según ``clip_skip``.
+  4. Pesos aplicados sobre los hidden states con restauración de la media por
+     chunk (como A1111), y concatenación de chunks.
+
+Los hidden states sin pesar se cachean por chunk con clave
+``(encoder, clip_skip, tuple(token_ids))``: los chunks constantes (post-prompt,
+negative fijo) se precalculan en ``load`` y solo se encodean los chunks nuevos.
 """
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Optional
+import re
+from typing import TYPE_CHECKING, Iterable, Optional
 
 from config.constants import CONTENT_TOKENS_PER_CHUNK, DEFAULT_CLIP_SKIP
 
@@ -13,15 +27,258 @@ if TYPE_CHECKING:
     import torch
     from diffusers import StableDiffusionXLPipeline
 
+    from core.embedding_cache import EmbeddingCache
+
+# Tokens de atención A1111: escapes, paréntesis, corchetes, ":peso)" y texto
+_ATTENTION_RE = re.compile(
+    r"""
+    \\\(|\\\)|\\\[|\\]|\\\\|\\|\(|\[|:\s*([+-]?[.\d]+)\s*\)|\)|]|[^\\()\[\]:]+|:
+    """,
+    re.X,
+)
+# Separador A1111: "BREAK" en mayúsculas como palabra suelta
+_BREAK_RE = re.compile(r"\s*\bBREAK\b\s*")
+
+_ROUND_MULTIPLIER = 1.1
+_SQUARE_MULTIPLIER = 1 / 1.1
+# Por debajo de esta media |z| no se restaura la media del chunk (evita dividir por ~0)
+_MEAN_EPS = 1e-6
+
+
+def parse_prompt_attention(text: str) -> list[tuple[str, Optional[float]]]:
+    """Parsea pesos estilo A1111 y devuelve fragmentos ``(texto, peso)``.
+
+    Los ``BREAK`` aparecen como ``("BREAK", None)``: el peso None es el marcador,
+    así un peso real como ``(word:-1)`` no se confunde con un BREAK y los
+    paréntesis que lo rodean no lo multiplican. Fragmentos contiguos con el
+    mismo peso se fusionan.
+
+    Ejemplo: ``"a (b:1.5) [c] BREAK d"`` → ``[("a ", 1.0), ("b", 1.5), (" ", 1.0),
+    ("c", 0.909), ("", 1.0), ("BREAK", None), ("d", 1.0)]``.
+    """
+    res: list[list] = []
+    round_brackets: list[int] = []
+    square_brackets: list[int] = []
+
+    def multiply_range(start: int, multiplier: float) -> None:
+        for p in range(start, len(res)):
+            if res[p][1] is not None:
+                res[p][1] *= multiplier
+
+    for m in _ATTENTION_RE.finditer(text):
+        token = m.group(0)
+        weight = m.group(1)
+        if token.startswith("\\"):
+            res.append([token[1:], 1.0])
+        elif token == "(":
+            round_brackets.append(len(res))
+        elif token == "[":
+            square_brackets.append(len(res))
+        elif weight is not None and round_brackets:
+            multiply_range(round_brackets.pop(), float(weight))
+        elif token == ")" and round_brackets:
+            multiply_range(round_brackets.pop(), _ROUND_MULTIPLIER)
+        elif token == "]" and square_brackets:
+            multiply_range(square_brackets.pop(), _SQUARE_MULTIPLIER)
+        else:
+            for i, part in enumerate(_BREAK_RE.split(token)):
+                if i > 0:
+                    res.append(["BREAK", None])
+                res.append([part, 1.0])
+
+    # Paréntesis sin cerrar: se aplican hasta el final
+    for pos in round_brackets:
+        multiply_range(pos, _ROUND_MULTIPLIER)
+    for pos in square_brackets:
+        multiply_range(pos, _SQUARE_MULTIPLIER)
+
+    if not res:
+        return [("", 1.0)]
+
+    merged: list[list] = [res[0]]
+    for frag, w in res[1:]:
+        if w is not None and w == merged[-1][1]:
+            merged[-1][0] += frag
+        else:
+            merged.append([frag, w])
+    return [(frag, w) for frag, w in merged]
+
+
+def _tokenize_no_trunc(tokenizer, text: str) -> list[int]:
+    """Tokeniza sin truncar y sin BOS/EOS."""
+    out = tokenizer(text, truncation=False, return_tensors="pt", padding=False)
+    ids = out.input_ids[0].tolist()
+    if (
+        len(ids) >= 2
+        and ids[0] == getattr(tokenizer, "bos_token_id", None)
+        and ids[-1] == tokenizer.eos_token_id
+    ):
+        ids = ids[1:-1]
+    return ids
+
+
+def _special_ids(tokenizer) -> tuple[int, int]:
+    """(bos_id, eos_id) del tokenizer; BOS cae a EOS si no existe."""
+    eos_id = tokenizer.eos_token_id
+    bos_id = tokenizer.bos_token_id if tokenizer.bos_token_id is not None else eos_id
+    return bos_id, eos_id
 
-def encode_long_prompt_sdxl(
+
+def _prompt_chunks(
+    tokenizer, text: str
+) -> tuple[list[list[int]], list[list[float]]]:
+    """Divide el prompt en chunks de 77 ids (BOS + 75 contenido + EOS/padding).
+
+    Cada BREAK empieza un chunk nuevo. BOS/EOS/padding llevan peso 1.0.
+
+    Returns:
+        (chunks_de_ids, chunks_de_pesos)
+    """
+    bos_id, eos_id = _special_ids(tokenizer)
+    chunks: list[list[int]] = []
+    weights: list[list[float]] = []
+    cur_ids: list[int] = []
+    cur_w: list[float] = []
+
+    def _flush() -> None:
+        pad_len = CONTENT_TOKENS_PER_CHUNK - len(cur_ids)
+        chunks.append([bos_id] + cur_ids + [eos_id] * (pad_len + 1))
+        weights.append([1.0] + cur_w + [1.0] * (pad_len + 1))
+        cur_ids.clear()
+        cur_w.clear()
+
+    for frag, w in parse_prompt_attention(text):
+        if w is None:
+            if cur_ids:
+                _flush()
+            continue
+        if not frag.strip():
+            continue
+        for tok in _tokenize_no_trunc(tokenizer, frag):
+            if len(cur_ids) == CONTENT_TOKENS_PER_CHUNK:
+                _flush()
+            cur_ids.append(tok)
+            cur_w.append(w)
+    if cur_ids:
+        _flush()
+    return chunks, weights
+
+
+def count_prompt_tokens(tokenizer, text: str) -> int:
+    """Número de tokens de contenido (sin BOS/EOS ni padding) del prompt."""
+    return sum(
+        len(_tokenize_no_trunc(tokenizer, frag))
+        for frag, w in parse_prompt_attention(text)
+        if w is not None and frag.strip()
+    )
+
+
+def _empty_chunk(tokenizer) -> list[int]:
+    """Chunk de padding: BOS + EOS * 76."""
+    bos_id, eos_id = _special_ids(tokenizer)
+    return [bos_id] + [eos_id] * (CONTENT_TOKENS_PER_CHUNK + 1)
+
+
+def _effective_clip_skip(encoder, clip_skip: Optional[int]) -> int:
+    """clip_skip estilo A1111: 1 = última capa, 2 = penúltima (default SDXL), ..."""
+    if clip_skip is None:
+        clip_skip = DEFAULT_CLIP_SKIP
+    return max(1, min(int(clip_skip), encoder.config.num_hidden_layers))
+
+
+def _encode_chunks(
+    encoder,
+    name: str,
+    chunks: list[list[int]],
+    clip_skip: int,
+    device,
+    dtype: "torch.dtype",
+    cache: Optional["EmbeddingCache"] = None,
+    with_pooled: bool = False,
+    pin: bool = False,
+) -> tuple["torch.Tensor", Optional["torch.Tensor"]]:
+    """Encodea chunks en un solo forward, reutilizando los que estén en cache.
+
+    Los chunks repetidos (p. ej. padding) se encodean una sola vez.
+
+    Returns:
+        (hidden [n, 77, D], pooled [n, P] o None) en ``dtype``.
+    """
+    import torch
+
+    results: list[Optional[tuple["torch.Tensor", ...]]] = [None] * len(chunks)
+    missing: dict[tuple[int, ...], list[int]] = {}
+    for i, chunk in enumerate(chunks):
+        ids = tuple(chunk)
+        if ids in missing:
+            missing[ids].append(i)
+            continue
+        hit = cache.get((name, clip_skip, ids)) if cache is not None else None
+        if hit is not None:
+            results[i] = hit
+        else:
+            missing[ids] = [i]
+
+    if missing:
+        uniq = list(missing)
+        batch = torch.tensor(uniq, dtype=torch.long, device=device)
+        with torch.no_grad():
+            out = encoder(batch, output_hidden_states=True)
+        if clip_skip == 1:
+            hidden = out.last_hidden_state.to(dtype)
+        else:
+            hidden = out.hidden_states[-clip_skip].to(dtype)
+        pooled = out[0].to(dtype) if with_pooled else None
+        for j, ids in enumerate(uniq):
+            # clone: no retener el batch completo a través de vistas
+            entry: tuple["torch.Tensor", ...] = (hidden[j].clone(),)
+            if pooled is not None:
+                entry += (pooled[j].clone(),)
+            if cache is not None:
+                cache.put((name, clip_skip, ids), entry, pin=pin)
+            for i in missing[ids]:
+                results[i] = entry
+
+    hidden = torch.stack([r[0] for r in results])
+    pooled = torch.stack([r[1] for r in results]) if with_pooled else None
+    return hidden, pooled
+
+
+def _apply_weights(hidden: "torch.Tensor", weights: list[list[float]]) -> "torch.Tensor":
+    """Multiplica cada token por su peso y restaura la media por chunk (A1111).
+
+    Si la media pesada de un chunk queda en ~0 (pesos que se cancelan) ese chunk
+    no se reescala.
+    """
+    import torch
+
+    if all(w == 1.0 for chunk in weights for w in chunk):
+        return hidden
+    w = torch.tensor(weights, dtype=torch.float32, device=hidden.device)
+    z = hidden.float()
+    original_mean = z.mean(dim=(1, 2), keepdim=True)
+    z = z * w.unsqueeze(-1)
+    new_mean = z.mean(dim=(1, 2), keepdim=True)
+    usable = new_mean.abs() > _MEAN_EPS
+    scale = torch.where(usable, original_mean / torch.where(usable, new_mean, 1.0), 1.0)
+    z = z * scale
+    return z.to(hidden.dtype)
+
+
+def encode_prompt_sdxl(
     pipe: StableDiffusionXLPipeline,
     full_prompt: str,
-    full_negative: str,
-    clip_skip: int = DEFAULT_CLIP_SKIP,
+    full_negative: Optional[str],
+    clip_skip: Optional[int] = DEFAULT_CLIP_SKIP,
     device: Optional[str] = None,
+    chunk_cache: Optional["EmbeddingCache"] = None,
 ) -> tuple["torch.Tensor", "torch.Tensor", "torch.Tensor", "torch.Tensor"]:
-    """Codifica prompt y negative largos por chunking + concat.
+    """Codifica prompt y negative (con pesos) en un solo forward por encoder.
+
+    Prompts cortos producen un chunk y largos N chunks; ambos comparten el mismo
+    camino. Con ``chunk_cache`` solo se encodean los chunks que no estén ya
+    cacheados. Con ``full_negative=None`` (sin CFG) el negative no se encodea y
+    se devuelven ceros en su lugar.
 
     Devuelve (prompt_embeds, negative_embeds, pooled_positive, pooled_negative).
     """
@@ -30,99 +287,116 @@ def encode_long_prompt_sdxl(
     device = device or pipe._execution_device
     tok1, tok2 = pipe.tokenizer, pipe.tokenizer_2
     enc1, enc2 = pipe.text_encoder, pipe.text_encoder_2
-    eos_id1 = tok1.eos_token_id
-    eos_id2 = tok2.eos_token_id
-    bos_id1 = tok1.bos_token_id if tok1.bos_token_id is not None else eos_id1
-    bos_id2 = tok2.bos_token_id if tok2.bos_token_id is not None else eos_id2
-
-    def _tokenize_no_trunc(tokenizer, text: str) -> list[int]:
-        out = tokenizer(text, truncation=False, return_tensors="pt", padding=False)
-        ids = out.input_ids[0].tolist()
-        if (
-            len(ids) >= 2
-            and ids[0] == getattr(tokenizer, "bos_token_id", None)
-            and ids[-1] == tokenizer.eos_token_id
-        ):
-            ids = ids[1:-1]
-        return ids
-
-    def _chunk_ids(ids: list[int], bos_id: int, eos_id: int) -> list[list[int]]:
-        chunks: list[list[int]] = []
-        i = 0
-        while i < len(ids):
-            block = ids[i : i + CONTENT_TOKENS_PER_CHUNK]
-            i += len(block)
-            pad_len = CONTENT_TOKENS_PER_CHUNK - len(block)
-            chunk = [bos_id] + block + [eos_id] * (pad_len + 1)
-            chunks.append(chunk)
-        return chunks
-
-    # Tokenizar sin truncar
-    p1 = _tokenize_no_trunc(tok1, full_prompt)
-    p2 = _tokenize_no_trunc(tok2, full_prompt)
-    n1 = _tokenize_no_trunc(tok1, full_negative)
-    n2 = _tokenize_no_trunc(tok2, full_negative)
-
-    cp1 = _chunk_ids(p1, bos_id1, eos_id1)
-    cp2 = _chunk_ids(p2, bos_id2, eos_id2)
-    cn1 = _chunk_ids(n1, bos_id1, eos_id1)
-    cn2 = _chunk_ids(n2, bos_id2, eos_id2)
-
-    num_chunks = max(len(cp1), len(cp2), len(cn1), len(cn2))
-    if num_chunks == 0:
-        num_chunks = 1
+    dtype = enc2.dtype
+
+    cp1, wp1 = _prompt_chunks(tok1, full_prompt)
+    cp2, wp2 = _prompt_chunks(tok2, full_prompt)
+    with_negative = full_negative is not None
+    rows = 2 if with_negative else 1  # prompts encodeados: positivo (+ negativo)
+    cn1, wn1 = _prompt_chunks(tok1, full_negative) if with_negative else ([], [])
+    cn2, wn2 = _prompt_chunks(tok2, full_negative) if with_negative else ([], [])
+
+    num_chunks = max(len(cp1), len(cp2), len(cn1), len(cn2), 1)
 
     # Rellenar con chunks de padding si hace falta
-    def _pad_chunks(chunks: list[list[int]], bos: int, eos: int) -> list[list[int]]:
+    def _pad_chunks(chunks: list[list[int]], weights: list[list[float]], tokenizer):
         while len(chunks) < num_chunks:
-            chunks.append([bos] + [eos] * (CONTENT_TOKENS_PER_CHUNK + 1))
-        return chunks
-
-    cp1 = _pad_chunks(cp1, bos_id1, eos_id1)
-    cp2 = _pad_chunks(cp2, bos_id2, eos_id2)
-    cn1 = _pad_chunks(cn1, bos_id1, eos_id1)
-    cn2 = _pad_chunks(cn2, bos_id2, eos_id2)
-
-    # Misma capa que Compel (penúltima) para consistencia
-    layer_idx = -2  # PENULTIMATE_HIDDEN_STATES
-    pooled_pos = None
-    pooled_neg = None
-    dtype = enc2.dtype
-    embeds_pos: list[torch.Tensor] = []
-    embeds_neg: list[torch.Tensor] = []
-
-    for i in range(num_chunks):
-        # Positive
-        t1 = torch.tensor([cp1[i]], dtype=torch.long, device=device)
-        t2 = torch.tensor([cp2[i]], dtype=torch.long, device=device)
-        o1 = enc1(t1, output_hidden_states=True)
-        o2 = enc2(t2, output_hidden_states=True)
-        if i == 0:
-            pooled_pos = o2[0]
-        h1 = o1.hidden_states[layer_idx].to(dtype)
-        h2 = o2.hidden_states[layer_idx].to(dtype)
-        embeds_pos.append(torch.cat([h1, h2], dim=-1))
-
-        # Negative
-        t1n = torch.tensor([cn1[i]], dtype=torch.long, device=device)
-        t2n = torch.tensor([cn2[i]], dtype=torch.long, device=device)
-        o1n = enc1(t1n, output_hidden_states=True)
-        o2n = enc2(t2n, output_hidden_states=True)
-        if i == 0:
-            pooled_neg = o2n[0]
-        h1n = o1n.hidden_states[layer_idx].to(dtype)
-        h2n = o2n.hidden_states[layer_idx].to(dtype)
-        embeds_neg.append(torch.cat([h1n, h2n], dim=-1))
-
-    prompt_embeds = torch.cat(embeds_pos, dim=1)
-    negative_embeds = torch.cat(embeds_neg, dim=1)
-
-    if pooled_pos is None:
-        pooled_pos = enc2(torch.tensor([cp2[0]], dtype=torch.long, device=device))[0]
-    if pooled_neg is None:
-        pooled_neg = enc2(torch.tensor([cn2[0]], dtype=torch.long, device=device))[0]
-
-    pooled_pos = pooled_pos.to(dtype)
-    pooled_neg = pooled_neg.to(dtype)
+            chunks.append(_empty_chunk(tokenizer))
+            weights.append([1.0] * (CONTENT_TOKENS_PER_CHUNK + 2))
+        return chunks, weights
+
+    cp1, wp1 = _pad_chunks(cp1, wp1, tok1)
+    cp2, wp2 = _pad_chunks(cp2, wp2, tok2)
+    if with_negative:
+        cn1, wn1 = _pad_chunks(cn1, wn1, tok1)
+        cn2, wn2 = _pad_chunks(cn2, wn2, tok2)
+
+    # Un solo forward por encoder: [positivos..., negativos...] → [rows*num_chunks, 77]
+    h1, _ = _encode_chunks(
+        enc1,
+        "text_encoder",
+        cp1 + cn1,
+        _effective_clip_skip(enc1, clip_skip),
+        device,
+        dtype,
+        chunk_cache,
+    )
+    h2, pooled = _encode_chunks(
+        enc2,
+        "text_encoder_2",
+        cp2 + cn2,
+        _effective_clip_skip(enc2, clip_skip),
+        device,
+        dtype,
+        chunk_cache,
+        with_pooled=True,
+    )
+    # Pesos por encoder: cada tokenizer asigna sus propios pesos por token
+    h1 = _apply_weights(h1, wp1 + wn1)
+    h2 = _apply_weights(h2, wp2 + wn2)
+    hidden = torch.cat([h1, h2], dim=-1)  # [rows*num_chunks, 77, 2048]
+
+    # Las filas son contiguas por chunk: reshape equivale a concatenar en dim=1
+    hidden = hidden.reshape(rows, num_chunks * hidden.shape[1], hidden.shape[-1])
+    prompt_embeds = hidden[0:1]
+
+    # Pooled del primer chunk de cada prompt (text_encoder_2)
+    pooled_pos = pooled[0:1]
+    if with_negative:
+        negative_embeds = hidden[1:2]
+        pooled_neg = pooled[num_chunks : num_chunks + 1]
+    else:
+        negative_embeds = torch.zeros_like(prompt_embeds)
+        pooled_neg = torch.zeros_like(pooled_pos)
 
     return prompt_embeds, negative_embeds, pooled_pos, pooled_neg
+
+
+def prewarm_chunk_cache(
+    pipe: StableDiffusionXLPipeline,
+    texts: Iterable[str],
+    chunk_cache: "EmbeddingCache",
+    clip_skip: Optional[int] = DEFAULT_CLIP_SKIP,
+    device: Optional[str] = None,
+) -> int:
+    """Precalcula y fija en cache los chunks de textos constantes.
+
+    Pensado para ``load`` con GPU snapshot: los tensores quedan en la imagen
+    restaurada y no se recalculan en ningún request.
+
+    Returns:
+        Número de chunks distintos fijados por encoder.
+    """
+    device = device or pipe._execution_device
+    tok1, tok2 = pipe.tokenizer, pipe.tokenizer_2
+    enc1, enc2 = pipe.text_encoder, pipe.text_encoder_2
+    dtype = enc2.dtype
+
+    chunks1: list[list[int]] = [_empty_chunk(tok1)]
+    chunks2: list[list[int]] = [_empty_chunk(tok2)]
+    for text in texts:
+        chunks1 += _prompt_chunks(tok1, text)[0]
+        chunks2 += _prompt_chunks(tok2, text)[0]
+
+    _encode_chunks(
+        enc1,
+        "text_encoder",
+        chunks1,
+        _effective_clip_skip(enc1, clip_skip),
+        device,
+        dtype,
+        chunk_cache,
+        pin=True,
+    )
+    _encode_chunks(
+        enc2,
+        "text_encoder_2",
+        chunks2,
+        _effective_clip_skip(enc2, clip_skip),
+        device,
+        dtype,
+        chunk_cache,
+        with_pooled=True,
+        pin=True,
+    )
+    return len({tuple(c) for c in chunks1})
@@ -0,0 +1,275 @@
+"""Cache de resultados direccionada por contenido para requests deterministas.
+
+Con ``seed`` fija, un request queda determinado por sus parámetros, el
+checkpoint y el código. La clave es el SHA-256 del JSON canónico de todo eso;
+las imágenes ya codificadas se guardan en el Volume
+(``/cache/results/<ab>/<clave>/``) con expulsión LRU por tamaño total, y las
+más recientes se mantienen además en memoria.
+
+El orden LRU (clave → bytes) se guarda compacto en ``index.json``: al arrancar
+el contenedor solo se lee ese fichero, sin recorrer las entradas. Si falta o
+está corrupto, se reconstruye desde los ``meta.json`` en segundo plano.
+
+Las escrituras se hacen en un hilo de fondo para no sumar I/O del Volume a la
+latencia del request que produjo el resultado. Cada escritura funde en el
+índice las entradas que hayan añadido otros contenedores antes de guardarlo.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+META_NAME = "meta.json"
+INDEX_NAME = "index.json"
+# Código que afecta al resultado: si cambia, cambia la clave
+_CODE_DIRS = ("core", "model")
+_CODE_FILES = ("config/constants.py",)
+
+
+@lru_cache(maxsize=1)
+def code_version() -> str:
+    """Hash corto de las fuentes que influyen en la imagen generada."""
+    root = Path(__file__).resolve().parent.parent
+    files = sorted(
+        [p for d in _CODE_DIRS for p in (root / d).glob("*.py")]
+        + [root / f for f in _CODE_FILES if (root / f).exists()]
+    )
+    h = hashlib.sha256()
+    for p in files:
+        h.update(p.relative_to(root).as_posix().encode())
+        h.update(p.read_bytes())
+    return h.hexdigest()[:16]
+
+
+def result_cache_key(params: dict[str, Any]) -> str:
+    """SHA-256 del JSON canónico de ``params`` (claves ordenadas, sin espacios)."""
+    canonical = json.dumps(params, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ResultCache:
+    """Imágenes codificadas por clave, en el Volume (LRU por bytes) y en memoria.
+
+    Args:
+        directory: Carpeta del Volume (``/cache/results``).
+        max_bytes: Tamaño máximo en disco; se expulsan las entradas menos usadas.
+        memory_max_bytes: Tamaño máximo del hot set en memoria.
+        commit: Callable que persiste el Volume tras cada escritura.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int,
+        memory_max_bytes: int,
+        commit: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.directory = Path(directory)
+        self.max_bytes = int(max_bytes)
+        self.memory_max_bytes = int(memory_max_bytes)
+        self.commit = commit
+        self._lock = threading.Lock()
+        # Índice del disco: clave → bytes, en orden LRU (último = más reciente)
+        self._index: OrderedDict[str, int] = OrderedDict()
+        self._disk_bytes = 0
+        self._memory: OrderedDict[str, tuple[list[bytes], dict]] = OrderedDict()
+        self._memory_bytes = 0
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="result-cache")
+        self.hits = 0
+        self.misses = 0
+        self._load_index()
+
+    def _entry_dir(self, key: str) -> Path:
+        return self.directory / key[:2] / key
+
+    def _read_index_file(self) -> Optional[list[tuple[str, int]]]:
+        """Entradas de ``index.json`` en orden LRU, o None si falta o está corrupto."""
+        try:
+            data = json.loads((self.directory / INDEX_NAME).read_text())
+            return [(str(key), int(size)) for key, size in data["entries"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _load_index(self) -> None:
+        """Carga el índice desde ``index.json`` (un solo fichero, sin recorrer el cache)."""
+        if not self.directory.exists():
+            return
+        entries = self._read_index_file()
+        if entries is None:
+            # Sin índice: se reconstruye en el hilo de escritura, fuera del arranque
+            self._writer.submit(self._rebuild_index)
+            return
+        for key, size in entries:
+            self._index[key] = size
+            self._disk_bytes += size
+
+    def _rebuild_index(self) -> None:
+        """Recorre los ``meta.json`` del Volume y guarda el índice (hilo de escritura)."""
+        entries = []
+        for meta in self.directory.glob(f"*/*/{META_NAME}"):
+            try:
+                info = json.loads(meta.read_text())
+                entries.append((meta.stat().st_mtime, meta.parent.name, int(info["bytes"])))
+            except (OSError, ValueError, KeyError):
+                continue
+        with self._lock:
+            # Lo ya conocido (escrito o leído desde el arranque) es más reciente
+            for _, key, size in sorted(entries, reverse=True):
+                if key not in self._index:
+                    self._index[key] = size
+                    self._index.move_to_end(key, last=False)
+                    self._disk_bytes += size
+        try:
+            self._sync_index()
+            if self.commit is not None:
+                self.commit()
+        except Exception as e:
+            print(f"ResultCache: no se pudo guardar el índice reconstruido: {e}")
+
+    def _sync_index(self) -> None:
+        """Funde ``index.json`` con el índice propio, expulsa por LRU y lo guarda.
+
+        Solo en el hilo de escritura. Las claves que solo conoce el fichero
+        (escritas por otros contenedores) entran como las menos recientes si su
+        entrada sigue en el Volume.
+        """
+        path = self.directory / INDEX_NAME
+        foreign = [
+            (key, size)
+            for key, size in reversed(self._read_index_file() or [])
+            if key not in self._index and (self._entry_dir(key) / META_NAME).exists()
+        ]
+        with self._lock:
+            for key, size in foreign:
+                if key not in self._index:
+                    self._index[key] = size
+                    self._index.move_to_end(key, last=False)
+                    self._disk_bytes += size
+            evicted = self._pop_lru()
+            entries = [[key, size] for key, size in self._index.items()]
+        for old_key in evicted:
+            shutil.rmtree(self._entry_dir(old_key), ignore_errors=True)
+        tmp_path = path.with_name(f"{INDEX_NAME}.tmp-{os.getpid()}")
+        tmp_path.write_text(json.dumps({"entries": entries}, separators=(",", ":")))
+        os.replace(tmp_path, path)
+
+    def get(self, key: str) -> Optional[tuple[list[bytes], dict]]:
+        """Devuelve ``(imágenes, meta)`` o ``None``. No toca la GPU."""
+        with self._lock:
+            hit = self._memory.get(key)
+            if hit is not None:
+                self._memory.move_to_end(key)
+                if key in self._index:
+                    self._index.move_to_end(key)
+                self.hits += 1
+                return hit
+        entry = self._read_entry(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                if key in self._index:
+                    # Expulsada por otro contenedor
+                    self._disk_bytes -= self._index.pop(key)
+                return None
+            self.hits += 1
+            if key not in self._index:
+                # Escrita por otro contenedor
+                self._index[key] = entry[1]["bytes"]
+                self._disk_bytes += entry[1]["bytes"]
+            self._index.move_to_end(key)
+            self._remember(key, entry)
+        return entry
+
+    def _read_entry(self, key: str) -> Optional[tuple[list[bytes], dict]]:
+        entry_dir = self._entry_dir(key)
+        meta_path = entry_dir / META_NAME
+        try:
+            meta = json.loads(meta_path.read_text())
+            images = [(entry_dir / name).read_bytes() for name in meta["files"]]
+            os.utime(meta_path)  # último uso, para el orden LRU entre contenedores
+        except (OSError, ValueError, KeyError):
+            return None
+        return images, meta
+
+    def _remember(self, key: str, entry: tuple[list[bytes], dict]) -> None:
+        """Añade al hot set en memoria (con el lock tomado)."""
+        size = entry[1]["bytes"]
+        if size > self.memory_max_bytes:
+            return
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = entry
+        self._memory_bytes += size
+        while self._memory_bytes > self.memory_max_bytes:
+            _, (_, old_meta) = self._memory.popitem(last=False)
+            self._memory_bytes -= old_meta["bytes"]
+
+    def put(
+        self, key: str, images: list[bytes], extension: str, meta: Optional[dict] = None
+    ) -> None:
+        """Guarda el resultado: en memoria ya, en el Volume en segundo plano."""
+        files = [f"{i}.{extension}" for i in range(len(images))]
+        info = {**(meta or {}), "files": files, "bytes": sum(len(b) for b in images)}
+        with self._lock:
+            self._remember(key, (list(images), info))
+        self._writer.submit(self._write_entry, key, list(images), info)
+
+    def _write_entry(self, key: str, images: list[bytes], info: dict) -> None:
+        entry_dir = self._entry_dir(key)
+        tmp_dir = entry_dir.with_name(f"{key}.tmp-{os.getpid()}")
+        try:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            tmp_dir.mkdir(parents=True)
+            for name, data in zip(info["files"], images):
+                (tmp_dir / name).write_bytes(data)
+            # meta.json al final: una entrada sin meta nunca se considera válida
+            (tmp_dir / META_NAME).write_text(json.dumps(info, sort_keys=True))
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(tmp_dir, entry_dir)
+            with self._lock:
+                self._disk_bytes += info["bytes"] - self._index.get(key, 0)
+                self._index[key] = info["bytes"]
+                self._index.move_to_end(key)
+            self._sync_index()
+            if self.commit is not None:
+                self.commit()
+        except Exception as e:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            print(f"ResultCache: no se pudo guardar {key[:12]}: {e}")
+
+    def _pop_lru(self) -> list[str]:
+        """Saca del índice las entradas más antiguas hasta caber en ``max_bytes``."""
+        evicted = []
+        while self._disk_bytes > self.max_bytes and len(self._index) > 1:
+            old_key, size = self._index.popitem(last=False)
+            self._disk_bytes -= size
+            evicted.append(old_key)
+        return evicted
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._index),
+                "disk_bytes": self._disk_bytes,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+            }
+
+    def flush(self) -> None:
+        """Espera a que terminen las escrituras ya encoladas."""
+        self._writer.submit(lambda: None).result()
+
+    def close(self) -> None:
+        """Espera a que terminen las escrituras pendientes."""
+        self._writer.shutdown(wait=True)
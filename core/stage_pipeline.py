@@ -0,0 +1,142 @@
+"""Ejecución por etapas con colas acotadas entre ellas.
+
+``StagePipeline`` encadena etapas (p. ej. detección CPU → inpainting GPU →
+codificación CPU), cada una con sus propios hilos y una cola de entrada de
+tamaño fijo. Mientras la GPU refina el request N, la CPU ya detecta caras del
+N+1 y codifica el N-1; si una etapa se atasca, las colas llenas frenan a las
+anteriores (backpressure) en lugar de acumular imágenes en memoria.
+
+No depende de torch: se puede medir el throughput en CPU con etapas falsas
+(``time.sleep``).
+"""
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Callable, Sequence
+
+_STOP = object()
+
+
+@dataclass(frozen=True)
+class Stage:
+    """Etapa del pipeline.
+
+    Args:
+        name: Nombre (para hilos y estadísticas).
+        fn: Recibe el item de la etapa anterior y devuelve el de la siguiente.
+        workers: Hilos de la etapa; 1 para etapas de GPU (ya serializadas).
+        queue_size: Items que pueden esperar a la entrada de la etapa.
+    """
+
+    name: str
+    fn: Callable[[Any], Any]
+    workers: int = 1
+    queue_size: int = 4
+
+
+class StagePipeline:
+    """Pipeline de etapas con hilos propios; ``submit`` devuelve un ``Future``.
+
+    Un error en una etapa se propaga al ``Future`` del item y el item no pasa
+    a las siguientes.
+    """
+
+    def __init__(self, stages: Sequence[Stage]) -> None:
+        if not stages:
+            raise ValueError("StagePipeline necesita al menos una etapa")
+        self.stages = list(stages)
+        self._queues: list[queue.Queue] = [
+            queue.Queue(maxsize=max(1, s.queue_size)) for s in self.stages
+        ]
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stats = {s.name: {"processed": 0, "errors": 0, "busy_s": 0.0} for s in self.stages}
+        self._threads: list[list[threading.Thread]] = []
+        for index, stage in enumerate(self.stages):
+            threads = [
+                threading.Thread(
+                    target=self._loop,
+                    args=(index,),
+                    name=f"stage-{stage.name}-{i}",
+                    daemon=True,
+                )
+                for i in range(max(1, stage.workers))
+            ]
+            for t in threads:
+                t.start()
+            self._threads.append(threads)
+
+    def submit(self, item: Any) -> Future:
+        """Encola un item en la primera etapa (bloquea si su cola está llena)."""
+        if self._closed:
+            raise RuntimeError("StagePipeline cerrado")
+        fut: Future = Future()
+        self._queues[0].put((item, fut))
+        return fut
+
+    def run_inline(self, item: Any) -> Any:
+        """Pasa ``item`` por todas las etapas en el hilo actual, sin colas.
+
+        Para requests perfilados: ``torch.profiler`` solo registra las ops de
+        CPU del hilo en el que se inició.
+        """
+        for stage in self.stages:
+            t0 = time.perf_counter()
+            try:
+                item = stage.fn(item)
+            except BaseException:
+                self._count(stage.name, time.perf_counter() - t0, error=True)
+                raise
+            self._count(stage.name, time.perf_counter() - t0)
+        return item
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        """Por etapa: items procesados, errores, segundos ocupada y cola actual."""
+        with self._lock:
+            return {
+                name: {**values, "queued": self._queues[i].qsize()}
+                for i, (name, values) in enumerate(self._stats.items())
+            }
+
+    def close(self) -> None:
+        """Termina lo encolado etapa por etapa y detiene los hilos."""
+        self._closed = True
+        for index, threads in enumerate(self._threads):
+            for _ in threads:
+                self._queues[index].put(_STOP)
+            for t in threads:
+                t.join()
+
+    def _loop(self, index: int) -> None:
+        stage = self.stages[index]
+        inbox = self._queues[index]
+        outbox = self._queues[index + 1] if index + 1 < len(self._queues) else None
+        while True:
+            entry = inbox.get()
+            if entry is _STOP:
+                return
+            item, fut = entry
+            t0 = time.perf_counter()
+            try:
+                result = stage.fn(item)
+            except BaseException as e:  # noqa: BLE001 - se propaga al llamante
+                self._count(stage.name, time.perf_counter() - t0, error=True)
+                fut.set_exception(e)
+                continue
+            self._count(stage.name, time.perf_counter() - t0)
+            if outbox is None:
+                fut.set_result(result)
+            else:
+                outbox.put((result, fut))
+
+    def _count(self, name: str, seconds: float, error: bool = False) -> None:
+        with self._lock:
+            values = self._stats[name]
+            values["processed"] += 1
+            values["busy_s"] += seconds
+            if error:
+                values["errors"] += 1
@@ -1,42 +1,160 @@
 """Clase Modal NovaAnimeModel: carga del pipeline SDXL, inferencia y refinado.
 
 Encapsula todo el ciclo de vida del modelo en un contenedor GPU de Modal:
-  1. @modal.enter → carga checkpoint, VAE, Compel, PAG, pipeline de inpainting.
-  2. predict / predict_one → genera imágenes con Compel/chunking + PAG + face refine.
-  3. get_timing_report → resumen de tiempos acumulados en el Volume.
+  1. @modal.enter → carga checkpoint, VAE, PAG, pipeline de inpainting.
+  2. predict / predict_one → genera imágenes con prompts ponderados + PAG + face refine.
+  3. get_timing_report → percentiles y resumen diario de tiempos (agregados en el Volume).
 """
 from __future__ import annotations
 
 import os
+import queue
+import threading
 import time
-from datetime import datetime, timezone
-from io import BytesIO
-from pathlib import Path
-from typing import Optional, Union
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, Iterator, Optional, Union
 
 import modal
 
 from config.constants import (
+    BATCH_MAX_SIZE,
+    BATCH_MAX_WAIT_MS,
+    CHUNK_EMBED_CACHE_MAX_MB,
+    DEFAULT_CFG_END,
     DEFAULT_CLIP_SKIP,
+    DEFAULT_FEATURE_CACHE_INTERVAL,
     DEFAULT_GUIDANCE,
     DEFAULT_GUIDANCE_RESCALE,
     DEFAULT_HEIGHT,
     DEFAULT_NEGATIVE,
-    DEFAULT_STEPS,
+    DEFAULT_OUTPUT_FORMAT,
+    DEFAULT_OUTPUT_QUALITY,
+    DEFAULT_PAG_END,
+    DEFAULT_PNG_COMPRESS_LEVEL,
+    DEFAULT_USER_NEGATIVE,
     DEFAULT_WIDTH,
+    FACE_DETECT_WORKERS,
+    FACE_REFINE_RESOLUTION,
+    FINALIZE_WORKERS,
+    IMAGE_ENCODE_WORKERS,
+    INFERENCE_TIMES_WINDOW,
+    MAX_CONCURRENT_INPUTS,
+    MEMORY_ACTIVATION_BUDGET_GB,
+    METRICS_FLUSH_INTERVAL_S,
+    METRICS_FLUSH_MAX_RECORDS,
+    POSTPROCESS_QUEUE_SIZE,
+    PREVIEW_EVERY_STEPS,
+    PROMPT_EMBED_CACHE_MAX_MB,
+    RESULT_CACHE_MAX_MB,
+    RESULT_CACHE_MEMORY_MB,
     REPLICATE_POST_PROMPT,
     REPLICATE_PRE_NEGATIVE,
     REPLICATE_PREPROMPT,
 )
 from config.infrastructure import (
     CACHE_DIR,
-    TIMING_REPORT_PATH,
+    PROFILES_DIR,
+    RESULT_CACHE_DIR,
+    TIMING_DIR,
     app,
     volume,
 )
-from core.checkpoint import get_checkpoint_path
-from core.face_refiner import refine_faces
-from core.prompt_encoder import encode_long_prompt_sdxl
+from core.batcher import RequestBatcher, per_sample_scale
+from core.buckets import snap_to_bucket as nearest_bucket
+from core.checkpoint import get_checkpoint_id, get_checkpoint_path
+from core.converted_cache import load_sdxl_pipeline
+from core.embedding_cache import EmbeddingCache
+from core.face_refiner import (
+    FaceCrop,
+    build_inpaint_pipeline,
+    detect_faces,
+    inpaint_face_crops,
+    paste_face_crops,
+    plan_face_crops,
+)
+from core.feature_cache import feature_cache
+from core.guidance import TRUNCATION_TENSOR_INPUTS, GuidanceTruncation
+from core.image_encoder import encode_images, extension_for, normalize_format
+from core.memory_planner import apply_memory_plan, plan_memory
+from core.metrics import MetricsWriter, build_report
+from core.previews import PredictedX0, PreviewFrame, latents_to_rgb, rgb_to_jpeg
+from core.profiling import ProfilerController, StageTimer
+from core.result_cache import ResultCache, code_version, result_cache_key
+from core.stage_pipeline import Stage, StagePipeline
+from core.schedulers import (
+    DEFAULT_SCHEDULER,
+    build_schedulers,
+    default_steps,
+    normalize_scheduler_name,
+)
+from core.prompt_encoder import encode_prompt_sdxl, prewarm_chunk_cache
+
+if TYPE_CHECKING:
+    import torch
+    from PIL import Image
+
+
+@dataclass
+class _GenerationJob:
+    """Trabajo de denoising de un request, listo para agruparse en batch."""
+
+    prompt_embeds: "torch.Tensor"
+    negative_embeds: "torch.Tensor"
+    pooled_positive: "torch.Tensor"
+    pooled_negative: "torch.Tensor"
+    num_outputs: int
+    seed: Optional[int]
+    num_inference_steps: int
+    scheduler: str
+    guidance_scale: float
+    guidance_rescale: float
+    pag_scale: float
+    width: int
+    height: int
+    feature_cache_interval: int = DEFAULT_FEATURE_CACHE_INTERVAL
+    cfg_end: float = DEFAULT_CFG_END
+    pag_end: float = DEFAULT_PAG_END
+
+    def batch_key(self) -> tuple:
+        """Requests con la misma clave pueden compartir un batch de UNet."""
+        return (
+            self.width,
+            self.height,
+            self.num_inference_steps,
+            self.scheduler,
+            self.pag_scale > 0,
+            self.guidance_scale > 1,
+            self.guidance_rescale,
+            self.prompt_embeds.shape[1],
+            self.feature_cache_interval,
+            self.cfg_end,
+            self.pag_end,
+        )
+
+
+@dataclass
+class _PostprocessJob:
+    """Imágenes de un request ya generadas, en tránsito por el pipeline por etapas."""
+
+    images: list["Image.Image"]
+    timer: StageTimer
+    output_format: str
+    output_quality: int
+    png_compress_level: int
+    resize_to: Optional[tuple[int, int]] = None
+    # Refinado de caras (embeds=None → desactivado)
+    embeds: Optional[tuple["torch.Tensor", "torch.Tensor", "torch.Tensor", "torch.Tensor"]] = None
+    scheduler: str = DEFAULT_SCHEDULER
+    num_inference_steps: int = 20
+    guidance_scale: float = DEFAULT_GUIDANCE
+    seed: Optional[int] = None
+    on_stage: Optional[Callable[[str], None]] = None
+    crops: Optional[list[FaceCrop]] = None
+    refined: Optional[list["Image.Image"]] = None
+    encoded: Optional[list[bytes]] = None
 
 
 @app.cls(
@@ -48,6 +166,7 @@ from core.prompt_encoder import encode_long_prompt_sdxl
     volumes={CACHE_DIR: volume},
     secrets=[modal.Secret.from_name("nova-anime-checkpoint")],
 )
+@modal.concurrent(max_inputs=MAX_CONCURRENT_INPUTS)
 class NovaAnimeModel:
     """Modelo Nova Anime IL (SDXL) en Modal.
 
@@ -60,79 +179,108 @@ class NovaAnimeModel:
     # ------------------------------------------------------------------
     @modal.enter(snap=True)
     def load(self) -> None:
-        """Carga el pipeline SDXL, VAE, Compel, PAG e inpainting al arrancar el contenedor.
+        """Carga el pipeline SDXL, VAE, PAG e inpainting al arrancar el contenedor.
 
         Con GPU Memory Snapshot (snap=True), todo el estado de GPU se captura
         después de esta función. Los cold starts posteriores restauran la
         memoria directamente sin re-ejecutar esta función (~5-10s vs ~40-60s).
         """
         import torch
-        from compel import Compel, ReturnedEmbeddingsType
-        from diffusers import (
-            AutoencoderKL,
-            AutoPipelineForText2Image,
-            EulerAncestralDiscreteScheduler,
-            StableDiffusionXLInpaintPipeline,
-            StableDiffusionXLPipeline,
-        )
+        from diffusers import AutoencoderKL, AutoPipelineForText2Image
 
         from config.constants import SDXL_VAE_HF_ID
 
         t0_load = time.perf_counter()
         checkpoint_path = get_checkpoint_path()
 
-        # VAE fp16-fix evita borrosidad y NaN en decodificado SDXL
-        vae = AutoencoderKL.from_pretrained(
-            SDXL_VAE_HF_ID,
-            torch_dtype=torch.float16,
-        )
-
-        # Pipeline principal txt2img
-        self.pipe = StableDiffusionXLPipeline.from_single_file(
+        # Pipeline principal txt2img (desde la cache convertida en el Volume si
+        # existe: los safetensors de UNet, text encoders y VAE se leen en paralelo
+        # directamente a la GPU y los módulos se montan según terminan). VAE
+        # fp16-fix evita borrosidad y NaN en decodificado SDXL.
+        t0_pipe = time.perf_counter()
+        self.pipe, pipe_source = load_sdxl_pipeline(
             checkpoint_path,
             torch_dtype=torch.float16,
-            use_safetensors=True,
-            vae=vae,
-        )
-        self.pipe.scheduler = EulerAncestralDiscreteScheduler.from_config(
-            self.pipe.scheduler.config
+            vae_loader=lambda: AutoencoderKL.from_pretrained(
+                SDXL_VAE_HF_ID, torch_dtype=torch.float16
+            ),
+            device="cuda",
         )
-        self.pipe = self.pipe.to("cuda")
+        print(f"Pipeline txt2img ({pipe_source}) en {time.perf_counter() - t0_pipe:.2f}s")
+        # Identidad del checkpoint (manifest del Volume; ya verificado al resolverlo)
+        self._checkpoint_id = get_checkpoint_id(checkpoint_path)
+        # Una instancia por pipeline y scheduler, a partir de la config del checkpoint
+        scheduler_config = self.pipe.scheduler.config
+        self._schedulers = {"txt2img": build_schedulers(scheduler_config)}
+        self.pipe.scheduler = self._schedulers["txt2img"][DEFAULT_SCHEDULER]
         self.pipe.set_progress_bar_config(disable=True)
 
-        # Compel: pesos de prompt (word:1.2), [word] estilo Replicate
-        self.compel = Compel(
-            tokenizer=[self.pipe.tokenizer, self.pipe.tokenizer_2],
-            text_encoder=[self.pipe.text_encoder, self.pipe.text_encoder_2],
-            returned_embeddings_type=ReturnedEmbeddingsType.PENULTIMATE_HIDDEN_STATES_NON_NORMALIZED,
-            requires_pooled=[False, True],
-            truncate_long_prompts=False,
+        # Cache LRU de embeddings en GPU: re-rolls y negative fijo no re-encodean
+        cache_mb = int(
+            os.environ.get("PROMPT_EMBED_CACHE_MB", PROMPT_EMBED_CACHE_MAX_MB)
         )
+        self.embed_cache = EmbeddingCache(max_bytes=cache_mb * 1024 * 1024)
+
+        # Cache por chunk (token ids) del encoder. Los chunks constantes se
+        # fijan aquí y quedan capturados en el GPU snapshot.
+        chunk_mb = int(
+            os.environ.get("CHUNK_EMBED_CACHE_MB", CHUNK_EMBED_CACHE_MAX_MB)
+        )
+        self.chunk_cache = EmbeddingCache(max_bytes=chunk_mb * 1024 * 1024)
+        n_chunks = prewarm_chunk_cache(
+            self.pipe,
+            [
+                REPLICATE_POST_PROMPT,
+                REPLICATE_PRE_NEGATIVE,
+                REPLICATE_PRE_NEGATIVE + DEFAULT_USER_NEGATIVE,
+                DEFAULT_NEGATIVE,
+            ],
+            self.chunk_cache,
+        )
+        print(f"Chunk cache: {n_chunks} chunks constantes precalculados.")
 
         # PAG (Perturbed-Attention Guidance): mejora estructura cuando pag_scale > 0
+        self._schedulers["pag"] = build_schedulers(scheduler_config)
         self.pipe_pag = AutoPipelineForText2Image.from_pipe(
-            self.pipe, enable_pag=True, pag_applied_layers=["mid"]
+            self.pipe,
+            enable_pag=True,
+            pag_applied_layers=["mid"],
+            scheduler=self._schedulers["pag"][DEFAULT_SCHEDULER],
         )
 
-        # Inpainting para refinado de caras (ADetailer-style)
+        # Inpainting para refinado de caras (ADetailer-style). Comparte UNet,
+        # text encoders y VAE con self.pipe: sin segundo parseo del checkpoint
+        # ni pesos duplicados en VRAM; solo los schedulers son instancias propias.
         enable_face_refine = os.environ.get(
             "ENABLE_FACE_REFINEMENT", "1"
         ).strip().lower() in ("1", "true", "yes")
         self.pipe_inpaint = None
         if enable_face_refine:
             try:
-                self.pipe_inpaint = StableDiffusionXLInpaintPipeline.from_single_file(
-                    checkpoint_path,
-                    torch_dtype=torch.float16,
-                    use_safetensors=True,
-                    vae=vae,
+                t0_inpaint = time.perf_counter()
+                mem_before = torch.cuda.memory_allocated()
+                self._schedulers["inpaint"] = build_schedulers(scheduler_config)
+                self.pipe_inpaint = build_inpaint_pipeline(
+                    self.pipe, self._schedulers["inpaint"][DEFAULT_SCHEDULER]
                 )
-                self.pipe_inpaint.scheduler = EulerAncestralDiscreteScheduler.from_config(
-                    self.pipe_inpaint.scheduler.config
+                shared_bytes = sum(
+                    p.numel() * p.element_size()
+                    for module in (
+                        self.pipe.unet,
+                        self.pipe.text_encoder,
+                        self.pipe.text_encoder_2,
+                    )
+                    for p in module.parameters()
                 )
-                self.pipe_inpaint = self.pipe_inpaint.to("cuda")
-                self.pipe_inpaint.set_progress_bar_config(disable=True)
-            except Exception:
+                print(
+                    f"Inpaint pipeline compartido en "
+                    f"{time.perf_counter() - t0_inpaint:.2f}s, "
+                    f"+{(torch.cuda.memory_allocated() - mem_before) / 2**20:.0f} MB VRAM "
+                    f"(evita {shared_bytes / 2**20:.0f} MB duplicados de UNet + "
+                    f"text encoders y un segundo from_single_file)."
+                )
+            except Exception as e:
+                print(f"Inpaint pipeline no disponible: {e}")
                 self.pipe_inpaint = None
 
         # Warmup: ejecutar un forward pass corto para calentar kernels CUDA.
@@ -142,8 +290,9 @@ class NovaAnimeModel:
 
         print("Warmup: ejecutando forward pass de prueba...")
         try:
-            warmup_embeds, warmup_pooled = self.compel("warmup test")
-            neg_embeds, neg_pooled = self.compel("bad quality")
+            warmup_embeds, neg_embeds, warmup_pooled, neg_pooled = encode_prompt_sdxl(
+                self.pipe, "warmup test", "bad quality", chunk_cache=self.chunk_cache
+            )
             _ = self.pipe_pag(
                 prompt_embeds=warmup_embeds,
                 negative_prompt_embeds=neg_embeds,
@@ -164,7 +313,19 @@ class NovaAnimeModel:
         # Métricas de rendimiento
         self._cold_start_seconds = time.perf_counter() - t0_load
         self._request_count = 0
-        self._inference_times: list[float] = []
+        self._inference_times: deque[float] = deque(maxlen=INFERENCE_TIMES_WINDOW)
+        self._stats_lock = threading.Lock()
+        # Serializa el uso de la GPU (encoders, pipelines) entre hilos de requests
+        self._gpu_lock = threading.RLock()
+        # Memoria para activaciones de un batch (el resto: pesos, caches, margen)
+        budget_gb = float(
+            os.environ.get("NOVA_ACTIVATION_BUDGET_GB", MEMORY_ACTIVATION_BUDGET_GB)
+        )
+        self._activation_budget = int(budget_gb * 1024**3)
+        self._profiler = ProfilerController(
+            PROFILES_DIR,
+            on_saved=lambda: modal.Volume.from_name("nova-anime-cache").commit(),
+        )
 
         # Persistir cache en Volume para futuros cold starts
         try:
@@ -174,6 +335,107 @@ class NovaAnimeModel:
 
         print(f"Snapshot listo. Cold start: {self._cold_start_seconds:.2f}s")
 
+    @modal.enter(snap=False)
+    def start_workers(self) -> None:
+        """Arranca batcher y pool de codificación tras restaurar el snapshot.
+
+        Se hace fuera de ``load`` porque los hilos no se capturan en el snapshot.
+        """
+        self._encode_pool = ThreadPoolExecutor(
+            max_workers=IMAGE_ENCODE_WORKERS, thread_name_prefix="image-encode"
+        )
+        result_mb = int(os.environ.get("RESULT_CACHE_MB", RESULT_CACHE_MAX_MB))
+        self.result_cache = ResultCache(
+            RESULT_CACHE_DIR,
+            max_bytes=result_mb * 1024 * 1024,
+            memory_max_bytes=RESULT_CACHE_MEMORY_MB * 1024 * 1024,
+            commit=lambda: modal.Volume.from_name("nova-anime-cache").commit(),
+        )
+        self._metrics = MetricsWriter(
+            TIMING_DIR,
+            commit=lambda: modal.Volume.from_name("nova-anime-cache").commit(),
+            flush_interval_s=METRICS_FLUSH_INTERVAL_S,
+            flush_max_records=METRICS_FLUSH_MAX_RECORDS,
+        )
+        max_batch = int(os.environ.get("NOVA_BATCH_MAX_SIZE", BATCH_MAX_SIZE))
+        max_wait_ms = float(os.environ.get("NOVA_BATCH_MAX_WAIT_MS", BATCH_MAX_WAIT_MS))
+        self._batcher = None
+        if max_batch > 1:
+            self._batcher = RequestBatcher(
+                self._generate_batch,
+                max_batch=max_batch,
+                max_wait_s=max_wait_ms / 1000.0,
+                size_of=lambda job: job.num_outputs,
+            )
+        # Tras el denoising: detección (CPU) → inpainting (GPU) → pegado y
+        # codificación (CPU). Cada etapa tiene sus hilos, así la CPU de un
+        # request se solapa con la GPU de otros (@modal.concurrent los alimenta).
+        self._postprocess = StagePipeline(
+            [
+                Stage(
+                    "face_detect",
+                    self._stage_face_detect,
+                    workers=FACE_DETECT_WORKERS,
+                    queue_size=POSTPROCESS_QUEUE_SIZE,
+                ),
+                Stage(
+                    "face_inpaint",
+                    self._stage_face_inpaint,
+                    workers=1,
+                    queue_size=POSTPROCESS_QUEUE_SIZE,
+                ),
+                Stage(
+                    "finalize",
+                    self._stage_finalize,
+                    workers=FINALIZE_WORKERS,
+                    queue_size=POSTPROCESS_QUEUE_SIZE,
+                ),
+            ]
+        )
+
+    # ------------------------------------------------------------------
+    # Codificación de prompts
+    # ------------------------------------------------------------------
+    def _encode_prompts(
+        self,
+        full_prompt: str,
+        full_negative: Optional[str],
+        clip_skip: Optional[int],
+    ) -> tuple["torch.Tensor", "torch.Tensor", "torch.Tensor", "torch.Tensor"]:
+        """Codifica prompt y negative consultando antes la cache de embeddings.
+
+        El encoder procesa ambos prompts en un mismo forward (y con el mismo
+        número de chunks), así que se cachea por el par (positivo, negativo).
+        Sin CFG (``full_negative=None``) solo se encodea el positivo.
+
+        Returns:
+            (prompt_embeds, negative_embeds, pooled_positive, pooled_negative)
+        """
+        import torch
+
+        key = ("weighted", clip_skip, full_prompt, full_negative)
+        cached = self.embed_cache.get(key)
+        if cached is None:
+            with self._gpu_lock:
+                prompt_embeds, negative_embeds, pooled_positive, pooled_negative = (
+                    encode_prompt_sdxl(
+                        self.pipe,
+                        full_prompt,
+                        full_negative,
+                        clip_skip=clip_skip,
+                        chunk_cache=self.chunk_cache,
+                    )
+                )
+                # Que el tiempo del encode no se cuele en la etapa de denoising
+                torch.cuda.synchronize()
+            cached = (
+                torch.cat([prompt_embeds, negative_embeds]),
+                torch.cat([pooled_positive, pooled_negative]),
+            )
+            self.embed_cache.put(key, cached)
+        embeds, pooled = cached
+        return embeds[0:1], embeds[1:2], pooled[0:1], pooled[1:2]
+
     # ------------------------------------------------------------------
     # Lógica central de inferencia
     # ------------------------------------------------------------------
@@ -182,30 +444,82 @@ class NovaAnimeModel:
         prompt: str,
         prepend_preprompt: Union[bool, str, None] = True,
         negative_prompt: Optional[str] = None,
-        num_inference_steps: int = DEFAULT_STEPS,
+        num_inference_steps: Optional[int] = None,
+        scheduler: Optional[str] = DEFAULT_SCHEDULER,
         guidance_scale: float = DEFAULT_GUIDANCE,
         guidance_rescale: float = DEFAULT_GUIDANCE_RESCALE,
         clip_skip: Optional[int] = DEFAULT_CLIP_SKIP,
         pag_scale: float = 1.5,
+        cfg_end: float = DEFAULT_CFG_END,
+        pag_end: float = DEFAULT_PAG_END,
         width: int = DEFAULT_WIDTH,
         height: int = DEFAULT_HEIGHT,
         seed: Optional[int] = None,
         num_outputs: int = 1,
         face_yolov9c: bool = True,
+        output_format: str = DEFAULT_OUTPUT_FORMAT,
+        output_quality: int = DEFAULT_OUTPUT_QUALITY,
+        png_compress_level: int = DEFAULT_PNG_COMPRESS_LEVEL,
+        snap_to_bucket: bool = False,
+        resize_back: bool = False,
+        feature_cache_interval: int = DEFAULT_FEATURE_CACHE_INTERVAL,
+        on_step: Optional[Callable[[int, int, PreviewFrame], None]] = None,
+        preview_every: int = PREVIEW_EVERY_STEPS,
+        on_stage: Optional[Callable[[str], None]] = None,
+        inline: bool = False,
         **_: object,
-    ) -> tuple[list[bytes], float, float]:
-        """Genera imágenes: Compel/chunking + PAG + face refine.
+    ) -> tuple[list[bytes], float, float, dict]:
+        """Genera imágenes: prompts ponderados + PAG + face refine.
+
+        ``feature_cache_interval=N`` (N > 1) corre el UNet completo cada N pasos
+        y reutiliza las features profundas en los intermedios (modo rápido).
+
+        ``cfg_end`` / ``pag_end`` (fracción de pasos) cortan CFG y PAG al final
+        del muestreo: a partir de ahí solo corre la rama condicional. Sin CFG
+        (``guidance_scale <= 1`` o ``cfg_end == 0``) el negative ni se encodea.
+
+        Con ``snap_to_bucket`` se genera en el bucket SDXL más cercano y, con
+        ``resize_back``, la salida se redimensiona al tamaño pedido.
+
+        ``on_step(step, total, frame)`` recibe un ``PreviewFrame`` de la x0
+        predicha de la primera imagen cada ``preview_every`` pasos (previews en
+        streaming); esos requests no pasan por el batcher. ``on_stage(nombre)``
+        se llama al empezar cada fase larga.
+
+        Con ``inline`` (requests perfilados) el denoising y el post-proceso
+        corren en este hilo, sin batcher ni pipeline por etapas: ``torch.profiler``
+        solo registra las ops de CPU y los ``record_function`` del hilo donde se
+        inició.
 
         Returns:
-            (lista_de_pngs_bytes, inference_seconds, cold_start_seconds)
+            (lista_de_imagenes_bytes, inference_seconds, cold_start_seconds, stats)
         """
-        import torch
-
         t0_infer = time.perf_counter()
-        request_num = self._request_count
-        is_first = request_num == 0
+        with self._stats_lock:
+            request_num = self._request_count
+            self._request_count += 1
+        # Sin sync de CUDA aquí: fuera del lock de GPU esperaría también el
+        # trabajo de otros requests. Las etapas de GPU sincronizan bajo el lock.
+        timer = StageTimer()
 
         num_outputs = max(1, min(4, num_outputs))
+        output_format = normalize_format(output_format)
+        scheduler = normalize_scheduler_name(scheduler)
+        if num_inference_steps is None:
+            num_inference_steps = default_steps(scheduler)
+        cfg_end = min(1.0, max(0.0, float(cfg_end)))
+        pag_end = min(1.0, max(0.0, float(pag_end)))
+        # Ramas apagadas desde el primer paso: ni se encodean ni entran al batch.
+        # El face refine conserva el guidance_scale pedido.
+        denoise_guidance = guidance_scale
+        if guidance_scale <= 1 or cfg_end == 0:
+            denoise_guidance, cfg_end = 1.0, DEFAULT_CFG_END
+        if pag_scale <= 0 or pag_end == 0:
+            pag_scale, pag_end = 0.0, DEFAULT_PAG_END
+        requested_size = (width, height)
+        if snap_to_bucket:
+            width, height = nearest_bucket(width, height)
+        resize_to = requested_size if resize_back and requested_size != (width, height) else None
 
         # Construir prompts completos con preprompt + post-prompt si corresponde
         full_prompt = prompt
@@ -216,113 +530,459 @@ class NovaAnimeModel:
         elif isinstance(prepend_preprompt, str) and prepend_preprompt.strip():
             full_prompt = prepend_preprompt.strip().rstrip(",") + ", " + prompt
 
-        # Codificar: Compel (rápido) → fallback chunking (prompts >77 tokens)
-        try:
-            prompt_embeds, pooled_positive = self.compel(full_prompt)
-            negative_embeds, pooled_negative = self.compel(full_negative)
-        except Exception:
+        # Cache de resultados: con seed fija el request es determinista
+        result_key = None
+        if seed is not None and seed != -1:
+            result_key = result_cache_key(
+                {
+                    "prompt": full_prompt,
+                    "negative": full_negative,
+                    "steps": num_inference_steps,
+                    "scheduler": scheduler,
+                    "cfg": denoise_guidance,
+                    "refine_cfg": guidance_scale,
+                    "rescale": guidance_rescale,
+                    "clip_skip": clip_skip,
+                    "pag_scale": pag_scale,
+                    "cfg_end": cfg_end,
+                    "pag_end": pag_end,
+                    "width": width,
+                    "height": height,
+                    "seed": seed,
+                    "num_outputs": num_outputs,
+                    "feature_cache_interval": feature_cache_interval,
+                    "face": bool(face_yolov9c and self.pipe_inpaint is not None),
+                    "resize_to": resize_to,
+                    "format": output_format,
+                    "quality": output_quality if output_format != "png" else None,
+                    "checkpoint": self._checkpoint_id,
+                    "code": code_version(),
+                }
+            )
+            cached = self.result_cache.get(result_key)
+            if cached is not None:
+                return self._finish_request(
+                    cached[0],
+                    t0_infer,
+                    request_num,
+                    {"result_cache": "hit"},
+                    num_outputs=num_outputs,
+                    width=width,
+                    height=height,
+                    steps=num_inference_steps,
+                )
+
+        # Codificar (con cache LRU de embeddings)
+        # Contadores del hilo de este request (no los globales, que mezclan
+        # requests concurrentes)
+        with (
+            timer.stage("prompt_encode"),
+            self.embed_cache.track() as embed_counts,
+            self.chunk_cache.track() as chunk_counts,
+        ):
             prompt_embeds, negative_embeds, pooled_positive, pooled_negative = (
-                encode_long_prompt_sdxl(
-                    self.pipe, full_prompt, full_negative, clip_skip=clip_skip
+                self._encode_prompts(
+                    full_prompt, full_negative if denoise_guidance > 1 else None, clip_skip
                 )
             )
+        stats = {}
+        for name, counts in (("embed_cache", embed_counts), ("chunk_cache", chunk_counts)):
+            for k, v in counts.items():
+                stats[f"{name}_{k}"] = v
 
-        # Igualar longitud si difieren (Compel puede generar longitudes distintas)
-        if prompt_embeds.shape[1] != negative_embeds.shape[1]:
-            target_len = max(prompt_embeds.shape[1], negative_embeds.shape[1])
-            if prompt_embeds.shape[1] < target_len:
-                pad = torch.zeros(
-                    prompt_embeds.shape[0],
-                    target_len - prompt_embeds.shape[1],
-                    prompt_embeds.shape[2],
-                    device=prompt_embeds.device,
-                    dtype=prompt_embeds.dtype,
-                )
-                prompt_embeds = torch.cat([prompt_embeds, pad], dim=1)
-            if negative_embeds.shape[1] < target_len:
-                pad = torch.zeros(
-                    negative_embeds.shape[0],
-                    target_len - negative_embeds.shape[1],
-                    negative_embeds.shape[2],
-                    device=negative_embeds.device,
-                    dtype=negative_embeds.dtype,
-                )
-                negative_embeds = torch.cat([negative_embeds, pad], dim=1)
+        # Denoising: agrupado con otros requests compatibles si hay batcher
+        job = _GenerationJob(
+            prompt_embeds=prompt_embeds,
+            negative_embeds=negative_embeds,
+            pooled_positive=pooled_positive,
+            pooled_negative=pooled_negative,
+            num_outputs=num_outputs,
+            seed=seed,
+            num_inference_steps=num_inference_steps,
+            scheduler=scheduler,
+            guidance_scale=denoise_guidance,
+            guidance_rescale=guidance_rescale,
+            pag_scale=pag_scale,
+            width=width,
+            height=height,
+            feature_cache_interval=max(1, int(feature_cache_interval)),
+            cfg_end=cfg_end,
+            pag_end=pag_end,
+        )
+        if on_stage is not None:
+            on_stage("denoise")
+        t0_generate = time.perf_counter()
+        if on_step is not None or inline:
+            images, batch_requests, batch_stages = self._generate_batch(
+                [job], on_step=on_step, preview_every=preview_every
+            )[0]
+        elif self._batcher is not None:
+            images, batch_requests, batch_stages = (
+                self._batcher.submit(job.batch_key(), job).result()
+            )
+        else:
+            images, batch_requests, batch_stages = self._generate_batch([job])[0]
+        stats["batch_requests"] = batch_requests
+        timer.update(batch_stages)
+        # Espera en el batcher y en el lock de GPU: lo que no fue denoising ni decode
+        timer.add(
+            "queue",
+            max(0.0, time.perf_counter() - t0_generate - sum(batch_stages.values())),
+        )
 
-        # Batch: repetir embeddings para num_outputs
-        prompt_embeds = prompt_embeds.repeat(num_outputs, 1, 1)
-        negative_embeds = negative_embeds.repeat(num_outputs, 1, 1)
-        pooled_positive = pooled_positive.repeat(num_outputs, 1)
-        pooled_negative = pooled_negative.repeat(num_outputs, 1)
+        # Refinado de caras (ADetailer-style con inpainting): todas las caras de
+        # todas las imágenes en un único batch
+        refine_embeds = None
+        if face_yolov9c and self.pipe_inpaint is not None:
+            refine_embeds = (prompt_embeds, negative_embeds, pooled_positive, pooled_negative)
+            if guidance_scale > 1 and denoise_guidance <= 1:
+                # Denoising sin CFG pero el refinado sí lo usa: falta el negative
+                with timer.stage("prompt_encode"):
+                    refine_embeds = self._encode_prompts(full_prompt, full_negative, clip_skip)
 
-        generator = None
-        if seed is not None and seed != -1:
-            generator = torch.Generator(device="cuda").manual_seed(seed)
+        # Detección, inpainting, resize y codificación en el pipeline por etapas
+        post = _PostprocessJob(
+            images=images,
+            timer=timer,
+            output_format=output_format,
+            output_quality=output_quality,
+            png_compress_level=png_compress_level,
+            resize_to=resize_to,
+            embeds=refine_embeds,
+            scheduler=scheduler,
+            num_inference_steps=min(20, num_inference_steps),
+            guidance_scale=guidance_scale,
+            seed=seed,
+            on_stage=on_stage,
+        )
+        t0_post = time.perf_counter()
+        busy_before = sum(timer.seconds.values())
+        if inline:
+            out = self._postprocess.run_inline(post).encoded
+        else:
+            out = self._postprocess.submit(post).result().encoded
+        # Espera en las colas de las etapas y en el lock de GPU
+        timer.add(
+            "queue",
+            max(
+                0.0,
+                time.perf_counter() - t0_post - (sum(timer.seconds.values()) - busy_before),
+            ),
+        )
+        stats["output_format"] = output_format
+        stats["generation_size"] = f"{width}x{height}"
+        stats["scheduler"] = scheduler
+        stats.update(timer.as_dict())
+
+        if result_key is not None:
+            self.result_cache.put(
+                result_key, out, extension_for(output_format), {"format": output_format}
+            )
+            stats["result_cache"] = "miss"
+        else:
+            stats["result_cache"] = "bypass"
+
+        return self._finish_request(
+            out,
+            t0_infer,
+            request_num,
+            stats,
+            num_outputs=num_outputs,
+            width=width,
+            height=height,
+            steps=num_inference_steps,
+        )
+
+    def _finish_request(
+        self,
+        out: list[bytes],
+        t0_infer: float,
+        request_num: int,
+        stats: dict,
+        **record_fields: object,
+    ) -> tuple[list[bytes], float, float, dict]:
+        """Cierra el request: tiempos en memoria, registro de métricas y retorno."""
+        inference_seconds = time.perf_counter() - t0_infer
+        with self._stats_lock:
+            self._inference_times.append(inference_seconds)
+        cold_start_for_request = self._cold_start_seconds if request_num == 0 else 0.0
+        stats["request_number"] = request_num + 1
+
+        # Reporte de tiempos: se bufferiza; el volcado y commit van en segundo plano
+        self._metrics.record(
+            inference_seconds,
+            cold_start_for_request,
+            request=request_num + 1,
+            **record_fields,
+            **stats,
+        )
+
+        return (out, inference_seconds, cold_start_for_request, stats)
+
+    def _generate_batch(
+        self,
+        jobs: list[_GenerationJob],
+        on_step: Optional[Callable[[int, int, PreviewFrame], None]] = None,
+        preview_every: int = PREVIEW_EVERY_STEPS,
+    ) -> list[tuple[list["Image.Image"], int, dict[str, float]]]:
+        """Ejecuta el denoising de varios requests como un único batch de UNet.
+
+        Cada request aporta sus embeddings, guidance/PAG scale y generator. Con
+        un solo request se usa exactamente el camino original (un generator,
+        latents generados por el pipeline).
+
+        ``on_step`` (solo con un request) recibe cada ``preview_every`` pasos
+        una proyección RGB barata de la x0 predicha de la primera imagen, con
+        la copia a CPU en curso (``PreviewFrame.wait()`` fuera del lock de la GPU).
+
+        Returns:
+            Por request: (imágenes_PIL, número_de_requests_en_el_batch,
+            segundos_por_etapa) con las etapas ``denoise`` y ``vae_decode`` del
+            batch completo.
+        """
+        import torch
+        from diffusers.utils.torch_utils import randn_tensor
+
+        first = jobs[0]
+        device = self.pipe.device
+
+        def _rows(t: "torch.Tensor", n: int) -> "torch.Tensor":
+            return t.repeat(n, *([1] * (t.ndim - 1)))
 
-        # Seleccionar pipeline (PAG si pag_scale > 0)
-        pipe_to_use = self.pipe_pag if pag_scale > 0 else self.pipe
+        prompt_embeds = torch.cat([_rows(j.prompt_embeds, j.num_outputs) for j in jobs])
+        negative_embeds = torch.cat([_rows(j.negative_embeds, j.num_outputs) for j in jobs])
+        pooled_positive = torch.cat([_rows(j.pooled_positive, j.num_outputs) for j in jobs])
+        pooled_negative = torch.cat([_rows(j.pooled_negative, j.num_outputs) for j in jobs])
+
+        latents = None
+        # Semillas por fila para el ruido Browniano de los schedulers SDE
+        noise_seeds: Optional[list[int]] = None
+        if len(jobs) == 1:
+            generator = None
+            if first.seed is not None and first.seed != -1:
+                generator = torch.Generator(device=device).manual_seed(first.seed)
+                noise_seeds = [first.seed + i for i in range(first.num_outputs)]
+        else:
+            # Un generator por request: latents iniciales y ruido de cada step
+            # (Euler a) salen de la semilla de su propio request.
+            generator, latent_parts, noise_seeds = [], [], []
+            shape = (
+                self.pipe.unet.config.in_channels,
+                first.height // self.pipe.vae_scale_factor,
+                first.width // self.pipe.vae_scale_factor,
+            )
+            for j in jobs:
+                g = torch.Generator(device=device)
+                if j.seed is not None and j.seed != -1:
+                    g.manual_seed(j.seed)
+                else:
+                    g.seed()
+                latent_parts.append(
+                    randn_tensor(
+                        (j.num_outputs, *shape),
+                        generator=g,
+                        device=device,
+                        dtype=prompt_embeds.dtype,
+                    )
+                )
+                generator += [g] * j.num_outputs
+                noise_seeds += [g.initial_seed() + i for i in range(j.num_outputs)]
+            latents = torch.cat(latent_parts)
+
+        guidance = per_sample_scale(
+            [j.guidance_scale for j in jobs for _ in range(j.num_outputs)]
+        )
+        pag = per_sample_scale([j.pag_scale for j in jobs for _ in range(j.num_outputs)])
+
+        # Seleccionar pipeline (PAG si pag_scale > 0) y su instancia del scheduler
+        pipe_name = "pag" if first.pag_scale > 0 else "txt2img"
+        pipe_to_use = self.pipe_pag if first.pag_scale > 0 else self.pipe
+        scheduler = self._schedulers[pipe_name][first.scheduler]
         kwargs = dict(
             prompt_embeds=prompt_embeds,
             negative_prompt_embeds=negative_embeds,
             pooled_prompt_embeds=pooled_positive,
             negative_pooled_prompt_embeds=pooled_negative,
-            num_inference_steps=num_inference_steps,
-            guidance_scale=guidance_scale,
-            width=width,
-            height=height,
+            num_inference_steps=first.num_inference_steps,
+            guidance_scale=guidance,
+            width=first.width,
+            height=first.height,
             generator=generator,
-            guidance_rescale=guidance_rescale if guidance_rescale > 0 else 0.0,
-            original_size=(height, width),
-            target_size=(height, width),
+            latents=latents,
+            guidance_rescale=first.guidance_rescale if first.guidance_rescale > 0 else 0.0,
+            original_size=(first.height, first.width),
+            target_size=(first.height, first.width),
+            output_type="latent",
         )
-        if clip_skip is not None:
-            kwargs["clip_skip"] = clip_skip
-        if pag_scale > 0:
-            kwargs["pag_scale"] = pag_scale
+        if first.pag_scale > 0:
+            kwargs["pag_scale"] = pag
 
-        images = pipe_to_use(**kwargs).images
+        total_steps = first.num_inference_steps
+        step_callbacks: list[Callable] = []
+        tensor_inputs: list[str] = []
+        truncation = GuidanceTruncation(
+            pipe_to_use,
+            total_steps,
+            cfg_end=first.cfg_end if first.guidance_scale > 1 else DEFAULT_CFG_END,
+            pag_end=first.pag_end if first.pag_scale > 0 else DEFAULT_PAG_END,
+        )
+        if truncation.active:
+            step_callbacks.append(truncation)
+            tensor_inputs += TRUNCATION_TENSOR_INPUTS
+        x0 = PredictedX0(scheduler) if on_step is not None else nullcontext()
+        if on_step is not None:
+            every = max(1, int(preview_every))
 
-        # Refinado de caras (ADetailer-style con inpainting)
-        if face_yolov9c and self.pipe_inpaint is not None:
-            images = [
-                refine_faces(
-                    self.pipe_inpaint,
-                    img,
-                    full_prompt,
-                    full_negative,
-                    num_inference_steps=min(20, num_inference_steps),
-                    guidance_scale=guidance_scale,
-                    seed=seed,
-                )
-                for img in images
-            ]
+            def _preview(_pipe, i, _t, callback_kwargs):
+                step = i + 1
+                if step % every == 0 and step < total_steps and x0.latest is not None:
+                    rgb = latents_to_rgb(x0.latest[:1])[0]
+                    on_step(step, total_steps, PreviewFrame(rgb))
+                return callback_kwargs
 
-        # Serializar a PNG bytes
-        out: list[bytes] = []
-        for img in images:
-            buf = BytesIO()
-            img.save(buf, format="PNG")
-            out.append(buf.getvalue())
+            step_callbacks.append(_preview)
+        if step_callbacks:
 
-        inference_seconds = time.perf_counter() - t0_infer
-        self._inference_times.append(inference_seconds)
-        cold_start_for_request = self._cold_start_seconds if is_first else 0.0
-        self._request_count = request_num + 1
+            def _on_step_end(_pipe, i, t, callback_kwargs):
+                for callback in step_callbacks:
+                    callback_kwargs = callback(_pipe, i, t, callback_kwargs)
+                return callback_kwargs
 
-        # Reporte de tiempos → archivo en el Volume
-        try:
-            ts = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
-            with open(TIMING_REPORT_PATH, "a") as f:
-                f.write(
-                    f"{ts} request={self._request_count} "
-                    f"cold_start_s={cold_start_for_request:.2f} "
-                    f"inference_s={inference_seconds:.2f}\n"
-                )
-            modal.Volume.from_name("nova-anime-cache").commit()
-        except Exception:
-            pass
+            kwargs["callback_on_step_end"] = _on_step_end
+            kwargs["callback_on_step_end_tensor_inputs"] = tensor_inputs
+
+        # Tiling/slicing solo si el pico estimado no cabe (nunca a 1024²)
+        memory_plan = plan_memory(
+            first.width,
+            first.height,
+            batch=prompt_embeds.shape[0],
+            pag=first.pag_scale > 0,
+            cfg=first.guidance_scale > 1,
+            budget_bytes=self._activation_budget,
+        )
+        if not memory_plan.is_default:
+            print(
+                f"Plan de memoria {first.width}x{first.height} x{prompt_embeds.shape[0]}: "
+                f"{memory_plan.describe()}"
+            )
+
+        timer = StageTimer(sync=torch.cuda.synchronize)
+        with self._gpu_lock, apply_memory_plan(pipe_to_use, memory_plan):
+            pipe_to_use.scheduler = scheduler
+            # La instancia del scheduler es compartida: las semillas del batch se
+            # fijan con el lock tomado (el batcher y el camino inline/stream
+            # preparan batches a la vez)
+            if hasattr(scheduler, "noise_sampler_seed"):
+                scheduler.noise_sampler_seed = noise_seeds
+            # El corte de PAG guarda los processors aquí, ya con el plan de memoria
+            with timer.stage("denoise"), truncation, x0, feature_cache(
+                pipe_to_use.unet, first.feature_cache_interval
+            ):
+                latents = pipe_to_use(**kwargs).images
+            with timer.stage("vae_decode"):
+                images = self._decode_latents(pipe_to_use, latents)
+
+        results: list[tuple[list["Image.Image"], int, dict[str, float]]] = []
+        offset = 0
+        for j in jobs:
+            results.append(
+                (images[offset : offset + j.num_outputs], len(jobs), dict(timer.seconds))
+            )
+            offset += j.num_outputs
+        return results
+
+    @staticmethod
+    def _decode_latents(pipe, latents: "torch.Tensor") -> list["Image.Image"]:
+        """VAE decode + postproceso a PIL, igual que el final de ``pipe.__call__``.
+
+        Se separa del denoising (``output_type="latent"``) para medir cada etapa.
+        """
+        import torch
+
+        vae = pipe.vae
+        needs_upcast = vae.dtype == torch.float16 and vae.config.force_upcast
+        if needs_upcast:
+            vae.to(dtype=torch.float32)
+        latents = latents.to(next(iter(vae.post_quant_conv.parameters())).dtype)
+        # Fuera de ``pipe.__call__`` no hay no_grad: sin él, postprocess falla en .numpy()
+        with torch.no_grad():
+            image = vae.decode(latents / vae.config.scaling_factor, return_dict=False)[0]
+        if needs_upcast:
+            vae.to(dtype=torch.float16)
+        if getattr(pipe, "watermark", None) is not None:
+            image = pipe.watermark.apply_watermark(image)
+        return pipe.image_processor.postprocess(image, output_type="pil")
+
+    # ------------------------------------------------------------------
+    # Etapas tras el denoising (StagePipeline)
+    # ------------------------------------------------------------------
+    def _stage_face_detect(self, job: _PostprocessJob) -> _PostprocessJob:
+        """CPU: detecta caras en todas las imágenes y planifica los crops."""
+        if job.embeds is None:
+            return job
+        if job.on_stage is not None:
+            job.on_stage("face_refine")
+        with job.timer.stage("face_detect"):
+            faces = [detect_faces(img) for img in job.images]
+            job.crops = plan_face_crops([img.size for img in job.images], faces)
+        return job
+
+    def _stage_face_inpaint(self, job: _PostprocessJob) -> _PostprocessJob:
+        """GPU: un batch de inpainting con todos los crops del request."""
+        if not job.crops:
+            return job
+
+        @contextmanager
+        def gpu_section(batch: int) -> Iterator[None]:
+            # El inpainting corre sobre crops a resolución fija, no sobre la imagen entera
+            memory_plan = plan_memory(
+                FACE_REFINE_RESOLUTION,
+                FACE_REFINE_RESOLUTION,
+                batch=batch,
+                pag=False,
+                cfg=job.guidance_scale > 1,
+                budget_bytes=self._activation_budget,
+            )
+            with self._gpu_lock, apply_memory_plan(self.pipe_inpaint, memory_plan):
+                self.pipe_inpaint.scheduler = self._schedulers["inpaint"][job.scheduler]
+                yield
+
+        with job.timer.stage("face_inpaint"):
+            job.refined = inpaint_face_crops(
+                self.pipe_inpaint,
+                job.images,
+                job.crops,
+                job.embeds,
+                num_inference_steps=job.num_inference_steps,
+                guidance_scale=job.guidance_scale,
+                seed=job.seed,
+                gpu_section=gpu_section,
+            )
+        return job
+
+    def _stage_finalize(self, job: _PostprocessJob) -> _PostprocessJob:
+        """CPU: pega las caras, redimensiona y codifica (PNG/WebP/JPEG)."""
+        images = job.images
+        if job.crops:
+            with job.timer.stage("face_paste"):
+                images = paste_face_crops(images, job.crops, job.refined)
 
-        return (out, inference_seconds, cold_start_for_request)
+        if job.resize_to is not None:
+            from PIL import Image as PILImage
+
+            with job.timer.stage("resize"):
+                images = [img.resize(job.resize_to, PILImage.LANCZOS) for img in images]
+
+        # Serializar en paralelo en el pool de codificación
+        with job.timer.stage("image_encode"):
+            job.encoded = encode_images(
+                images,
+                job.output_format,
+                quality=job.output_quality,
+                compress_level=job.png_compress_level,
+                executor=self._encode_pool,
+            )
+        return job
 
     # ------------------------------------------------------------------
     # Métodos remotos (endpoints Modal)
@@ -333,11 +993,14 @@ class NovaAnimeModel:
         prompt: str,
         prepend_preprompt: Union[bool, str, None] = True,
         negative_prompt: Optional[str] = None,
-        num_inference_steps: int = DEFAULT_STEPS,
+        num_inference_steps: Optional[int] = None,
+        scheduler: Optional[str] = DEFAULT_SCHEDULER,
         guidance_scale: float = DEFAULT_GUIDANCE,
         guidance_rescale: float = DEFAULT_GUIDANCE_RESCALE,
         clip_skip: Optional[int] = DEFAULT_CLIP_SKIP,
         pag_scale: float = 1.5,
+        cfg_end: float = DEFAULT_CFG_END,
+        pag_end: float = DEFAULT_PAG_END,
         width: int = DEFAULT_WIDTH,
         height: int = DEFAULT_HEIGHT,
         seed: Optional[int] = None,
@@ -345,77 +1008,147 @@ class NovaAnimeModel:
         face_yolov9c: bool = True,
         hand_yolov9c: bool = False,
         person_yolov8m_seg: bool = False,
+        output_format: str = DEFAULT_OUTPUT_FORMAT,
+        output_quality: int = DEFAULT_OUTPUT_QUALITY,
+        png_compress_level: int = DEFAULT_PNG_COMPRESS_LEVEL,
+        snap_to_bucket: bool = False,
+        resize_back: bool = False,
+        feature_cache_interval: int = DEFAULT_FEATURE_CACHE_INTERVAL,
     ) -> tuple[list[bytes], dict]:
         """Genera N imágenes y devuelve (lista_bytes, dict_timings)."""
-        images, inference_s, cold_s = self._run_predict(
-            prompt=prompt,
-            prepend_preprompt=prepend_preprompt,
-            negative_prompt=negative_prompt,
-            num_inference_steps=num_inference_steps,
-            guidance_scale=guidance_scale,
-            guidance_rescale=guidance_rescale,
-            clip_skip=clip_skip,
-            pag_scale=pag_scale,
-            width=width,
-            height=height,
-            seed=seed,
-            num_outputs=num_outputs,
-            face_yolov9c=face_yolov9c,
-        )
+        with self._profiler.capture("predict") as profiled:
+            images, inference_s, cold_s, stats = self._run_predict(
+                prompt=prompt,
+                prepend_preprompt=prepend_preprompt,
+                negative_prompt=negative_prompt,
+                num_inference_steps=num_inference_steps,
+                scheduler=scheduler,
+                guidance_scale=guidance_scale,
+                guidance_rescale=guidance_rescale,
+                clip_skip=clip_skip,
+                pag_scale=pag_scale,
+                cfg_end=cfg_end,
+                pag_end=pag_end,
+                width=width,
+                height=height,
+                seed=seed,
+                num_outputs=num_outputs,
+                face_yolov9c=face_yolov9c,
+                output_format=output_format,
+                output_quality=output_quality,
+                png_compress_level=png_compress_level,
+                snap_to_bucket=snap_to_bucket,
+                resize_back=resize_back,
+                feature_cache_interval=feature_cache_interval,
+                inline=profiled,
+            )
         timings = {
             "inference_seconds": round(inference_s, 2),
             "cold_start_seconds": round(cold_s, 2),
-            "request_number": self._request_count,
+            **stats,
         }
         return (images, timings)
 
     @modal.method()
     def predict_one(self, prompt: str, **kwargs) -> tuple[bytes, dict]:
         """Genera una sola imagen y devuelve (bytes, dict_timings)."""
-        images, inference_s, cold_s = self._run_predict(
-            prompt=prompt, num_outputs=1, **kwargs
-        )
+        with self._profiler.capture("predict_one") as profiled:
+            images, inference_s, cold_s, stats = self._run_predict(
+                prompt=prompt, num_outputs=1, inline=profiled, **kwargs
+            )
         timings = {
             "inference_seconds": round(inference_s, 2),
             "cold_start_seconds": round(cold_s, 2),
-            "request_number": self._request_count,
+            **stats,
         }
         return (images[0], timings)
 
+    @modal.method(is_generator=True)
+    def predict_stream(
+        self, prompt: str, preview_every: int = PREVIEW_EVERY_STEPS, **kwargs
+    ) -> Iterator[dict]:
+        """Genera con previews: emite eventos ``status``, ``preview`` y ``result``.
+
+        Los previews son JPEG pequeños de la proyección lineal de la x0 predicha
+        (sin VAE), cada ``preview_every`` pasos. El último evento es
+        ``result`` (imágenes + timings) o ``error``.
+        """
+        events: queue.Queue = queue.Queue()
+        done = object()
+
+        def on_step(step: int, total: int, frame: PreviewFrame) -> None:
+            events.put({"event": "preview", "step": step, "total": total, "frame": frame})
+
+        def on_stage(stage: str) -> None:
+            events.put({"event": "status", "stage": stage})
+
+        def worker() -> None:
+            try:
+                with self._profiler.capture("predict_stream") as profiled:
+                    images, inference_s, cold_s, stats = self._run_predict(
+                        prompt=prompt,
+                        on_step=on_step,
+                        preview_every=preview_every,
+                        on_stage=on_stage,
+                        inline=profiled,
+                        **kwargs,
+                    )
+                timings = {
+                    "inference_seconds": round(inference_s, 2),
+                    "cold_start_seconds": round(cold_s, 2),
+                    **stats,
+                }
+                events.put({"event": "result", "images": images, "timings": timings})
+            except Exception as e:
+                events.put({"event": "error", "detail": str(e)})
+            finally:
+                events.put(done)
+
+        threading.Thread(target=worker, name="predict-stream", daemon=True).start()
+        while (event := events.get()) is not done:
+            # La copia se espera y el JPEG se comprime aquí, fuera del hilo de la GPU
+            if event["event"] == "preview":
+                event["image"] = rgb_to_jpeg(event.pop("frame").wait())
+            yield event
+
     @modal.method()
     def get_timing_report(self) -> str:
-        """Devuelve el reporte completo de tiempos (resumen + detalle por request)."""
+        """Devuelve el reporte de tiempos: p50/p95/p99, resumen por día y últimos requests."""
         try:
-            if not Path(TIMING_REPORT_PATH).exists():
-                return "No hay registros aún. Ejecuta al menos una generación.\n"
-            lines = Path(TIMING_REPORT_PATH).read_text().strip().split("\n")
-            if not lines:
-                return "Reporte vacío.\n"
-            cold_starts: list[float] = []
-            inference_times: list[float] = []
-            for line in lines:
-                if "cold_start_s=" in line and "inference_s=" in line:
-                    try:
-                        parts = line.split()
-                        for p in parts:
-                            if p.startswith("cold_start_s="):
-                                cold_starts.append(float(p.split("=")[1]))
-                            elif p.startswith("inference_s="):
-                                inference_times.append(float(p.split("=")[1]))
-                    except (ValueError, IndexError):
-                        pass
-            n = len(inference_times)
-            total_cold = sum(cold_starts)
-            avg_inf = sum(inference_times) / n if n else 0
-            min_inf = min(inference_times) if inference_times else 0
-            max_inf = max(inference_times) if inference_times else 0
-            summary = (
-                f"=== Reporte de tiempos Nova Anime ===\n"
-                f"Total requests: {n}\n"
-                f"Cold start (solo primer request): {total_cold:.2f}s\n"
-                f"Inferencia: avg={avg_inf:.2f}s min={min_inf:.2f}s max={max_inf:.2f}s\n"
-                f"--- Detalle por request ---\n"
-            )
-            return summary + "\n".join(lines) + "\n"
+            # Volcar lo propio y ver lo que otros contenedores ya hicieron commit
+            self._metrics.flush()
+            try:
+                modal.Volume.from_name("nova-anime-cache").reload()
+            except Exception:
+                pass
+            return build_report(TIMING_DIR)
         except Exception as e:
             return f"Error leyendo reporte: {e}\n"
+
+    @modal.method()
+    def enable_profiler(self, num_requests: int = 1) -> dict:
+        """Perfila con ``torch.profiler`` los próximos ``num_requests`` de este contenedor.
+
+        Las trazas Chrome se guardan en ``PROFILES_DIR`` del Volume. Con varios
+        contenedores activos solo se arma el que recibe esta llamada.
+        """
+        armed = self._profiler.arm(num_requests)
+        return {
+            "armed_requests": armed,
+            "profiles_dir": PROFILES_DIR,
+            "recent_traces": self._profiler.saved[-10:],
+        }
+
+    @modal.exit()
+    def shutdown(self) -> None:
+        """Vacía el buffer de métricas y detiene los hilos de fondo."""
+        if getattr(self, "_batcher", None) is not None:
+            self._batcher.close()
+        if getattr(self, "_postprocess", None) is not None:
+            self._postprocess.close()
+        if getattr(self, "result_cache", None) is not None:
+            self.result_cache.close()
+        if getattr(self, "_metrics", None) is not None:
+            self._metrics.close()
+        if getattr(self, "_encode_pool", None) is not None:
+            self._encode_pool.shutdown(wait=False)
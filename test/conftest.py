@@ -0,0 +1,186 @@
+"""Configuración de pytest: la raíz del repo en sys.path y fixtures compartidas.
+
+Las fixtures que necesitan torch/transformers se saltan si no están instalados.
+"""
+from __future__ import annotations
+
+import re
+import sys
+import zlib
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+TINY_VOCAB = 1000
+TINY_BOS = 1
+TINY_EOS = TINY_VOCAB - 1
+
+
+class WordTokenizer:
+    """Tokenizer de juguete: una palabra o signo → un id estable (crc32)."""
+
+    bos_token_id = TINY_BOS
+    eos_token_id = TINY_EOS
+    model_max_length = 77
+
+    def __call__(self, text, truncation=False, return_tensors="pt", padding=False):
+        import torch
+
+        words = re.findall(r"\w+|[^\w\s]", text.lower())
+        ids = [3 + zlib.crc32(w.encode()) % (TINY_VOCAB - 4) for w in words]
+        return SimpleNamespace(input_ids=torch.tensor([[TINY_BOS, *ids, TINY_EOS]]))
+
+
+class CallCounter:
+    """Cuenta forwards y filas de batch de un ``nn.Module`` con un forward hook.
+
+    Se usa como context manager: el hook se quita al salir.
+    """
+
+    def __init__(self, module) -> None:
+        self.calls = 0
+        self.rows: list[int] = []
+        self._handle = module.register_forward_hook(self._hook)
+
+    def _hook(self, module, args, output) -> None:
+        self.calls += 1
+        self.rows.append(int(args[0].shape[0]) if args else 0)
+
+    def reset(self) -> None:
+        self.calls = 0
+        self.rows.clear()
+
+    def __enter__(self) -> "CallCounter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._handle.remove()
+
+
+@pytest.fixture(scope="session")
+def tiny_text_pipe():
+    """Pipeline mínimo con los dos text encoders CLIP de SDXL en tamaño diminuto."""
+    torch = pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+
+    torch.manual_seed(0)
+
+    def config(hidden: int, **extra):
+        return transformers.CLIPTextConfig(
+            vocab_size=TINY_VOCAB,
+            hidden_size=hidden,
+            intermediate_size=2 * hidden,
+            num_hidden_layers=3,
+            num_attention_heads=4,
+            max_position_embeddings=77,
+            bos_token_id=TINY_BOS,
+            eos_token_id=TINY_EOS,
+            pad_token_id=TINY_EOS,
+            **extra,
+        )
+
+    enc1 = transformers.CLIPTextModel(config(32)).eval()
+    enc2 = transformers.CLIPTextModelWithProjection(config(48, projection_dim=16)).eval()
+    return SimpleNamespace(
+        tokenizer=WordTokenizer(),
+        tokenizer_2=WordTokenizer(),
+        text_encoder=enc1,
+        text_encoder_2=enc2,
+        _execution_device=torch.device("cpu"),
+    )
+
+
+# Vocabulario BPE mínimo (el de los tests de CLIP de transformers)
+_TINY_BPE_VOCAB = [
+    "l", "o", "w", "e", "r", "s", "t", "i", "d", "n", "lo", "l</w>", "w</w>", "r</w>",
+    "t</w>", "low</w>", "er</w>", "lowest</w>", "newer</w>", "wider", "<unk>",
+    "<|startoftext|>", "<|endoftext|>",
+]
+_TINY_BPE_MERGES = "#version: 0.2\nl o\nlo w</w>\ne r</w>\n"
+
+
+def build_tiny_sdxl_pipe(tmp_dir: Path):
+    """StableDiffusionXLPipeline con configs aleatorias diminutas (segundos en CPU)."""
+    import json
+
+    import torch
+    from diffusers import (
+        AutoencoderKL,
+        EulerAncestralDiscreteScheduler,
+        StableDiffusionXLPipeline,
+        UNet2DConditionModel,
+    )
+    from transformers import (
+        CLIPTextConfig,
+        CLIPTextModel,
+        CLIPTextModelWithProjection,
+        CLIPTokenizer,
+    )
+
+    vocab_file = tmp_dir / "vocab.json"
+    merges_file = tmp_dir / "merges.txt"
+    vocab_file.write_text(json.dumps({t: i for i, t in enumerate(_TINY_BPE_VOCAB)}))
+    merges_file.write_text(_TINY_BPE_MERGES)
+    tokenizer = CLIPTokenizer(str(vocab_file), str(merges_file), model_max_length=77)
+
+    torch.manual_seed(0)
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=2,
+        sample_size=32,
+        in_channels=4,
+        out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        attention_head_dim=(2, 4),
+        use_linear_projection=True,
+        addition_embed_type="text_time",
+        addition_time_embed_dim=8,
+        transformer_layers_per_block=(1, 2),
+        projection_class_embeddings_input_dim=80,  # 6 * 8 + pooled 32
+        cross_attention_dim=64,
+        norm_num_groups=1,
+    )
+    vae = AutoencoderKL(
+        block_out_channels=[32, 64],
+        in_channels=3,
+        out_channels=3,
+        down_block_types=["DownEncoderBlock2D"] * 2,
+        up_block_types=["UpDecoderBlock2D"] * 2,
+        latent_channels=4,
+        sample_size=128,
+    )
+    text_config = CLIPTextConfig(
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+        hidden_size=32,
+        intermediate_size=37,
+        num_attention_heads=4,
+        num_hidden_layers=5,
+        pad_token_id=1,
+        vocab_size=1000,
+        hidden_act="gelu",
+        projection_dim=32,
+    )
+    return StableDiffusionXLPipeline(
+        vae=vae,
+        text_encoder=CLIPTextModel(text_config),
+        text_encoder_2=CLIPTextModelWithProjection(text_config),
+        tokenizer=tokenizer,
+        tokenizer_2=tokenizer,
+        unet=unet,
+        scheduler=EulerAncestralDiscreteScheduler(),
+        add_watermarker=False,
+    )
+
+
+@pytest.fixture(scope="session")
+def tiny_sdxl_pipe(tmp_path_factory):
+    """Pipeline SDXL diminuto compartido por la sesión (no mutarlo en los tests)."""
+    pytest.importorskip("torch")
+    pytest.importorskip("diffusers")
+    pytest.importorskip("transformers")
+    return build_tiny_sdxl_pipe(tmp_path_factory.mktemp("tiny-sdxl"))
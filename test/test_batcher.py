@@ -0,0 +1,156 @@
+"""Batching dinámico con un pipeline falso que registra la forma de cada llamada."""
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from core.batcher import RequestBatcher, per_sample_scale
+from core.embedding_cache import EmbeddingCache
+
+
+class FakePipeline:
+    """Devuelve una "imagen" por fila y apunta las filas de cada llamada."""
+
+    def __init__(self, delay_s: float = 0.0) -> None:
+        self.calls: list[list[tuple[str, int]]] = []
+        self.delay_s = delay_s
+        self._lock = threading.Lock()
+
+    def run_batch(self, jobs: list[dict]) -> list[list[str]]:
+        with self._lock:
+            self.calls.append([(job["key"], job["rows"]) for job in jobs])
+        time.sleep(self.delay_s)
+        return [[f"{job['name']}-{i}" for i in range(job["rows"])] for job in jobs]
+
+
+def _job(name: str, key: str = "1024x1024", rows: int = 1) -> dict:
+    return {"name": name, "key": key, "rows": rows}
+
+
+def _rows(job: dict) -> int:
+    return job["rows"]
+
+
+def _submit_all(batcher: RequestBatcher, jobs: list[dict]) -> list[list[str]]:
+    futures = [batcher.submit(job["key"], job) for job in jobs]
+    return [fut.result(timeout=5) for fut in futures]
+
+
+def test_compatible_requests_share_one_call():
+    fake = FakePipeline()
+    batcher = RequestBatcher(fake.run_batch, max_batch=8, max_wait_s=0.2, size_of=_rows)
+    try:
+        results = _submit_all(batcher, [_job("a"), _job("b", rows=2), _job("c")])
+    finally:
+        batcher.close()
+
+    assert fake.calls == [[("1024x1024", 1), ("1024x1024", 2), ("1024x1024", 1)]]
+    # Cada llamante recibe solo sus filas
+    assert results == [["a-0"], ["b-0", "b-1"], ["c-0"]]
+
+
+def test_incompatible_keys_run_separately():
+    fake = FakePipeline()
+    batcher = RequestBatcher(fake.run_batch, max_batch=8, max_wait_s=0.1)
+    try:
+        _submit_all(
+            batcher, [_job("a", "1024x1024"), _job("b", "832x1216"), _job("c", "1024x1024")]
+        )
+    finally:
+        batcher.close()
+
+    shapes = sorted(sorted(call) for call in fake.calls)
+    assert shapes == [[("1024x1024", 1), ("1024x1024", 1)], [("832x1216", 1)]]
+
+
+def test_max_batch_splits_rows():
+    fake = FakePipeline()
+    batcher = RequestBatcher(fake.run_batch, max_batch=3, max_wait_s=0.2, size_of=_rows)
+    try:
+        _submit_all(batcher, [_job("a", rows=2), _job("b", rows=2), _job("c", rows=1)])
+    finally:
+        batcher.close()
+
+    assert [sum(rows for _, rows in call) for call in fake.calls] == [2, 3]
+
+
+def test_lone_request_waits_at_most_max_wait():
+    fake = FakePipeline()
+    batcher = RequestBatcher(fake.run_batch, max_batch=8, max_wait_s=0.05)
+    try:
+        t0 = time.monotonic()
+        batcher.submit("k", _job("a", "k")).result(timeout=5)
+        elapsed = time.monotonic() - t0
+    finally:
+        batcher.close()
+    assert elapsed < 0.5
+
+
+def test_error_reaches_every_caller():
+    def boom(jobs):
+        raise RuntimeError("OOM")
+
+    batcher = RequestBatcher(boom, max_batch=4, max_wait_s=0.1)
+    try:
+        futures = [batcher.submit("k", _job(n, "k")) for n in "ab"]
+        for fut in futures:
+            with pytest.raises(RuntimeError, match="OOM"):
+                fut.result(timeout=5)
+    finally:
+        batcher.close()
+
+
+def test_concurrent_callers_are_batched():
+    fake = FakePipeline(delay_s=0.05)
+    batcher = RequestBatcher(fake.run_batch, max_batch=4, max_wait_s=0.2)
+    try:
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda n: batcher.submit("k", _job(n, "k")).result(), "abcd"))
+    finally:
+        batcher.close()
+    assert results == [["a-0"], ["b-0"], ["c-0"], ["d-0"]]
+    assert len(fake.calls) == 1
+
+
+def test_per_sample_scale_rows_in_both_orders():
+    torch = pytest.importorskip("torch")
+
+    assert per_sample_scale([5.0, 5.0]) == 5.0
+    scale = per_sample_scale([1.0, 2.0, 3.0])
+    x = torch.ones(3, 2, 4)
+    expected = torch.tensor([1.0, 2.0, 3.0]).view(3, 1, 1).expand(3, 2, 4)
+    assert torch.equal(scale * x, expected)
+    assert torch.equal(x * scale, expected)
+    assert torch.equal(torch.mul(x, scale), expected)
+    # Comparaciones de diffusers (do_classifier_free_guidance) usan la fila 0
+    assert scale > 0.5 and not scale > 1
+    with pytest.raises(TypeError):
+        x / scale
+
+
+def test_cache_track_counts_only_current_thread():
+    cache = EmbeddingCache(max_bytes=1 << 20)
+    started = threading.Event()
+    stop = threading.Event()
+
+    def other_request():
+        with cache.track():
+            started.set()
+            while not stop.is_set():
+                cache.get("otro")
+
+    thread = threading.Thread(target=other_request)
+    thread.start()
+    started.wait()
+    try:
+        with cache.track() as counts:
+            cache.get("mio")
+    finally:
+        stop.set()
+        thread.join()
+
+    assert counts == {"hits": 0, "misses": 1, "evictions": 0}
+    assert cache.stats()["misses"] > 1
@@ -0,0 +1,114 @@
+"""Manifest del checkpoint: hash solo cuando hace falta y checkpoints corruptos."""
+from __future__ import annotations
+
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from core import checkpoint
+
+CONTENT = b"safetensors" * 1000
+
+
+@pytest.fixture
+def volume(tmp_path, monkeypatch):
+    """Volume y manifest en ``tmp_path``; cuenta los hashes calculados."""
+    cache_dir = tmp_path / "checkpoint"
+    cache_dir.mkdir()
+    monkeypatch.setattr(checkpoint, "MODEL_CACHE_DIR", str(cache_dir))
+    monkeypatch.setattr(checkpoint, "CHECKPOINT_MANIFEST_PATH", str(cache_dir / "manifest.json"))
+    monkeypatch.setattr(checkpoint, "LOCAL_CHECKPOINT_IN_IMAGE", str(tmp_path / "no-image"))
+    for var in ("CHECKPOINT_PATH", "CHECKPOINT_URL", "NOVA_ANIME_HF_FILENAME"):
+        monkeypatch.delenv(var, raising=False)
+
+    hashes: list[str] = []
+    sha256_file = checkpoint._sha256_file
+
+    def counting(path: str) -> str:
+        hashes.append(path)
+        return sha256_file(path)
+
+    monkeypatch.setattr(checkpoint, "_sha256_file", counting)
+    return SimpleNamespace(dir=cache_dir, hashes=hashes)
+
+
+def _manifest(volume) -> dict:
+    return json.loads((volume.dir / "manifest.json").read_text())
+
+
+def _touch(path, delta: float = 10.0) -> None:
+    st = os.stat(path)
+    os.utime(path, (st.st_atime, st.st_mtime + delta))
+
+
+def test_hash_only_when_size_or_mtime_change(volume, tmp_path, monkeypatch):
+    ckpt = tmp_path / "model.safetensors"
+    ckpt.write_bytes(CONTENT)
+    monkeypatch.setenv("CHECKPOINT_PATH", str(ckpt))
+
+    assert checkpoint.get_checkpoint_path() == str(ckpt)
+    first = _manifest(volume)
+    assert checkpoint.get_checkpoint_path() == str(ckpt)
+    assert len(volume.hashes) == 1
+
+    # Mismo contenido con otro mtime: se rehashea una vez y solo se apunta el mtime
+    _touch(ckpt)
+    assert checkpoint.get_checkpoint_id(str(ckpt)) == first["sha256"]
+    second = _manifest(volume)
+    assert second["mtime"] == os.stat(ckpt).st_mtime != first["mtime"]
+    assert second["verified_at"] == first["verified_at"]
+    checkpoint.get_checkpoint_path()
+    assert len(volume.hashes) == 2
+
+
+def test_same_size_different_content_raises(volume, tmp_path, monkeypatch):
+    ckpt = tmp_path / "model.safetensors"
+    ckpt.write_bytes(CONTENT)
+    monkeypatch.setenv("CHECKPOINT_PATH", str(ckpt))
+    checkpoint.get_checkpoint_path()
+    before = _manifest(volume)
+
+    ckpt.write_bytes(CONTENT[::-1])
+    _touch(ckpt)
+    with pytest.raises(RuntimeError, match="cambió de contenido"):
+        checkpoint.get_checkpoint_path()
+    assert _manifest(volume) == before  # el manifest no adopta el fichero cambiado
+
+
+def test_corrupt_download_is_downloaded_again(volume, monkeypatch):
+    monkeypatch.setenv("CHECKPOINT_URL", "https://example.com/model.safetensors")
+    downloads: list[str] = []
+
+    def fake_download(url, dest, headers=None):
+        downloads.append(url)
+        with open(dest, "wb") as f:
+            f.write(CONTENT)
+        return dest
+
+    monkeypatch.setattr("core.downloader.download", fake_download)
+    cached = volume.dir / "model.safetensors"
+
+    assert checkpoint.get_checkpoint_path() == str(cached)
+    sha256 = _manifest(volume)["sha256"]
+    assert len(downloads) == 1
+
+    # Bit rot en el Volume: mismo tamaño, otro contenido y otro mtime
+    cached.write_bytes(CONTENT[:-1] + b"X")
+    _touch(cached)
+    assert checkpoint.get_checkpoint_path() == str(cached)
+    assert len(downloads) == 2
+    assert cached.read_bytes() == CONTENT
+    assert _manifest(volume)["sha256"] == sha256
+
+
+def test_source_change_keeps_hash(volume, tmp_path, monkeypatch):
+    ckpt = tmp_path / "model.safetensors"
+    ckpt.write_bytes(CONTENT)
+    monkeypatch.setenv("CHECKPOINT_PATH", str(ckpt))
+    checkpoint.get_checkpoint_path()
+
+    assert checkpoint._record(str(ckpt), "local")["source"] == "local"
+    assert _manifest(volume)["source"] == "local"
+    assert len(volume.hashes) == 1
@@ -0,0 +1,204 @@
+"""Descargas contra un ``http.server`` local con soporte de ``Range``."""
+from __future__ import annotations
+
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from core import downloader
+
+PAYLOAD = random.Random(0).randbytes(1_000_003)  # no múltiplo del trozo
+CHUNK = 64 * 1024
+FLAKY_DELAY_S = 0.1
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Sirve ``PAYLOAD`` en ``/file`` (con Range) y ``/plain`` (sin Range).
+
+    ``/flaky`` es ``/file`` lento (``FLAKY_DELAY_S`` por trozo) con un 500 en el
+    segundo trozo.
+    """
+
+    def do_GET(self):
+        server = self.server
+        entry = (self.path, self.headers.get("Range"), self.headers.get("Authorization"))
+        with server.lock:
+            server.requests.append(entry)
+        if self.path == "/redirect":
+            self.send_response(302)
+            self.send_header("Location", f"http://localhost:{server.server_port}/file")
+            self.end_headers()
+            return
+        match = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range") or "")
+        if self.path == "/flaky" and match and match.group(2) != "0":
+            if int(match.group(1)) == CHUNK:
+                self.send_error(500)
+                return
+            time.sleep(FLAKY_DELAY_S)
+        if self.path in ("/file", "/flaky") and match:
+            start, end = int(match.group(1)), min(int(match.group(2)), len(PAYLOAD) - 1)
+            body = PAYLOAD[start : end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(PAYLOAD)}")
+        else:
+            body = PAYLOAD
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    httpd.requests = []
+    httpd.lock = threading.Lock()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield httpd
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def _url(server, path: str) -> str:
+    return f"http://127.0.0.1:{server.server_port}{path}"
+
+
+def _chunk_ranges(server) -> list[str]:
+    return sorted(r for path, r, _ in server.requests if path == "/file" and r != "bytes=0-0")
+
+
+def test_parallel_download(server, tmp_path):
+    dest = tmp_path / "model.safetensors"
+    downloader.download(_url(server, "/file"), str(dest), chunk_size=CHUNK, workers=4)
+
+    assert dest.read_bytes() == PAYLOAD
+    num_chunks = -(-len(PAYLOAD) // CHUNK)
+    assert len(_chunk_ranges(server)) == num_chunks
+    # Sin restos del progreso
+    assert sorted(os.listdir(tmp_path)) == ["model.safetensors"]
+
+
+def test_resume_fetches_only_missing_chunks(server, tmp_path):
+    dest = tmp_path / "model.safetensors"
+    part = tmp_path / "model.safetensors.part"
+    done = [0, 2, 5]
+    data = bytearray(len(PAYLOAD))
+    for i in done:
+        data[i * CHUNK : (i + 1) * CHUNK] = PAYLOAD[i * CHUNK : (i + 1) * CHUNK]
+    part.write_bytes(bytes(data))
+    (tmp_path / "model.safetensors.part.json").write_text(
+        json.dumps({"total": len(PAYLOAD), "chunk_size": CHUNK, "done": done})
+    )
+
+    downloader.download(_url(server, "/file"), str(dest), chunk_size=CHUNK, workers=2)
+
+    assert dest.read_bytes() == PAYLOAD
+    fetched = _chunk_ranges(server)
+    assert len(fetched) == -(-len(PAYLOAD) // CHUNK) - len(done)
+    assert all(f"bytes={i * CHUNK}-" not in r for i in done for r in fetched)
+
+
+def test_stale_progress_is_ignored(server, tmp_path):
+    dest = tmp_path / "model.safetensors"
+    (tmp_path / "model.safetensors.part").write_bytes(b"x" * 10)
+    (tmp_path / "model.safetensors.part.json").write_text(
+        json.dumps({"total": 10, "chunk_size": CHUNK, "done": [0]})
+    )
+    downloader.download(_url(server, "/file"), str(dest), chunk_size=CHUNK, workers=2)
+    assert dest.read_bytes() == PAYLOAD
+
+
+def test_sequential_without_range(server, tmp_path):
+    dest = tmp_path / "model.safetensors"
+    downloader.download(_url(server, "/plain"), str(dest), chunk_size=CHUNK, workers=4)
+    assert dest.read_bytes() == PAYLOAD
+    assert [path for path, _, _ in server.requests] == ["/plain"]
+
+
+def test_auth_header_not_sent_to_redirect_host(server, tmp_path):
+    dest = tmp_path / "model.safetensors"
+    downloader.download(
+        _url(server, "/redirect"),
+        str(dest),
+        headers={"Authorization": "Bearer secreto"},
+        chunk_size=CHUNK,
+        workers=2,
+    )
+    assert dest.read_bytes() == PAYLOAD
+    chunk_auth = {
+        auth for path, r, auth in server.requests if path == "/file" and r != "bytes=0-0"
+    }
+    assert chunk_auth == {None}
+
+
+def test_failed_download_leaves_no_dest(tmp_path, monkeypatch):
+    def broken(url, headers, timeout):
+        raise OSError("conexión rechazada")
+
+    monkeypatch.setattr(downloader, "_probe", broken)
+    dest = tmp_path / "model.safetensors"
+    with pytest.raises(OSError):
+        downloader.download("http://127.0.0.1:9/file", str(dest))
+    assert not dest.exists()
+
+
+def test_failed_chunk_cancels_the_rest(server, tmp_path):
+    dest = tmp_path / "model.safetensors"
+    num_chunks = -(-len(PAYLOAD) // CHUNK)
+    with pytest.raises(IOError):
+        downloader.download(
+            _url(server, "/flaky"), str(dest), chunk_size=CHUNK, workers=2, retries=0
+        )
+    assert not dest.exists()
+    # Solo los trozos ya en curso al fallar el segundo, no los 16
+    fetched = [r for path, r, _ in server.requests if path == "/flaky" and r != "bytes=0-0"]
+    assert len(fetched) <= 3 < num_chunks
+    assert (tmp_path / "model.safetensors.part").exists()  # para reanudar
+
+
+class FakeResponse:
+    """Respuesta que apunta el tamaño pedido en cada ``read``."""
+
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+        self.pos = 0
+        self.reads: list[int] = []
+
+    def read(self, size: int) -> bytes:
+        self.reads.append(size)
+        block = self.data[self.pos : self.pos + size]
+        self.pos += len(block)
+        return block
+
+
+def test_memory_ceiling_is_one_block_per_stream(tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, "BLOCK_SIZE", 4096)
+    resp = FakeResponse(PAYLOAD[:100_000])
+    path = tmp_path / "out"
+    with open(path, "wb+") as f:
+        written = downloader._stream_to(resp, f.fileno(), 0, 100_000)
+    assert written == 100_000
+    assert max(resp.reads) == 4096
+    assert path.read_bytes() == PAYLOAD[:100_000]
+
+    with open(path, "wb+") as f, pytest.raises(IOError, match="incompleta"):
+        downloader._stream_to(FakeResponse(b"abc"), f.fileno(), 0, 10)
+
+    stop = threading.Event()
+    stop.set()
+    resp = FakeResponse(PAYLOAD[:100_000])
+    with open(path, "wb+") as f, pytest.raises(IOError, match="cancelada"):
+        downloader._stream_to(resp, f.fileno(), 0, 100_000, stop)
+    assert resp.reads == []
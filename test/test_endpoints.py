@@ -0,0 +1,247 @@
+"""Tier web: imports sin GPU, huecos de generación (429), plazos (504) y SSE."""
+from __future__ import annotations
+
+import asyncio
+import base64
+import json
+import subprocess
+import sys
+import textwrap
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Lo que no está en ``web_image``
+GPU_ONLY = ("torch", "diffusers", "transformers", "accelerate", "safetensors", "numpy", "cv2")
+IMPORT_BUDGET_S = 10.0
+
+_WEB_IMPORT_SCRIPT = textwrap.dedent(
+    """
+    import json, sys, time
+
+    class BlockGpuDeps:
+        def find_spec(self, name, path=None, target=None):
+            if name.split(".")[0] in {blocked!r}:
+                raise ImportError(f"{{name}} no está en web_image")
+            return None
+
+    sys.meta_path.insert(0, BlockGpuDeps())
+    t0 = time.perf_counter()
+    from api.endpoints import fastapi_app
+    web = fastapi_app.local()
+    elapsed = time.perf_counter() - t0
+    print(json.dumps({{
+        "elapsed_s": elapsed,
+        "routes": sorted(r.path for r in web.routes),
+        "modules": sorted(sys.modules),
+    }}))
+    """
+)
+
+
+def test_web_tier_imports_without_gpu_dependencies():
+    pytest.importorskip("modal")
+    pytest.importorskip("fastapi")
+    result = subprocess.run(
+        [sys.executable, "-c", _WEB_IMPORT_SCRIPT.format(blocked=set(GPU_ONLY))],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+
+    modules = set(report["modules"])
+    assert "model.nova_anime" not in modules
+    assert not {m for m in modules if m.split(".")[0] in GPU_ONLY}
+    assert {"/predict", "/predict/stream", "/health"} <= set(report["routes"])
+    assert report["elapsed_s"] < IMPORT_BUDGET_S
+
+
+class FakeModel:
+    """``NovaAnimeModel`` remoto de mentira: ``predict`` y ``predict_stream`` con esperas."""
+
+    delay = 0.0
+    stream_delay = 0.0
+    stream_started = 0
+
+    def __init__(self) -> None:
+        self.predict = SimpleNamespace(remote=SimpleNamespace(aio=self._predict))
+        self.predict_stream = SimpleNamespace(remote_gen=SimpleNamespace(aio=self._stream))
+
+    async def _predict(self, **kwargs):
+        await asyncio.sleep(FakeModel.delay)
+        timings = {"inference_seconds": 0.1, "cold_start_seconds": 0.0, "request_number": 1}
+        return [b"PNG"], timings
+
+    async def _stream(self, preview_every, **kwargs):
+        FakeModel.stream_started += 1
+        yield {"event": "status", "phase": "denoise"}
+        await asyncio.sleep(FakeModel.stream_delay)
+        yield {"event": "preview", "step": 1, "total": 2, "image": b"JPG"}
+        yield {"event": "result", "images": [b"PNG"], "timings": {}}
+
+
+@pytest.fixture
+def make_app(monkeypatch):
+    """Crea la app web con ``max_in_flight`` huecos y el modelo remoto falso."""
+    pytest.importorskip("fastapi")
+    pytest.importorskip("httpx")
+    modal = pytest.importorskip("modal")
+    monkeypatch.setattr(modal.Cls, "from_name", lambda *args, **kwargs: FakeModel)
+    for attr, value in (("delay", 0.0), ("stream_delay", 0.0), ("stream_started", 0)):
+        monkeypatch.setattr(FakeModel, attr, value)
+
+    def make(max_in_flight: int):
+        from api.endpoints import fastapi_app
+
+        monkeypatch.setenv("NOVA_WEB_MAX_IN_FLIGHT", str(max_in_flight))
+        return fastapi_app.local()
+
+    return make
+
+
+def _client(app):
+    import httpx
+
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+def _events(text: str) -> list[tuple[str, dict]]:
+    events = []
+    for block in text.strip().split("\n\n"):
+        kind, data = block.split("\n")
+        events.append((kind.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+
+BODY = {"prompt": "1girl"}
+
+
+def test_concurrent_predicts_run_in_parallel(make_app):
+    FakeModel.delay = 0.2
+    app = make_app(max_in_flight=4)
+
+    async def run():
+        async with _client(app) as client:
+            t0 = time.perf_counter()
+            responses = await asyncio.gather(
+                *(client.post("/predict", json=BODY) for _ in range(4))
+            )
+            return responses, time.perf_counter() - t0
+
+    responses, elapsed = asyncio.run(run())
+    assert [r.status_code for r in responses] == [200] * 4
+    assert responses[0].content == b"PNG"
+    assert elapsed < 4 * FakeModel.delay / 2
+
+
+def test_full_slots_return_429_and_are_released(make_app):
+    FakeModel.delay = 0.3
+    app = make_app(max_in_flight=1)
+
+    async def run():
+        async with _client(app) as client:
+            slow = asyncio.create_task(client.post("/predict", json=BODY))
+            await asyncio.sleep(0.1)
+            rejected = await client.post("/predict", json=BODY)
+            stream_rejected = await client.post("/predict/stream", json=BODY)
+            first = await slow
+            after = await client.post("/predict", json=BODY)
+            return rejected, stream_rejected, first, after
+
+    rejected, stream_rejected, first, after = asyncio.run(run())
+    assert rejected.status_code == stream_rejected.status_code == 429
+    assert rejected.headers["Retry-After"] == "5"
+    assert first.status_code == after.status_code == 200
+
+
+def test_timeout_returns_504_and_releases_slot(make_app, monkeypatch):
+    monkeypatch.setattr("api.endpoints.WEB_REQUEST_TIMEOUT_S", 0.05)
+    FakeModel.delay = 0.3
+    app = make_app(max_in_flight=1)
+
+    async def run():
+        async with _client(app) as client:
+            timed_out = await client.post("/predict", json=BODY)
+            FakeModel.delay = 0.0
+            return timed_out, await client.post("/predict", json=BODY)
+
+    timed_out, after = asyncio.run(run())
+    assert timed_out.status_code == 504
+    assert after.status_code == 200
+
+
+def test_stream_events_and_slot_release(make_app):
+    app = make_app(max_in_flight=1)
+
+    async def run():
+        async with _client(app) as client:
+            streamed = await client.post("/predict/stream", json=BODY)
+            return streamed, await client.post("/predict/stream", json=BODY)
+
+    streamed, again = asyncio.run(run())
+    assert streamed.status_code == again.status_code == 200
+    events = _events(streamed.text)
+    assert [kind for kind, _ in events] == ["status", "preview", "result"]
+    assert base64.b64decode(events[1][1]["image"]) == b"JPG"
+    assert events[2][1]["format"] == "png"
+
+
+def test_stream_deadline_ends_with_error_event(make_app, monkeypatch):
+    monkeypatch.setattr("api.endpoints.WEB_REQUEST_TIMEOUT_S", 0.05)
+    FakeModel.stream_delay = 0.3
+    app = make_app(max_in_flight=1)
+
+    async def run():
+        async with _client(app) as client:
+            streamed = await client.post("/predict/stream", json=BODY)
+            return streamed, await client.post("/predict", json=BODY)
+
+    streamed, after = asyncio.run(run())
+    events = _events(streamed.text)
+    assert [kind for kind, _ in events] == ["status", "error"]
+    assert "superó" in events[1][1]["detail"]
+    assert after.status_code == 200
+
+
+def test_disconnect_before_stream_starts_releases_slot(make_app):
+    """Cliente que se va antes de ``http.response.start``: el generador nunca arranca."""
+    app = make_app(max_in_flight=1)
+    body = json.dumps(BODY).encode()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.4"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/predict/stream",
+        "raw_path": b"/predict/stream",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"content-type", b"application/json"), (b"host", b"test")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("test", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            raise OSError("conexión cerrada por el cliente")
+
+    async def run():
+        with pytest.raises(Exception):
+            await app(scope, receive, send)
+        async with _client(app) as client:
+            return await client.post("/predict", json=BODY)
+
+    after = asyncio.run(run())
+    assert FakeModel.stream_started == 0
+    assert after.status_code == 200
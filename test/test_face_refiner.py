@@ -0,0 +1,123 @@
+"""Refinado de caras: pipeline de inpainting compartido y geometría de crops/máscaras."""
+from __future__ import annotations
+
+import pytest
+
+from core import face_refiner as fr
+
+
+def test_inpaint_pipeline_shares_txt2img_modules(tiny_sdxl_pipe):
+    from diffusers import EulerAncestralDiscreteScheduler
+
+    scheduler = EulerAncestralDiscreteScheduler.from_config(tiny_sdxl_pipe.scheduler.config)
+    pipe_inpaint = fr.build_inpaint_pipeline(tiny_sdxl_pipe, scheduler)
+
+    for name in ("unet", "vae", "text_encoder", "text_encoder_2", "tokenizer", "tokenizer_2"):
+        assert getattr(pipe_inpaint, name) is getattr(tiny_sdxl_pipe, name), name
+    assert pipe_inpaint.scheduler is scheduler
+    assert pipe_inpaint.scheduler is not tiny_sdxl_pipe.scheduler
+
+    # Ningún parámetro nuevo: los pesos de txt2img son los únicos en memoria
+    params = {id(p) for p in tiny_sdxl_pipe.unet.parameters()}
+    assert {id(p) for p in pipe_inpaint.unet.parameters()} == params
+
+
+# --- Geometría de crops, máscaras y pegado (CPU) ------------------------------
+
+
+def test_mask_box_pads_and_clips():
+    assert fr.mask_box((100, 100, 100, 100), (1024, 1024)) == (65, 65, 235, 235)
+    assert fr.mask_box((0, 990, 40, 30), (1024, 1024)) == (0, 976, 54, 1024)
+
+
+@pytest.mark.parametrize(
+    "mask, size, expected",
+    [
+        ((65, 65, 235, 235), (1024, 1024), (22, 22, 277, 277)),  # centrado, x1.5
+        ((0, 0, 50, 50), (1024, 1024), (0, 0, 75, 75)),  # esquina: se desplaza
+        ((1000, 0, 1024, 40), (1024, 1024), (964, 0, 1024, 60)),  # borde derecho
+        ((0, 0, 800, 800), (1024, 512), (144, 0, 656, 512)),  # lado limitado por la imagen
+    ],
+)
+def test_crop_box_is_square_and_inside(mask, size, expected):
+    box = fr.crop_box(mask, size)
+    assert box == expected
+    x1, y1, x2, y2 = box
+    assert x2 - x1 == y2 - y1
+    assert 0 <= x1 and 0 <= y1 and x2 <= size[0] and y2 <= size[1]
+
+
+def test_plan_face_crops_local_mask_coordinates():
+    crops = fr.plan_face_crops(
+        [(1024, 1024), (512, 512)], [[(100, 100, 100, 100)], [(0, 0, 40, 40)]]
+    )
+    assert [c.image_index for c in crops] == [0, 1]
+    first = crops[0]
+    assert first.box == (22, 22, 277, 277) and first.side == 255
+    assert first.mask_box == (43.0, 43.0, 213.0, 213.0)
+    # La máscara siempre cae dentro del crop
+    for c in crops:
+        assert 0 <= c.mask_box[0] < c.mask_box[2] <= c.side
+        assert 0 <= c.mask_box[1] < c.mask_box[3] <= c.side
+
+
+def test_ellipse_masks_binary_and_feathered():
+    np = pytest.importorskip("numpy")
+
+    boxes = np.array([[0, 0, 10, 10], [2, 4, 8, 6]])
+    masks = fr.ellipse_masks(10, boxes)
+    assert masks.shape == (2, 10, 10) and masks.dtype == np.float32
+    assert set(np.unique(masks)) <= {0.0, 1.0}
+    assert masks[0, 5, 5] == 1 and masks[0, 0, 0] == 0
+    # Simétrica y limitada a su caja
+    assert np.array_equal(masks[0], masks[0].T)
+    assert masks[1, :4].sum() == 0 and masks[1, 6:].sum() == 0
+    # Vectorizado = una a una
+    assert np.array_equal(masks[1], fr.ellipse_masks(10, boxes[1])[0])
+
+    soft = fr.ellipse_masks(64, np.array([[0, 0, 64, 64]]), feather=0.2)[0]
+    assert soft[32, 32] == 1 and soft[0, 0] == 0
+    assert ((soft > 0) & (soft < 1)).any()
+    assert np.all((soft > 0) <= (fr.ellipse_masks(64, np.array([[0, 0, 64, 64]]))[0] > 0))
+
+
+def test_paste_back_blends_inside_box_only():
+    np = pytest.importorskip("numpy")
+
+    image = np.full((8, 8, 3), 100, dtype=np.uint8)
+    patch = np.full((4, 4, 3), 200, dtype=np.uint8)
+    alpha = np.array([[0.0, 0.5, 1.0, 1.0]] * 4, dtype=np.float32)
+    out = fr.paste_back(image, patch, (2, 2, 6, 6), alpha)
+
+    assert out.dtype == np.uint8 and out is not image
+    assert np.all(image == 100)  # no modifica la entrada
+    assert out[3, 2].tolist() == [100] * 3
+    assert out[3, 3].tolist() == [150] * 3
+    assert out[3, 5].tolist() == [200] * 3
+    mask = np.zeros((8, 8), dtype=bool)
+    mask[2:6, 2:6] = True
+    assert np.all(out[~mask] == 100)
+
+    gray = fr.paste_back(image[..., 0], patch[..., 0], (2, 2, 6, 6), alpha)
+    assert gray[3, 3] == 150
+
+
+def test_paste_face_crops_touches_only_face_region():
+    np = pytest.importorskip("numpy")
+    from PIL import Image
+
+    images = [Image.new("RGB", (256, 256), (10, 10, 10)), Image.new("RGB", (64, 64))]
+    crops = fr.plan_face_crops([(256, 256), (64, 64)], [[(100, 100, 40, 40)], []])
+    refined = [Image.new("RGB", (768, 768), (250, 250, 250))]
+    out = fr.paste_face_crops(images, crops, refined)
+
+    assert out[1] is images[1]  # sin caras: misma imagen
+    arr = np.asarray(out[0])
+    x1, y1, x2, y2 = crops[0].box
+    assert arr[(y1 + y2) // 2, (x1 + x2) // 2].tolist() == [250] * 3
+    outside = np.ones(arr.shape[:2], dtype=bool)
+    outside[y1:y2, x1:x2] = False
+    assert np.all(arr[outside] == 10)
+    # Borde fundido: hay valores intermedios dentro del crop
+    inside = arr[y1:y2, x1:x2, 0]
+    assert ((inside > 10) & (inside < 250)).any()
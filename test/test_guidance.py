@@ -0,0 +1,154 @@
+"""Corte de CFG/PAG: filas del UNet por paso y attention processors restaurados."""
+from __future__ import annotations
+
+import pytest
+
+from conftest import CallCounter
+from core.guidance import TRUNCATION_TENSOR_INPUTS, GuidanceTruncation, active_steps
+
+torch = pytest.importorskip("torch")
+
+
+def test_active_steps():
+    assert [active_steps(end, 10) for end in (0.0, 0.05, 0.5, 0.81, 1.0, 1.5)] == [
+        0, 1, 5, 9, 10, 10,
+    ]
+
+
+class FakeUnet:
+    """UNet falso: apunta las filas de cada paso y los processors que recibe."""
+
+    def __init__(self) -> None:
+        self.rows: list[int] = []
+        self.attn_processors = {"mid.attn1": "sdpa"}
+
+    def set_attn_processor(self, processors) -> None:
+        self.attn_processors = dict(processors)
+        processors.clear()  # diffusers consume el dict con pop()
+
+
+class FakePipe:
+    """Lo que lee ``GuidanceTruncation`` de un pipeline SDXL (PAG) de diffusers."""
+
+    pag_applied_layers = ["mid"]
+
+    def __init__(self, guidance_scale: float, pag_scale: float) -> None:
+        self.unet = FakeUnet()
+        self._guidance_scale = guidance_scale
+        self._pag_scale = pag_scale
+        self.pag_processor_groups: list[int] = []
+
+    @property
+    def do_classifier_free_guidance(self) -> bool:
+        return self._guidance_scale > 1
+
+    @property
+    def do_perturbed_attention_guidance(self) -> bool:
+        return self._pag_scale > 0
+
+    def _set_pag_attn_processor(self, pag_applied_layers, do_classifier_free_guidance):
+        self.pag_processor_groups.append(2 + int(do_classifier_free_guidance))
+        self.unet.set_attn_processor({"mid.attn1": "pag"})
+
+    def __call__(self, steps: int, callback, batch: int = 2) -> None:
+        """Bucle de denoising mínimo: UNet sobre las filas actuales y callback."""
+        groups = 1 + int(self.do_classifier_free_guidance) + int(
+            self.do_perturbed_attention_guidance
+        )
+        if self.do_perturbed_attention_guidance:
+            self._set_pag_attn_processor(self.pag_applied_layers, self.do_classifier_free_guidance)
+        tensors = {
+            name: torch.arange(groups).repeat_interleave(batch).float().unsqueeze(-1)
+            for name in TRUNCATION_TENSOR_INPUTS
+        }
+        for i in range(steps):
+            self.unet.rows.append(tensors["prompt_embeds"].shape[0])
+            tensors = callback(self, i, None, tensors)
+        self.last_tensors = tensors
+
+
+@pytest.mark.parametrize(
+    "guidance, pag, cfg_end, pag_end, expected",
+    [
+        # CFG: [neg, pos] → [pos]
+        (5.0, 0.0, 0.5, 1.0, [4, 4, 2, 2]),
+        # PAG sin CFG: [pos, perturbada] → [pos]
+        (1.0, 3.0, 1.0, 0.25, [4, 2, 2, 2]),
+        # Ambos, PAG antes: [neg, pos, pag] → [neg, pos] → [pos]
+        (5.0, 3.0, 0.75, 0.5, [6, 6, 4, 2]),
+        # Ambos, CFG antes: [neg, pos, pag] → [pos, pag] → [pos]
+        (5.0, 3.0, 0.25, 0.75, [6, 4, 4, 2]),
+        # Mismo paso: las dos ramas a la vez
+        (5.0, 3.0, 0.5, 0.5, [6, 6, 2, 2]),
+    ],
+)
+def test_unet_rows_per_step(guidance, pag, cfg_end, pag_end, expected):
+    pipe = FakePipe(guidance, pag)
+    with GuidanceTruncation(pipe, 4, cfg_end=cfg_end, pag_end=pag_end) as truncation:
+        assert truncation.active
+        pipe(4, truncation)
+    assert pipe.unet.rows == expected
+    # Siempre queda la rama condicional
+    assert pipe.last_tensors["prompt_embeds"].flatten().tolist() == [
+        float(int(guidance > 1))
+    ] * 2
+
+
+def test_cfg_drop_switches_pag_processor_to_two_groups():
+    pipe = FakePipe(5.0, 3.0)
+    with GuidanceTruncation(pipe, 4, cfg_end=0.5, pag_end=1.0) as truncation:
+        pipe(4, truncation)
+    assert pipe.pag_processor_groups == [3, 2]
+    assert pipe.unet.rows == [6, 6, 4, 4]
+
+
+def test_restores_processors_captured_on_enter():
+    """El snapshot se toma al entrar (bajo el plan de memoria), no al construir."""
+    pipe = FakePipe(5.0, 3.0)
+    truncation = GuidanceTruncation(pipe, 4, cfg_end=1.0, pag_end=0.5)
+    # apply_memory_plan activa attention slicing después de construir el callback
+    pipe.unet.set_attn_processor({"mid.attn1": "sliced"})
+    with truncation:
+        pipe(4, truncation)
+        # Al cortar PAG se vuelve a los processors con slicing
+        assert pipe.unet.attn_processors == {"mid.attn1": "sliced"}
+    assert pipe.unet.attn_processors == {"mid.attn1": "sliced"}
+
+
+def test_restores_processors_on_error():
+    pipe = FakePipe(1.0, 3.0)
+    with pytest.raises(RuntimeError):
+        with GuidanceTruncation(pipe, 4, cfg_end=1.0, pag_end=0.5):
+            pipe._set_pag_attn_processor(["mid"], False)
+            raise RuntimeError("OOM")
+    assert pipe.unet.attn_processors == {"mid.attn1": "sdpa"}
+
+
+def test_tiny_pag_pipeline_rows_and_slicing(tiny_sdxl_pipe):
+    """Pipeline PAG real (diminuto) con attention slicing: filas del UNet y processors."""
+    from diffusers import StableDiffusionXLPAGPipeline
+
+    pipe = StableDiffusionXLPAGPipeline.from_pipe(tiny_sdxl_pipe, pag_applied_layers=["mid"])
+    pipe.set_progress_bar_config(disable=True)
+    default_processors = pipe.unet.attn_processors
+    pipe.enable_attention_slicing("auto")
+    sliced = {name: type(p) for name, p in pipe.unet.attn_processors.items()}
+    try:
+        truncation = GuidanceTruncation(pipe, 4, cfg_end=0.75, pag_end=0.5)
+        with CallCounter(pipe.unet) as unet_calls, truncation:
+            pipe(
+                "a",
+                num_inference_steps=4,
+                guidance_scale=5.0,
+                pag_scale=3.0,
+                height=64,
+                width=64,
+                output_type="latent",
+                callback_on_step_end=truncation,
+                callback_on_step_end_tensor_inputs=TRUNCATION_TENSOR_INPUTS,
+                generator=torch.Generator().manual_seed(0),
+            )
+        assert unet_calls.rows == [3, 3, 2, 1]
+        assert {name: type(p) for name, p in pipe.unet.attn_processors.items()} == sliced
+    finally:
+        pipe.unet.set_attn_processor(default_processors)
@@ -0,0 +1,96 @@
+"""Plan de memoria: tabla de modos por tamaño/batch y activación con un pipeline falso."""
+from __future__ import annotations
+
+import pytest
+
+from core.memory_planner import MemoryPlan, apply_memory_plan, plan_memory
+
+GIB = 1 << 30
+BUDGET = 20 * GIB  # MEMORY_ACTIVATION_BUDGET_GB por defecto (A100-40GB)
+
+
+@pytest.mark.parametrize(
+    "width, height, batch, pag, cfg, expected",
+    [
+        # Tamaños SDXL habituales: nunca se toca nada
+        (1024, 1024, 1, False, True, "default"),
+        (832, 1216, 1, True, True, "default"),
+        (1024, 1024, 4, True, True, "default"),  # 12 filas de UNet, 12 GiB de VAE
+        (2048, 2048, 1, True, True, "default"),  # 12 GiB + 12 GiB por separado
+        # El batch completo no cabe en el VAE ni en el UNet
+        (2048, 2048, 2, True, True, "vae_slicing+attention_slicing"),
+        (2048, 2048, 2, False, False, "vae_slicing"),
+        # Una sola imagen ya no cabe en el VAE: tiling (nunca junto a slicing)
+        (3072, 3072, 1, False, True, "vae_tiling"),
+        (3072, 3072, 2, True, True, "vae_tiling+attention_slicing"),
+    ],
+)
+def test_plan_table(width, height, batch, pag, cfg, expected):
+    plan = plan_memory(width, height, batch=batch, pag=pag, cfg=cfg, budget_bytes=BUDGET)
+    assert plan.describe() == expected
+    assert plan.is_default == (expected == "default")
+
+
+def test_plan_estimates():
+    plan = plan_memory(1024, 1024, batch=2, pag=True, cfg=True, budget_bytes=BUDGET)
+    assert plan.unet_bytes == 6 * GIB  # 2 imágenes x (neg, pos, perturbada)
+    assert plan.vae_bytes == 6 * GIB
+
+    sliced = plan_memory(2048, 2048, batch=2, pag=False, cfg=False, budget_bytes=BUDGET)
+    assert sliced.vae_bytes == 12 * GIB  # una imagen a la vez
+    tiled = plan_memory(3072, 3072, batch=1, pag=False, cfg=True, budget_bytes=BUDGET)
+    assert tiled.vae_bytes == BUDGET
+
+
+def test_smaller_budget_needs_more_modes():
+    modes = [
+        plan_memory(1024, 1024, batch=4, pag=True, cfg=True, budget_bytes=gib * GIB).describe()
+        for gib in (20, 11, 2)
+    ]
+    assert modes == ["default", "vae_slicing+attention_slicing", "vae_tiling+attention_slicing"]
+
+
+class FakeVae:
+    def __init__(self, log: list[str]) -> None:
+        self.log = log
+
+    def enable_tiling(self):
+        self.log.append("enable_tiling")
+
+    def disable_tiling(self):
+        self.log.append("disable_tiling")
+
+    def enable_slicing(self):
+        self.log.append("enable_slicing")
+
+    def disable_slicing(self):
+        self.log.append("disable_slicing")
+
+
+class FakePipe:
+    def __init__(self) -> None:
+        self.log: list[str] = []
+        self.vae = FakeVae(self.log)
+
+    def enable_attention_slicing(self, size):
+        self.log.append(f"enable_attention_slicing:{size}")
+
+    def disable_attention_slicing(self):
+        self.log.append("disable_attention_slicing")
+
+
+def test_default_plan_touches_nothing():
+    pipe = FakePipe()
+    with apply_memory_plan(pipe, MemoryPlan()):
+        pass
+    assert pipe.log == []
+
+
+def test_modes_are_restored_even_on_error():
+    pipe = FakePipe()
+    plan = MemoryPlan(vae_tiling=True, attention_slicing=True)
+    with pytest.raises(RuntimeError):
+        with apply_memory_plan(pipe, plan):
+            assert pipe.log == ["enable_tiling", "enable_attention_slicing:auto"]
+            raise RuntimeError("OOM")
+    assert pipe.log[2:] == ["disable_attention_slicing", "disable_tiling"]
@@ -0,0 +1,110 @@
+"""``NovaAnimeModel._generate_batch`` en CPU con el pipeline SDXL diminuto."""
+from __future__ import annotations
+
+import threading
+import time
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("diffusers")
+pytest.importorskip("torchsde")  # DPM++ SDE Karras
+pytest.importorskip("modal")
+
+from conftest import build_tiny_sdxl_pipe  # noqa: E402
+from core.schedulers import build_schedulers  # noqa: E402
+from model.nova_anime import NovaAnimeModel, _GenerationJob  # noqa: E402
+
+SDE = "DPM++ SDE Karras"
+
+
+class CountingLock:
+    """``RLock`` que cuenta los hilos que han llegado a pedirlo."""
+
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self.waiters = 0
+
+    def __enter__(self) -> "CountingLock":
+        self.waiters += 1
+        self._lock.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._lock.release()
+
+
+@pytest.fixture(scope="module")
+def model(tmp_path_factory):
+    """Instancia sin ``@modal.enter``: solo lo que usa ``_generate_batch``."""
+    pipe = build_tiny_sdxl_pipe(tmp_path_factory.mktemp("tiny-sdxl-model"))
+    pipe.set_progress_bar_config(disable=True)
+    cls = NovaAnimeModel._get_user_cls()
+    instance = cls.__new__(cls)
+    instance.pipe = pipe
+    instance.pipe_pag = None
+    instance._schedulers = {"txt2img": build_schedulers(pipe.scheduler.config)}
+    instance._gpu_lock = threading.RLock()
+    instance._activation_budget = 1 << 40
+    return instance
+
+
+@pytest.fixture(autouse=True)
+def cpu_timer(monkeypatch):
+    """``StageTimer`` sincroniza con CUDA; en CPU no hay nada que esperar."""
+    monkeypatch.setattr(torch.cuda, "synchronize", lambda: None)
+
+
+def _job(model, rows: int, seed: int) -> _GenerationJob:
+    with torch.no_grad():
+        embeds = model.pipe.encode_prompt("1girl, smile", do_classifier_free_guidance=True)
+    positive, negative, pooled_positive, pooled_negative = embeds
+    return _GenerationJob(
+        prompt_embeds=positive,
+        negative_embeds=negative,
+        pooled_positive=pooled_positive,
+        pooled_negative=pooled_negative,
+        num_outputs=rows,
+        seed=seed,
+        num_inference_steps=3,
+        scheduler=SDE,
+        guidance_scale=5.0,
+        guidance_rescale=0.0,
+        pag_scale=0.0,
+        width=64,
+        height=64,
+    )
+
+
+def _pixels(images) -> list[bytes]:
+    return [image.tobytes() for image in images]
+
+
+def test_concurrent_sde_batches_keep_their_noise_seeds(model, monkeypatch):
+    """Dos batches de distinto tamaño preparados a la vez sobre el scheduler compartido."""
+    jobs = {"two": _job(model, rows=2, seed=1), "one": _job(model, rows=1, seed=2)}
+    expected = {name: _pixels(model._generate_batch([job])[0][0]) for name, job in jobs.items()}
+
+    lock = CountingLock()
+    monkeypatch.setattr(model, "_gpu_lock", lock)
+    results, errors = {}, []
+
+    def run(name: str) -> None:
+        try:
+            results[name] = _pixels(model._generate_batch([jobs[name]])[0][0])
+        except Exception as e:  # noqa: BLE001 — se comprueba abajo
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(name,)) for name in jobs]
+    # Con el lock tomado, los dos hilos preparan su batch y esperan a la GPU
+    with lock:
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 30
+        while lock.waiters < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    for thread in threads:
+        thread.join(timeout=60)
+
+    assert not errors
+    assert results == expected
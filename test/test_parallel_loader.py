@@ -0,0 +1,112 @@
+"""Carga paralela del pipeline guardado: mismos pesos que ``from_pretrained`` y tiempos."""
+from __future__ import annotations
+
+import threading
+import time
+
+import pytest
+
+torch = pytest.importorskip("torch")
+diffusers = pytest.importorskip("diffusers")
+pytest.importorskip("accelerate")
+
+from core import parallel_loader  # noqa: E402
+from core.parallel_loader import load_pipeline_parallel  # noqa: E402
+
+MODULES = ("unet", "vae", "text_encoder", "text_encoder_2")
+
+
+@pytest.fixture(scope="module")
+def saved_pipe(tiny_sdxl_pipe, tmp_path_factory):
+    directory = tmp_path_factory.mktemp("tiny-sdxl-saved")
+    # Shards pequeños: varios ficheros por componente, como la cache convertida
+    tiny_sdxl_pipe.save_pretrained(
+        str(directory), safe_serialization=True, max_shard_size="200KB"
+    )
+    return directory
+
+
+def test_matches_saved_pipeline(tiny_sdxl_pipe, saved_pipe):
+    pipe, timings = load_pipeline_parallel(
+        str(saved_pipe), torch_dtype=torch.float16, device=None, workers=4
+    )
+    assert type(pipe) is type(tiny_sdxl_pipe)
+    assert set(timings) >= set(MODULES) | {"tokenizer", "scheduler"}
+    for name in MODULES:
+        module, original = getattr(pipe, name), getattr(tiny_sdxl_pipe, name)
+        assert type(module) is type(original)
+        assert not module.training
+        loaded = module.state_dict()
+        expected = original.state_dict()
+        assert loaded.keys() == expected.keys()
+        for key, tensor in loaded.items():
+            assert tensor.device.type == "cpu", key
+            if tensor.is_floating_point():
+                assert tensor.dtype == torch.float16, key
+            torch.testing.assert_close(tensor, expected[key].to(tensor.dtype), msg=key)
+        # Buffers no persistentes (p. ej. position_ids de CLIP) fuera de meta
+        assert all(b.device.type == "cpu" for b in module.buffers())
+    assert type(pipe.scheduler) is type(tiny_sdxl_pipe.scheduler)
+    assert pipe.scheduler.config.beta_schedule == tiny_sdxl_pipe.scheduler.config.beta_schedule
+    assert pipe.tokenizer("lower").input_ids == tiny_sdxl_pipe.tokenizer("lower").input_ids
+
+
+def test_modules_are_built_on_the_calling_thread(tiny_sdxl_pipe, saved_pipe, monkeypatch):
+    """Solo la lectura va en hilos; construir y asignar pesos, en el hilo principal."""
+    read_threads, build_threads = set(), set()
+    read, build = parallel_loader._read_state_dict, parallel_loader._build_module
+
+    def tracking_read(*args):
+        read_threads.add(threading.current_thread().name)
+        return read(*args)
+
+    def tracking_build(*args):
+        build_threads.add(threading.current_thread().name)
+        return build(*args)
+
+    monkeypatch.setattr(parallel_loader, "_read_state_dict", tracking_read)
+    monkeypatch.setattr(parallel_loader, "_build_module", tracking_build)
+    vae = tiny_sdxl_pipe.vae
+    pipe, _ = load_pipeline_parallel(
+        str(saved_pipe),
+        torch_dtype=torch.float32,
+        device=None,
+        overrides={"vae": lambda: vae},
+    )
+    assert pipe.vae is vae
+    assert build_threads == {threading.current_thread().name}
+    assert read_threads and all(name.startswith("load") for name in read_threads)
+
+
+def test_missing_weights_raise(saved_pipe, tmp_path):
+    import shutil
+
+    broken = tmp_path / "broken"
+    shutil.copytree(saved_pipe, broken)
+    for shard in sorted((broken / "unet").glob("*.safetensors"))[:1]:
+        shard.unlink()
+    with pytest.raises(RuntimeError, match="faltan pesos"):
+        load_pipeline_parallel(str(broken), torch_dtype=torch.float32, device=None)
+
+
+def test_benchmark_against_from_pretrained(saved_pipe, capsys):
+    """Micro-benchmark en CPU: ``from_pretrained`` en serie vs lectura paralela."""
+
+    def timed(fn) -> float:
+        fn()  # calentamiento (caché de disco, imports)
+        t0 = time.perf_counter()
+        fn()
+        return time.perf_counter() - t0
+
+    serial_s = timed(
+        lambda: diffusers.StableDiffusionXLPipeline.from_pretrained(
+            str(saved_pipe), torch_dtype=torch.float16
+        )
+    )
+    parallel_s = timed(
+        lambda: load_pipeline_parallel(
+            str(saved_pipe), torch_dtype=torch.float16, device=None, workers=4
+        )
+    )
+    with capsys.disabled():
+        print(f"\nfrom_pretrained: {serial_s:.2f}s | load_pipeline_parallel: {parallel_s:.2f}s")
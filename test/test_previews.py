@@ -0,0 +1,112 @@
+"""Previews: x0 predicha por scheduler, copia a CPU y coste dentro del denoising."""
+from __future__ import annotations
+
+import time
+
+import pytest
+
+torch = pytest.importorskip("torch")
+diffusers = pytest.importorskip("diffusers")
+
+from core.previews import PredictedX0, PreviewFrame, latents_to_rgb, x0_from_sigma  # noqa: E402
+
+SCHEDULERS = [
+    "EulerAncestralDiscreteScheduler",
+    "EulerDiscreteScheduler",
+    "DDIMScheduler",
+    "DPMSolverMultistepScheduler",
+    "UniPCMultistepScheduler",
+]
+
+
+def _oracle_step(scheduler_name: str, step: int = 3):
+    """Da ``step`` pasos con un "UNet" que predice el ruido exacto de un x0 fijo.
+
+    Devuelve el scheduler, el x0 capturado, el x0 real y los últimos latents.
+    """
+    scheduler = getattr(diffusers, scheduler_name)()
+    scheduler.set_timesteps(10)
+    gen = torch.Generator().manual_seed(0)
+    # En [-1, 1]: DDIM recorta su x0 (clip_sample)
+    x0 = torch.rand(1, 4, 8, 8, generator=gen) * 1.8 - 0.9
+    eps = torch.randn(1, 4, 8, 8, generator=gen)
+
+    with PredictedX0(scheduler) as capture:
+        for t in scheduler.timesteps[:step]:
+            # Mismo ruido en todo el camino: x_t = add_noise(x0, eps, t)
+            noisy = scheduler.add_noise(x0, eps, t.reshape(1))
+            sample = scheduler.step(eps, t, noisy, return_dict=False)[0]
+        latest = capture.latest
+    return scheduler, latest, x0, sample
+
+
+@pytest.mark.parametrize("scheduler_name", SCHEDULERS)
+def test_latest_is_predicted_x0_not_noisy_latents(scheduler_name):
+    scheduler, latest, x0, sample = _oracle_step(scheduler_name)
+    torch.testing.assert_close(latest, x0, atol=1e-4, rtol=1e-4)
+    assert not torch.allclose(sample, x0, atol=1e-2)
+    # Al salir el scheduler vuelve a usar su step de clase
+    assert "step" not in vars(scheduler)
+
+
+@pytest.mark.parametrize(
+    "scheduler_name", ["DPMSolverMultistepScheduler", "UniPCMultistepScheduler"]
+)
+def test_sigma_fallback_matches_scheduler_x0(scheduler_name):
+    """Sin ``pred_original_sample`` el x0 calculado es el que guarda el propio scheduler."""
+    scheduler = getattr(diffusers, scheduler_name)()
+    scheduler.set_timesteps(10)
+    gen = torch.Generator().manual_seed(1)
+    sample = torch.randn(1, 4, 8, 8, generator=gen)
+    for t in scheduler.timesteps[:3]:
+        model_output = torch.randn(1, 4, 8, 8, generator=gen)
+        prev = scheduler.step(model_output, t, sample, return_dict=False)[0]
+        # dpmsolver++ / UniPC predict_x0 guardan la x0 convertida del paso
+        torch.testing.assert_close(
+            x0_from_sigma(scheduler, model_output, sample), scheduler.model_outputs[-1]
+        )
+        sample = prev
+
+
+def test_preview_frame_on_cpu_is_immediate():
+    latents = torch.randn(2, 4, 16, 24)
+    rgb = latents_to_rgb(latents)
+    assert rgb.shape == (2, 16, 24, 3) and rgb.dtype == torch.uint8
+    assert torch.equal(PreviewFrame(rgb[0]).wait(), rgb[0])
+
+
+def test_preview_overhead_in_denoising(tiny_sdxl_pipe, capsys):
+    """Mide el coste de los previews (todos los pasos) frente al denoising completo."""
+    pipe = tiny_sdxl_pipe
+    pipe.set_progress_bar_config(disable=True)
+    frames: list[PreviewFrame] = []
+    preview_s = 0.0
+
+    def on_step_end(_pipe, i, t, callback_kwargs):
+        nonlocal preview_s
+        t0 = time.perf_counter()
+        frames.append(PreviewFrame(latents_to_rgb(capture.latest[:1])[0]))
+        preview_s += time.perf_counter() - t0
+        return callback_kwargs
+
+    with PredictedX0(pipe.scheduler) as capture:
+        t0 = time.perf_counter()
+        pipe(
+            "a",
+            num_inference_steps=4,
+            height=64,
+            width=64,
+            output_type="latent",
+            callback_on_step_end=on_step_end,
+            generator=torch.Generator().manual_seed(0),
+        )
+        total_s = time.perf_counter() - t0
+
+    with capsys.disabled():
+        print(
+            f"\npreviews: {preview_s / len(frames) * 1e3:.2f} ms/preview, "
+            f"{preview_s / total_s:.2%} del denoising ({len(frames)} pasos)"
+        )
+    assert len(frames) == 4
+    assert frames[-1].wait().shape == (32, 32, 3)
+    assert preview_s < 0.05 * total_s
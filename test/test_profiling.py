@@ -0,0 +1,53 @@
+"""Captura con torch.profiler: las ops de CPU solo se ven en el hilo perfilado."""
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from core.profiling import ProfilerController
+from core.stage_pipeline import Stage, StagePipeline
+
+torch = pytest.importorskip("torch")
+
+
+def _gpu_stage(item):
+    with torch.profiler.record_function("fake_inpaint"):
+        return torch.mm(item, item)
+
+
+def _trace_names(controller: ProfilerController, run) -> set[str]:
+    controller.arm(1)
+    with controller.capture("test") as profiled:
+        assert profiled
+        run()
+    with open(controller.saved[-1]) as f:
+        return {event.get("name") for event in json.load(f)["traceEvents"]}
+
+
+def test_inline_stages_appear_in_trace(tmp_path):
+    pipeline = StagePipeline([Stage("inpaint", _gpu_stage)])
+    controller = ProfilerController(str(tmp_path))
+    x = torch.randn(32, 32)
+    try:
+        inline = _trace_names(controller, lambda: pipeline.run_inline(x))
+        threaded = _trace_names(controller, lambda: pipeline.submit(x).result())
+    finally:
+        pipeline.close()
+
+    assert "fake_inpaint" in inline and "aten::mm" in inline
+    # En el hilo de la etapa el profiler no ve las ops de CPU: por eso inline
+    assert "fake_inpaint" not in threaded
+    assert pipeline.stats()["inpaint"]["processed"] == 2
+
+
+def test_capture_consumes_armed_requests(tmp_path):
+    controller = ProfilerController(str(tmp_path))
+    with controller.capture() as profiled:
+        assert not profiled
+    controller.arm(1)
+    with controller.capture() as profiled:
+        assert profiled
+    with controller.capture() as profiled:
+        assert not profiled
+    assert len(controller.saved) == 1
@@ -0,0 +1,219 @@
+"""Encoder de prompts SDXL: pesos, BREAK, clip_skip y un forward por encoder.
+
+Los tests con encoders usan la fixture ``tiny_text_pipe`` (CLIP diminuto, CPU).
+"""
+from __future__ import annotations
+
+import time
+
+import pytest
+
+from conftest import CallCounter, WordTokenizer
+from core import prompt_encoder as pe
+
+LONG_PROMPT = ", ".join(f"word{i} detail{i}" for i in range(60))  # ~180 tokens, 3 chunks
+NEGATIVE = "lowres, bad anatomy, bad hands, watermark"
+
+
+def _per_chunk_reference(pipe, prompt: str, negative: str, layer: int = -2):
+    """Camino anterior: un forward por chunk, por prompt y por encoder."""
+    import torch
+
+    num_chunks = max(
+        len(pe._prompt_chunks(tok, text)[0])
+        for tok in (pipe.tokenizer, pipe.tokenizer_2)
+        for text in (prompt, negative)
+    )
+    outputs = []
+    for text in (prompt, negative):
+        per_encoder = []
+        pooled = None
+        encoders = ((pipe.tokenizer, pipe.text_encoder), (pipe.tokenizer_2, pipe.text_encoder_2))
+        for tok, enc in encoders:
+            chunks = pe._prompt_chunks(tok, text)[0]
+            chunks += [pe._empty_chunk(tok)] * (num_chunks - len(chunks))
+            hidden = []
+            for i, chunk in enumerate(chunks):
+                with torch.no_grad():
+                    out = enc(torch.tensor([chunk]), output_hidden_states=True)
+                hidden.append(out.hidden_states[layer])
+                if i == 0 and enc is pipe.text_encoder_2:
+                    pooled = out[0]
+            per_encoder.append(torch.cat(hidden, dim=1))
+        outputs.append((torch.cat(per_encoder, dim=-1), pooled))
+    (pos, pooled_pos), (neg, pooled_neg) = outputs
+    return pos, neg, pooled_pos, pooled_neg
+
+
+@pytest.mark.parametrize("prompt", ["1girl, smile, cherry blossoms", LONG_PROMPT])
+def test_batched_matches_per_chunk_encoding(tiny_text_pipe, prompt):
+    import torch
+
+    expected = _per_chunk_reference(tiny_text_pipe, prompt, NEGATIVE)
+    got = pe.encode_prompt_sdxl(tiny_text_pipe, prompt, NEGATIVE, clip_skip=2)
+    for g, e in zip(got, expected):
+        assert g.shape == e.shape
+        torch.testing.assert_close(g, e, atol=1e-5, rtol=1e-5)
+
+
+def test_one_forward_per_encoder(tiny_text_pipe):
+    num_chunks = len(pe._prompt_chunks(tiny_text_pipe.tokenizer, LONG_PROMPT)[0])
+    assert num_chunks == 3
+
+    with (
+        CallCounter(tiny_text_pipe.text_encoder) as c1,
+        CallCounter(tiny_text_pipe.text_encoder_2) as c2,
+    ):
+        pe.encode_prompt_sdxl(tiny_text_pipe, LONG_PROMPT, NEGATIVE, clip_skip=2)
+        # 3 chunks positivos + 1 negativo + padding (repetido, se encodea una vez)
+        assert (c1.calls, c2.calls) == (1, 1)
+        assert (c1.rows, c2.rows) == ([5], [5])
+
+        c1.reset()
+        c2.reset()
+        _per_chunk_reference(tiny_text_pipe, LONG_PROMPT, NEGATIVE)
+        assert (c1.calls, c2.calls) == (2 * num_chunks, 2 * num_chunks)
+
+
+# --- Parser de pesos y BREAK -------------------------------------------------
+
+
+def test_parse_weights_and_break():
+    assert pe.parse_prompt_attention("a (b:1.5) [c] BREAK d") == [
+        ("a ", 1.0),
+        ("b", 1.5),
+        (" ", 1.0),
+        ("c", pytest.approx(1 / 1.1)),
+        ("", 1.0),
+        ("BREAK", None),
+        ("d", 1.0),
+    ]
+    assert pe.parse_prompt_attention("((x))") == [("x", pytest.approx(1.21))]
+    assert pe.parse_prompt_attention(r"\(literal\)") == [("(literal)", 1.0)]
+
+
+def test_negative_weight_is_not_a_break():
+    assert pe.parse_prompt_attention("(word:-1) cat") == [("word", -1.0), (" cat", 1.0)]
+
+
+def test_brackets_do_not_scale_break():
+    assert pe.parse_prompt_attention("(a BREAK b:1.2)") == [
+        ("a", pytest.approx(1.2)),
+        ("BREAK", None),
+        ("b", pytest.approx(1.2)),
+    ]
+
+
+def test_chunks_keep_negative_weights_and_split_on_break():
+    pytest.importorskip("torch")
+    tok = WordTokenizer()
+
+    chunks, weights = pe._prompt_chunks(tok, "(word:-1) cat")
+    assert len(chunks) == 1
+    assert weights[0][1:3] == [-1.0, 1.0]
+
+    chunks, weights = pe._prompt_chunks(tok, "(a BREAK b:1.2)")
+    assert len(chunks) == 2
+    assert weights[0][1] == weights[1][1] == pytest.approx(1.2)
+    # "BREAK" nunca llega al tokenizer como palabra
+    break_id = tok("BREAK").input_ids[0, 1].item()
+    assert all(break_id not in chunk for chunk in chunks)
+    assert pe.count_prompt_tokens(tok, "(a BREAK b:1.2)") == 2
+
+
+def test_apply_weights_guards_zero_mean():
+    torch = pytest.importorskip("torch")
+
+    hidden = torch.ones(1, 4, 2)
+    weighted = pe._apply_weights(hidden, [[1.0, -1.0, 1.0, -1.0]])
+    assert torch.isfinite(weighted).all()
+    # Sin reescalar: solo el peso por token
+    assert torch.equal(weighted[0, :, 0], torch.tensor([1.0, -1.0, 1.0, -1.0]))
+
+
+# --- Equivalencias del encoder único -----------------------------------------
+
+
+def test_weights_match_a1111_mean_restoration(tiny_text_pipe):
+    torch = pytest.importorskip("torch")
+    d1 = tiny_text_pipe.text_encoder.config.hidden_size
+
+    plain = pe.encode_prompt_sdxl(tiny_text_pipe, "a b c", None)[0]
+    weighted = pe.encode_prompt_sdxl(tiny_text_pipe, "a (b:1.5) c", None)[0]
+
+    w = torch.ones(1, 77, 1)
+    w[0, 2] = 1.5  # BOS, a, b
+    expected = []
+    for z in (plain[..., :d1], plain[..., d1:]):
+        scaled = z * w
+        expected.append(scaled * (z.mean() / scaled.mean()))
+    torch.testing.assert_close(weighted, torch.cat(expected, dim=-1), atol=1e-5, rtol=1e-5)
+
+
+def test_clip_skip_selects_layer(tiny_text_pipe):
+    torch = pytest.importorskip("torch")
+    enc1 = tiny_text_pipe.text_encoder
+    chunk = pe._prompt_chunks(tiny_text_pipe.tokenizer, "1girl, smile")[0][0]
+    with torch.no_grad():
+        out = enc1(torch.tensor([chunk]), output_hidden_states=True)
+    d1 = enc1.config.hidden_size
+
+    for clip_skip, expected in ((1, out.last_hidden_state), (2, out.hidden_states[-2])):
+        embeds = pe.encode_prompt_sdxl(tiny_text_pipe, "1girl, smile", None, clip_skip)[0]
+        torch.testing.assert_close(embeds[..., :d1], expected, atol=1e-5, rtol=1e-5)
+
+
+def test_chunk_count_comes_from_token_count(tiny_text_pipe):
+    tok = tiny_text_pipe.tokenizer
+    for prompt in ("1girl, smile", LONG_PROMPT):
+        n_tokens = pe.count_prompt_tokens(tok, prompt)
+        embeds = pe.encode_prompt_sdxl(tiny_text_pipe, prompt, NEGATIVE)[0]
+        assert embeds.shape[1] == 77 * -(-n_tokens // pe.CONTENT_TOKENS_PER_CHUNK)
+
+
+def _two_path_reference(pipe, prompt: str, negative: str):
+    """Comportamiento anterior con prompt largo: intento truncado + fallback por chunk."""
+    import torch
+
+    for text in (prompt, negative):
+        encoders = ((pipe.tokenizer, pipe.text_encoder), (pipe.tokenizer_2, pipe.text_encoder_2))
+        for tok, enc in encoders:
+            ids = tok(text).input_ids[:, :77]
+            with torch.no_grad():
+                enc(ids, output_hidden_states=True)  # trabajo descartado por la excepción
+    return _per_chunk_reference(pipe, prompt, negative)
+
+
+def test_micro_benchmark_against_two_path(tiny_text_pipe, capsys):
+    """Micro-benchmark en CPU: encoder único vs intento + fallback por chunk."""
+    pytest.importorskip("torch")
+    rounds = 20
+
+    def timed(fn) -> tuple[float, int]:
+        with (
+            CallCounter(tiny_text_pipe.text_encoder) as c1,
+            CallCounter(tiny_text_pipe.text_encoder_2) as c2,
+        ):
+            fn()  # calentamiento
+            c1.reset()
+            c2.reset()
+            t0 = time.perf_counter()
+            for _ in range(rounds):
+                fn()
+            return (time.perf_counter() - t0) / rounds, (c1.calls + c2.calls) // rounds
+
+    single_s, single_calls = timed(
+        lambda: pe.encode_prompt_sdxl(tiny_text_pipe, LONG_PROMPT, NEGATIVE)
+    )
+    two_path_s, two_path_calls = timed(
+        lambda: _two_path_reference(tiny_text_pipe, LONG_PROMPT, NEGATIVE)
+    )
+    with capsys.disabled():
+        print(
+            f"\nencoder único: {single_s * 1e3:.2f} ms/prompt, {single_calls} forwards | "
+            f"intento + fallback: {two_path_s * 1e3:.2f} ms/prompt, {two_path_calls} forwards"
+        )
+    # Los tiempos solo se informan: en una CPU compartida el reloj no es fiable
+    assert single_calls == 2
+    assert two_path_calls == 4 + 2 * 2 * 3
+    assert single_calls < two_path_calls
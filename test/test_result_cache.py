@@ -0,0 +1,138 @@
+"""Cache de resultados en un Volume de ``tmp_path``: aciertos, LRU por bytes e índice."""
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from core.result_cache import INDEX_NAME, ResultCache, result_cache_key
+
+IMAGE = b"x" * 10
+
+
+@pytest.fixture
+def make_cache(tmp_path):
+    """Crea caches sobre el mismo directorio y los cierra al terminar."""
+    caches: list[ResultCache] = []
+
+    def make(max_bytes: int = 1000, memory_max_bytes: int = 1000) -> ResultCache:
+        cache = ResultCache(str(tmp_path / "results"), max_bytes, memory_max_bytes)
+        caches.append(cache)
+        return cache
+
+    yield make
+    for cache in caches:
+        cache.close()
+
+
+def _key(name: str) -> str:
+    return result_cache_key({"prompt": name, "seed": 1})
+
+
+def _index_keys(cache: ResultCache) -> list[str]:
+    return [key for key, _ in json.loads((cache.directory / INDEX_NAME).read_text())["entries"]]
+
+
+def test_key_is_canonical():
+    assert result_cache_key({"a": 1, "b": 2}) == result_cache_key({"b": 2, "a": 1})
+    assert result_cache_key({"a": 1}) != result_cache_key({"a": 2})
+
+
+def test_hit_from_memory_then_from_volume(make_cache):
+    cache = make_cache()
+    assert cache.get(_key("a")) is None
+    cache.put(_key("a"), [IMAGE, IMAGE], "png", {"format": "png"})
+    images, meta = cache.get(_key("a"))
+    assert images == [IMAGE, IMAGE]
+    assert meta["bytes"] == 20 and meta["format"] == "png"
+    cache.flush()
+
+    # Otro contenedor: memoria vacía, la entrada se lee del Volume
+    other = make_cache()
+    assert other.stats()["memory_entries"] == 0
+    images, _ = other.get(_key("a"))
+    assert images == [IMAGE, IMAGE]
+    assert other.get(_key("b")) is None
+    stats = other.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"], stats["disk_bytes"]) == (1, 1, 1, 20)
+
+
+def test_lru_eviction_by_bytes(make_cache):
+    cache = make_cache(max_bytes=25)
+    for name in ("a", "b"):
+        cache.put(_key(name), [IMAGE], "png")
+    cache.flush()
+    cache.get(_key("a"))  # "b" pasa a ser la menos reciente
+    cache.put(_key("c"), [IMAGE], "png")
+    cache.flush()
+
+    assert cache.stats()["disk_bytes"] == 20
+    assert _index_keys(cache) == [_key("a"), _key("c")]
+    assert not (cache.directory / _key("b")[:2] / _key("b")).exists()
+    assert make_cache(memory_max_bytes=0).get(_key("b")) is None
+
+
+def test_memory_hot_set_is_bounded(make_cache):
+    cache = make_cache(memory_max_bytes=15)
+    cache.put(_key("a"), [IMAGE], "png")
+    cache.put(_key("b"), [IMAGE], "png")
+    assert cache.stats()["memory_entries"] == 1
+    assert cache.stats()["memory_bytes"] == 10
+
+
+def test_startup_reads_index_without_scanning(make_cache, monkeypatch):
+    cache = make_cache()
+    cache.put(_key("a"), [IMAGE], "png")
+    cache.put(_key("b"), [IMAGE, IMAGE], "png")
+    cache.flush()
+
+    def no_scan(self):
+        raise AssertionError("el arranque no debe recorrer los meta.json")
+
+    monkeypatch.setattr(ResultCache, "_rebuild_index", no_scan)
+    other = make_cache()
+    assert other.stats()["entries"] == 2
+    assert other.stats()["disk_bytes"] == 30
+
+
+def test_missing_index_is_rebuilt_in_background(make_cache):
+    cache = make_cache()
+    for name in ("a", "b", "c"):
+        cache.put(_key(name), [IMAGE], "png")
+    cache.flush()
+    (cache.directory / INDEX_NAME).unlink()
+
+    rebuilt = make_cache()
+    rebuilt.flush()
+    assert rebuilt.stats()["entries"] == 3
+    assert rebuilt.stats()["disk_bytes"] == 30
+    assert sorted(_index_keys(rebuilt)) == sorted(_key(n) for n in ("a", "b", "c"))
+
+    (rebuilt.directory / INDEX_NAME).write_text("{no es json")
+    corrupt = make_cache()
+    corrupt.flush()
+    assert corrupt.stats()["entries"] == 3
+
+
+def test_writes_from_other_containers_are_merged(make_cache):
+    first, second = make_cache(), make_cache()
+    first.put(_key("a"), [IMAGE], "png")
+    first.flush()
+    second.put(_key("b"), [IMAGE], "png")
+    second.flush()
+
+    assert _index_keys(second) == [_key("a"), _key("b")]
+    assert make_cache().stats()["entries"] == 2
+
+
+def test_entry_evicted_elsewhere_leaves_the_index(make_cache):
+    cache = make_cache(memory_max_bytes=0)
+    cache.put(_key("a"), [IMAGE], "png")
+    cache.flush()
+    other = make_cache(memory_max_bytes=0)
+    for path in sorted((cache.directory / _key("a")[:2] / _key("a")).iterdir()):
+        path.unlink()
+
+    assert other.get(_key("a")) is None
+    assert other.stats()["entries"] == 0
+    assert other.stats()["disk_bytes"] == 0
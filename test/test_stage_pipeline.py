@@ -0,0 +1,113 @@
+"""Pipeline por etapas con etapas falsas de ``time.sleep`` (CPU, sin torch)."""
+from __future__ import annotations
+
+import threading
+import time
+
+import pytest
+
+from core.stage_pipeline import Stage, StagePipeline
+
+STAGE_S = 0.1
+
+
+def _sleep_stage(name: str, seconds: float = STAGE_S, **kwargs) -> Stage:
+    def fn(item):
+        time.sleep(seconds)
+        return item + [name]
+
+    return Stage(name, fn, **kwargs)
+
+
+def test_overlapping_stages_beat_serial(capsys):
+    items = 5
+    pipeline = StagePipeline([_sleep_stage("gpu"), _sleep_stage("encode")])
+    try:
+        t0 = time.perf_counter()
+        futures = [pipeline.submit([i]) for i in range(items)]
+        results = [f.result(timeout=10) for f in futures]
+        pipelined_s = time.perf_counter() - t0
+    finally:
+        pipeline.close()
+
+    serial_s = items * 2 * STAGE_S
+    with capsys.disabled():
+        print(
+            f"\n{items} items x 2 etapas: {pipelined_s:.2f} s en pipeline "
+            f"vs {serial_s:.2f} s en serie"
+        )
+    assert results == [[i, "gpu", "encode"] for i in range(items)]
+    # Ideal (items + 1) * STAGE_S = 0.6 s
+    assert pipelined_s < 0.8 * serial_s
+    stats = pipeline.stats()
+    assert stats["gpu"]["processed"] == stats["encode"]["processed"] == items
+
+
+def test_cpu_stage_workers_run_in_parallel():
+    pipeline = StagePipeline([_sleep_stage("detect", workers=4)])
+    try:
+        t0 = time.perf_counter()
+        for f in [pipeline.submit([i]) for i in range(4)]:
+            f.result(timeout=10)
+        elapsed = time.perf_counter() - t0
+    finally:
+        pipeline.close()
+    assert elapsed < 2 * STAGE_S
+
+
+def test_full_queues_block_submit():
+    release = threading.Event()
+
+    def blocked(item):
+        release.wait(10)
+        return item
+
+    pipeline = StagePipeline([Stage("gpu", blocked, queue_size=1)])
+    try:
+        pipeline.submit(0)  # en la etapa
+        time.sleep(0.05)
+        pipeline.submit(1)  # en la cola
+        third = threading.Thread(target=pipeline.submit, args=(2,))
+        third.start()
+        third.join(0.2)
+        assert third.is_alive()  # backpressure: no hay sitio en la cola
+        release.set()
+        third.join(5)
+        assert not third.is_alive()
+    finally:
+        release.set()
+        pipeline.close()
+
+
+def test_error_reaches_future_and_skips_later_stages():
+    calls: list[int] = []
+
+    def fail_odd(item):
+        if item % 2:
+            raise ValueError(f"item {item}")
+        return item
+
+    pipeline = StagePipeline([Stage("detect", fail_odd), Stage("encode", calls.append)])
+    try:
+        futures = [pipeline.submit(i) for i in range(4)]
+        with pytest.raises(ValueError, match="item 1"):
+            futures[1].result(timeout=5)
+        futures[0].result(timeout=5)
+        futures[2].result(timeout=5)
+        with pytest.raises(ValueError, match="item 3"):
+            futures[3].result(timeout=5)
+    finally:
+        pipeline.close()
+    assert calls == [0, 2]
+    assert pipeline.stats()["detect"]["errors"] == 2
+
+
+def test_run_inline_and_closed_pipeline():
+    pipeline = StagePipeline([_sleep_stage("a", 0), _sleep_stage("b", 0)])
+    assert pipeline.run_inline([0]) == [0, "a", "b"]
+    pipeline.close()
+    assert pipeline.stats()["a"]["processed"] == 1
+    with pytest.raises(RuntimeError):
+        pipeline.submit([1])
+    with pytest.raises(ValueError):
+        StagePipeline([])